@@ -32,12 +32,12 @@
 import collections
 import os
 import threading
-import time
 
 from sebs.core import Rule, Test, Action, Artifact, DefinitionError
-from sebs.filesystem import Directory
+from sebs.filesystem import Directory, StatCache
 from sebs.helpers import typecheck
 from sebs.command import ArtifactEnumerator
+from sebs.deps_log import parse_dep_file
 from sebs.console import Console, ColoredText
 from sebs.runner import ActionRunner
 
@@ -55,6 +55,8 @@ class _ArtifactEnumeratorImpl(ArtifactEnumerator):
     self.inputs = []
     self.outputs = []
     self.disk_inputs = []
+    # Outputs which the command reads as dependency lists.
+    self.dep_files = []
 
   def add_input(self, artifact):
     self.inputs.append(artifact)
@@ -80,6 +82,61 @@ class _ArtifactEnumeratorImpl(ArtifactEnumerator):
     else:
       return None
 
+  def read_dependencies(self, artifact):
+    if artifact.action is not self.__action:
+      raise DefinitionError("%s is not an output of %s." %
+                            (artifact, self.__action))
+
+    self.dep_files.append(artifact)
+    real_name = artifact.real_name(self.read)
+    if real_name is None:
+      return None
+    root_dir = self.__config.root_dir
+    mtime = root_dir.getmtime_if_exists(real_name)
+    if mtime is None:
+      return None
+
+    # The deps log is only written when the action completes; see
+    # Builder.do_one_action().
+    deps = self.__config.deps_log.lookup(
+        real_name, mtime, root_dir.getsize_if_exists(real_name))
+    if deps is None:
+      deps = parse_dep_file(root_dir.read(real_name))
+    return deps
+
+  def read_includes(self, artifact):
+    self.inputs.append(artifact)
+    return self.__state_map.includes_if_clean(self.__config, artifact)
+
+  def read_disk_includes(self, filename):
+    return self.__config.include_cache.scan(self.__config.root_dir, filename)
+
+class _InputCollector(_ArtifactEnumeratorImpl):
+  """Enumerates an action's inputs without building or recording anything,
+  noting whether any of them couldn't be determined."""
+
+  def __init__(self, state_map, config, action):
+    super(_InputCollector, self).__init__(state_map, config, action)
+    self.complete = True
+
+  def read(self, artifact):
+    result = super(_InputCollector, self).read(artifact)
+    if result is None:
+      self.complete = False
+    return result
+
+  def read_dependencies(self, artifact):
+    result = super(_InputCollector, self).read_dependencies(artifact)
+    if result is None:
+      self.complete = False
+    return result
+
+  def read_includes(self, artifact):
+    result = super(_InputCollector, self).read_includes(artifact)
+    if result is False:
+      self.complete = False
+    return result
+
 class _ArtifactState(object):
   def __init__(self, artifact, root_dir, state_map, config):
     typecheck(artifact, Artifact)
@@ -101,16 +158,18 @@ class _ArtifactState(object):
       assert artifact.action is not None
       self.timestamp = -1
       self.is_dirty = True
-    elif root_dir.exists(real_name):
-      self.timestamp = root_dir.getmtime(real_name)
-      self.is_dirty = self.__decide_if_dirty(state_map)
-    elif artifact.action is not None:
-      # Derived artifact doesn't exist yet.
-      self.timestamp = -1
-      self.is_dirty = True
     else:
-      raise DefinitionError(
-        "The required source file '%s' does not exist." % artifact.filename)
+      timestamp = root_dir.getmtime_if_exists(real_name)
+      if timestamp is not None:
+        self.timestamp = timestamp
+        self.is_dirty = self.__decide_if_dirty(state_map)
+      elif artifact.action is not None:
+        # Derived artifact doesn't exist yet.
+        self.timestamp = -1
+        self.is_dirty = True
+      else:
+        raise DefinitionError(
+          "The required source file '%s' does not exist." % artifact.filename)
 
   def __decide_if_dirty(self, state_map):
     if self.artifact.action is None:
@@ -150,9 +209,9 @@ class _ArtifactState(object):
 
     # Check disk inputs, too.
     for disk_input in action_state.disk_inputs:
-      if not os.path.exists(disk_input):
+      disk_timestamp = state_map.disk_stats.getmtime(disk_input)
+      if disk_timestamp is None:
         return True
-      disk_timestamp = os.path.getmtime(disk_input)
       # See above comment about rounding error.
       if self.timestamp + 1 < disk_timestamp:
         return True
@@ -165,6 +224,26 @@ class _ArtifactState(object):
 
     return False
 
+class _OrderedSet(object):
+  """A set which iterates in insertion order, so that actions which become
+  ready together are started in the order their inputs were listed rather
+  than in an order depending on memory addresses."""
+
+  def __init__(self):
+    self.__items = collections.OrderedDict()
+
+  def add(self, item):
+    self.__items[item] = None
+
+  def __contains__(self, item):
+    return item in self.__items
+
+  def __iter__(self):
+    return iter(self.__items)
+
+  def __len__(self):
+    return len(self.__items)
+
 class _ActionState(object):
   def __init__(self, action, root_dir, state_map, config):
     typecheck(action, Action)
@@ -194,7 +273,7 @@ class _ActionState(object):
 
     # As other ActionStates discover that they are blocked by this, they add
     # themselves to this set.
-    self.blocked = set()
+    self.blocked = _OrderedSet()
 
     self.update_readiness(state_map)
 
@@ -213,7 +292,7 @@ class _ActionState(object):
     enumerator = _ArtifactEnumeratorImpl(state_map, self.config, self.action)
     self.action.command.enumerate_artifacts(enumerator)
 
-    self.blocking = set()
+    self.blocking = _OrderedSet()
     for input in enumerator.inputs:
       input_state = state_map.artifact_state(self.config, input)
 
@@ -237,6 +316,7 @@ class _ActionState(object):
     self.inputs = enumerator.inputs
     self.disk_inputs = enumerator.disk_inputs
     self.outputs = enumerator.outputs
+    self.dep_files = enumerator.dep_files
     return True
 
 class _StateMap(object):
@@ -244,6 +324,10 @@ class _StateMap(object):
     self.__artifacts = {}
     self.__actions = {}
 
+    # Disk inputs (e.g. headers listed in .d files) tend to be shared by many
+    # actions, so we only want to stat each one once per build.
+    self.disk_stats = StatCache()
+
   def artifact_state(self, config, artifact):
     typecheck(artifact, Artifact)
 
@@ -283,18 +367,38 @@ class _StateMap(object):
       return None
     return state.config.root_dir.read(real_name)
 
+  def includes_if_clean(self, config, artifact):
+    """Like read_if_clean(), but returns the artifact's #includes as
+    IncludeCache.scan() would, or False if it is dirty."""
+    state = self.artifact_state(config, artifact)
+    if state.is_dirty:
+      return False
+    real_name = self.real_name(state.config, state.artifact)
+    if real_name is None:
+      return False
+    return state.config.include_cache.scan(state.config.root_dir, real_name)
+
 class Builder(object):
-  def __init__(self, console):
+  def __init__(self, console, max_concurrent_tests = None):
     typecheck(console, Console)
+    typecheck(max_concurrent_tests, int)
 
     self.__state_map = _StateMap()
     self.__console = console
     self.__lock = threading.Lock()
+    # Notified whenever an action finishes, since that may make others ready.
+    self.__action_done = threading.Condition(self.__lock)
     self.__num_pending = 0
 
     # ActionStates which are ready but haven't been started.
     self.__action_queue = collections.deque()
 
+    # Tests tend to be much heavier than compiles (or can't share the machine
+    # with each other at all), so they may be limited separately from the
+    # number of build threads.  None means no separate limit.
+    self.__max_concurrent_tests = max_concurrent_tests
+    self.__running_tests = 0
+
     self.__tests = []
 
     self.failed = False
@@ -352,25 +456,100 @@ class Builder(object):
         config, test.test_result_artifact).is_dirty
     self.__tests.append((test.name, config, test, cached))
 
+  def affected_tests(self, config, tests, changed_files):
+    """Returns those of |tests| which depend on any of |changed_files|, in
+    order.  A test depends on the source files read by the actions needed to
+    run it (including headers listed in dep files), and on the SEBS files
+    defining those actions.  File names are relative to the root directory,
+    e.g. "src/foo/bar.cc".
+
+    A test also counts as affected if what it depends on can't be known
+    without building something first, e.g. because a compile has never run
+    so its dep file doesn't exist.
+
+    Nothing is built or recorded, e.g. in the deps log."""
+
+    (dependents, unknown) = self.__index_dependents(config, tests)
+
+    affected = set()
+    queue = [name for name in changed_files if name in dependents] + unknown
+    seen = set(queue)
+    while len(queue) > 0:
+      node = queue.pop()
+      if isinstance(node, Test):
+        affected.add(node)
+      for dependent in dependents.get(node, ()):
+        if dependent not in seen:
+          seen.add(dependent)
+          queue.append(dependent)
+
+    return [test for test in tests if test in affected]
+
+  def __index_dependents(self, config, tests):
+    """Walks the actions needed to run |tests| once, sharing the work between
+    tests which depend on the same libraries, and returns (dependents,
+    unknown).  |dependents| maps each file name, and each (config, action)
+    pair, to the set of actions and tests which directly depend on it.
+    |unknown| lists the actions whose inputs couldn't be determined."""
+
+    dependents = collections.defaultdict(set)
+    unknown = []
+    visited = set()
+    queue = []
+    for test in tests:
+      typecheck(test, Test)
+      test.expand_once()
+      queue.append((config, test.test_result_artifact, test))
+      queue.append((config, test.test_output_artifact, test))
+
+    while len(queue) > 0:
+      (artifact_config, artifact, dependent) = queue.pop()
+      artifact_state = self.__state_map.artifact_state(artifact_config,
+                                                       artifact)
+      artifact_config = artifact_state.config
+      artifact = artifact_state.artifact
+
+      if artifact.action is None:
+        dependents[artifact.filename].add(dependent)
+        continue
+      node = (artifact_config, artifact.action)
+      dependents[node].add(dependent)
+      if node in visited:
+        continue
+      visited.add(node)
+
+      for filename in artifact.action.rule.context.build_files:
+        dependents[filename].add(node)
+      collector = _InputCollector(self.__state_map, artifact_config,
+                                  artifact.action)
+      artifact.action.command.enumerate_artifacts(collector)
+      if not collector.complete:
+        unknown.append(node)
+      for filename in collector.disk_inputs:
+        dependents[filename].add(node)
+      for input in collector.inputs:
+        queue.append((artifact_config, input, node))
+
+    return (dependents, unknown)
+
   def build(self, action_runner):
     self.__lock.acquire()
     try:
       typecheck(action_runner, ActionRunner)
 
       while self.__num_pending > 0 and not self.failed:
-        if len(self.__action_queue) == 0:
-          # wait for actions
-          # TODO(kenton):  Use a semaphore or something?
-          self.__lock.release()
-          try:
-            time.sleep(1)
-          finally:
-            self.__lock.acquire()
+        action_state = self.__pop_runnable_action()
+        if action_state is None:
+          # Wait for running actions to make more ready.  The timeout is
+          # just a safety net.
+          self.__action_done.wait(1)
           continue
 
-        action_state = self.__action_queue.popleft()
-        self.do_one_action(
-            action_state.config, action_state.action, action_runner)
+        try:
+          self.do_one_action(
+              action_state.config, action_state.action, action_runner)
+        finally:
+          self.__action_done.notify_all()
     except KeyboardInterrupt:
       if not self.failed:
         self.__console.write(ColoredText(ColoredText.RED, "INTERRUPTED"))
@@ -381,6 +560,25 @@ class Builder(object):
     finally:
       self.__lock.release()
 
+  def __pop_runnable_action(self):
+    """Removes and returns the first ActionState in the queue that may be
+    started now, or returns None if there is none."""
+
+    if self.__max_concurrent_tests is None or \
+       self.__running_tests < self.__max_concurrent_tests:
+      if len(self.__action_queue) == 0:
+        return None
+      return self.__action_queue.popleft()
+
+    # Too many tests are running; pass over any tests in the queue.
+    for action_state in self.__action_queue:
+      if action_state.action.verb != "test":
+        break
+    else:
+      return None
+    self.__action_queue.remove(action_state)
+    return action_state
+
   def do_one_action(self, config, action, action_runner):
     action_state = self.__state_map.action_state(config, action)
     test_result = None
@@ -392,23 +590,38 @@ class Builder(object):
       real_name_map[artifact] = self.__state_map.real_name(config, artifact)
 
     self.__num_pending = self.__num_pending - 1
-    if not action_runner.run(action, action_state.inputs,
-                                     action_state.disk_inputs,
-                                     action_state.outputs,
-                                     test_result,
-                                     config,
-                                     real_name_map,
-                                     self.__lock):
+    is_test = action.verb == "test"
+    if is_test:
+      self.__running_tests = self.__running_tests + 1
+    try:
+      succeeded = action_runner.run(action, action_state.inputs,
+                                            action_state.disk_inputs,
+                                            action_state.outputs,
+                                            test_result,
+                                            config,
+                                            real_name_map,
+                                            self.__lock)
+    finally:
+      if is_test:
+        self.__running_tests = self.__running_tests - 1
+    if not succeeded:
       if not self.failed:
         self.__console.write(ColoredText(ColoredText.RED, "BUILD FAILED"))
         self.failed = True
       return
 
+    self.__record_deps(config, action_state)
+
     newly_ready = []
 
     for output in action_state.outputs:
       self.__state_map.artifact_state(config, output).is_dirty = False
 
+      # The output may also be some other action's disk input.
+      disk_path = config.root_dir.get_disk_path(real_name_map[output])
+      if disk_path is not None:
+        self.__state_map.disk_stats.invalidate(disk_path)
+
     for dependent in action_state.blocked:
       became_ready = dependent.update_readiness(self.__state_map)
       if dependent.is_pending:
@@ -434,9 +647,23 @@ class Builder(object):
     newly_ready.reverse()
     self.__action_queue.extendleft(newly_ready)
 
+  def __record_deps(self, config, action_state):
+    """Adds the dep files just written by a successful action to the deps
+    log, so that later builds needn't parse them."""
+
+    for artifact in action_state.dep_files:
+      real_name = self.__state_map.real_name(config, artifact)
+      mtime = config.root_dir.getmtime_if_exists(real_name)
+      if mtime is not None:
+        config.deps_log.record(real_name, mtime,
+                               config.root_dir.getsize_if_exists(real_name),
+                               parse_dep_file(config.root_dir.read(real_name)))
+
   def print_test_results(self):
     self.__tests.sort()
 
+    # Console output may be buffered; don't let it come after ours.
+    self.__console.flush()
     print "\nTest results:"
 
     had_failure = False
@@ -461,4 +688,5 @@ class Builder(object):
         message.extend(["\n    ", output_file])
       self.__console.write(message)
 
+    self.__console.flush()
     return not had_failure
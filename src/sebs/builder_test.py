@@ -32,13 +32,15 @@
 
 # TODO(kenton): Test DryRunner and SubprocessRunner.
 
+import threading
+import time
 import unittest
 import cStringIO
 
-from sebs.core import Artifact, Action, Rule, Context, DefinitionError
+from sebs.core import Artifact, Action, Rule, Test, Context, DefinitionError
 from sebs.filesystem import VirtualDirectory
 from sebs.builder import Builder
-from sebs.command import Command
+from sebs.command import Command, DepFileCommand
 from sebs.console import make_console
 from sebs.runner import ActionRunner
 
@@ -64,12 +66,55 @@ class MockRunner(ActionRunner):
 
     return True
 
+class SlowMockRunner(ActionRunner):
+  """Runs each action with the builder's lock released, tracking how many test
+  actions run at once.  Each test action blocks until |overlap| of them are
+  running, so that the maximum is reached deterministically rather than by
+  timing.  The wait gives up after a while so that a builder which never runs
+  that many at once fails the test instead of hanging it."""
+
+  def __init__(self, overlap):
+    self.overlap = overlap
+    self.running_tests = 0
+    self.max_running_tests = 0
+    self.actions = []
+    self.__condition = threading.Condition()
+
+  def run(self, action, inputs, disk_inputs, outputs, test_result, config,
+          real_name_map, lock):
+    self.actions.append(action)
+    is_test = action.verb == "test"
+    lock.release()
+    try:
+      if is_test:
+        self.__condition.acquire()
+        try:
+          self.running_tests += 1
+          self.max_running_tests = max(self.max_running_tests,
+                                       self.running_tests)
+          self.__condition.notifyAll()
+          deadline = time.time() + 10
+          while self.max_running_tests < self.overlap and \
+                time.time() < deadline:
+            self.__condition.wait(deadline - time.time())
+          self.running_tests -= 1
+        finally:
+          self.__condition.release()
+    finally:
+      lock.acquire()
+    return True
+
 class MockContext(Context):
   def __init__(self, filename, full_filename):
     super(MockContext, self).__init__()
     self.filename = filename
     self.full_filename = full_filename
     self.timestamp = 0
+    self.build_files = set([full_filename])
+
+class MockTest(Test):
+  def _expand(self, args):
+    pass
 
 class MockCommand(Command):
   def __init__(self, inputs, outputs):
@@ -98,6 +143,16 @@ class ConditionalMockCommand(Command):
     for output in self.__outputs:
       artifact_enumerator.add_output(output)
 
+class MockDepsLog(object):
+  def __init__(self):
+    self.records = {}
+
+  def lookup(self, name, mtime, size):
+    return self.records.get((name, mtime, size))
+
+  def record(self, name, mtime, size, deps):
+    self.records[(name, mtime, size)] = deps
+
 class MockConfiguration(object):
   def __init__(self, dir):
     self.root_dir = dir
@@ -339,5 +394,141 @@ class BuilderTest(unittest.TestCase):
     self.assertEqual([condition_builder, conditional_action, action],
                      self.doBuild(output))
 
+  def testAffectedTests(self):
+    source = Artifact("src/test.cc", None)
+    compile = Action(self.rule, "compile")
+    object = Artifact("tmp/test.o", compile)
+    compile.command = MockCommand([source], [object])
+
+    condition_builder = Action(self.rule, "", "condition_builder")
+    condition = Artifact("cond", condition_builder)
+    condition_builder.command = MockCommand([], [condition])
+    conditional_source = Artifact("src/cond.cc", None)
+
+    action = Action(self.rule, "test")
+    result = Artifact("mem/test_result", action)
+    output = Artifact("tmp/test_output.txt", action)
+    action.command = ConditionalMockCommand(
+        condition, [object], [conditional_source], [result, output])
+
+    test = MockTest(self.context)
+    test.test_result_artifact = result
+    test.test_output_artifact = output
+
+    # A second test sharing the compile.
+    other_source = Artifact("src/other.cc", None)
+    other_action = Action(self.rule, "test", "other")
+    other_result = Artifact("mem/other_result", other_action)
+    other_output = Artifact("tmp/other_output.txt", other_action)
+    other_action.command = MockCommand([object, other_source],
+                                       [other_result, other_output])
+
+    other_test = MockTest(self.context)
+    other_test.test_result_artifact = other_result
+    other_test.test_output_artifact = other_output
+
+    self.dir.add("src/test.cc", 20, "")
+    self.dir.add("src/cond.cc", 20, "")
+    self.dir.add("src/other.cc", 20, "")
+    config = MockConfiguration(self.dir)
+    tests = [test, other_test]
+
+    def affected(*changed_files):
+      return Builder(self.console).affected_tests(config, tests,
+                                                  set(changed_files))
+
+    # The condition hasn't been built, so the first test's inputs aren't
+    # known.
+    self.assertEqual([test], affected())
+    self.assertEqual([test, other_test], affected("src/other.cc"))
+
+    self.dir.add("cond", 30, "false")
+    self.assertEqual([], affected())
+    self.assertEqual([], affected("src/cond.cc", "src/unrelated.cc"))
+    self.assertEqual([other_test], affected("src/other.cc"))
+    self.assertEqual([test, other_test], affected("src/test.cc"))
+    self.assertEqual([test, other_test], affected("src/mock.sebs"))
+
+    self.dir.add("cond", 30, "true")
+    self.assertEqual([test], affected("src/cond.cc"))
+
+  def testAffectedTestsRecordsNothing(self):
+    compile = Action(self.rule, "compile")
+    object = Artifact("tmp/test.o", compile)
+    dep_file = Artifact("tmp/test.d", compile)
+    compile.command = DepFileCommand(MockCommand([], [object, dep_file]),
+                                     dep_file)
+
+    action = Action(self.rule, "test")
+    result = Artifact("mem/test_result", action)
+    output = Artifact("tmp/test_output.txt", action)
+    action.command = MockCommand([object], [result, output])
+
+    test = MockTest(self.context)
+    test.test_result_artifact = result
+    test.test_output_artifact = output
+
+    self.dir.add("tmp/test.d", 20, "tmp/test.o: src/test.cc src/test.h\n")
+    config = MockConfiguration(self.dir)
+    config.deps_log = MockDepsLog()
+
+    builder = Builder(self.console)
+    self.assertEqual(
+        [test], builder.affected_tests(config, [test], set(["src/test.h"])))
+    self.assertEqual([], builder.affected_tests(config, [test], set()))
+    self.assertEqual({}, config.deps_log.records)
+
+  def testDepsRecordedOnCompletion(self):
+    compile = Action(self.rule, "compile")
+    object = Artifact("tmp/test.o", compile)
+    dep_file = Artifact("tmp/test.d", compile)
+    compile.command = DepFileCommand(MockCommand([], [object, dep_file]),
+                                     dep_file)
+
+    content = "tmp/test.o: src/test.cc src/test.h\n"
+    self.dir.add("tmp/test.d", 20, content)
+    config = MockConfiguration(self.dir)
+    config.deps_log = MockDepsLog()
+
+    # Deciding what to build only reads the dep file.
+    builder = Builder(self.console)
+    builder.add_artifact(config, object)
+    self.assertEqual({}, config.deps_log.records)
+
+    builder.build(MockRunner())
+    self.assertEqual({ ("tmp/test.d", 20, len(content)):
+                           ["src/test.cc", "src/test.h"] },
+                     config.deps_log.records)
+
+  def testTestConcurrencyLimit(self):
+    outputs = []
+    for i in range(4):
+      action = Action(self.rule, "test", "test%d" % i)
+      outputs.append(Artifact("test%d_result" % i, action))
+      action.command = MockCommand([], [outputs[-1]])
+    action = Action(self.rule, "compile", "compile")
+    outputs.append(Artifact("object", action))
+    action.command = MockCommand([], [outputs[-1]])
+
+    def build(max_concurrent_tests):
+      builder = Builder(self.console, max_concurrent_tests)
+      runner = SlowMockRunner(min(max_concurrent_tests or 4, 4))
+      config = MockConfiguration(self.dir)
+      for output in outputs:
+        builder.add_artifact(config, output)
+      threads = [threading.Thread(target = builder.build, args = [runner])
+                 for _ in range(4)]
+      for thread in threads:
+        thread.start()
+      for thread in threads:
+        thread.join()
+      self.assertFalse(builder.failed)
+      self.assertEqual(5, len(runner.actions))
+      return runner.max_running_tests
+
+    self.assertEqual(4, build(None))
+    self.assertEqual(2, build(2))
+    self.assertEqual(1, build(1))
+
 if __name__ == "__main__":
   unittest.main()
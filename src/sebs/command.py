@@ -41,8 +41,22 @@ import subprocess
 
 from sebs.core import Artifact, Action, DefinitionError, ContentToken, \
                       CommandBase, Context
+from sebs.deps_log import parse_dep_file
+from sebs.include_scanner import scan_includes
 from sebs.helpers import typecheck
 
+def subprocess_environment(environ):
+  """Given the environment in which SEBS is running, returns the environment
+  in which SubprocessCommands should run."""
+
+  env = dict(environ)
+  # TODO(kenton):  We should *add* src to the existing PYTHONPATH instead of
+  #   overwrite, but there is one problem:  The SEBS Python archive may be
+  #   in PYTHONPATH, and we do NOT want programs that we run to be able to
+  #   take advantage of that to import SEBS implementation modules.
+  env["PYTHONPATH"] = "src"
+  return env
+
 class CommandContext(object):
   def get_disk_path(self, artifact, use_temporary=True):
     """Get the on-disk file name of the given artifact.  If the artifact is not
@@ -66,16 +80,35 @@ class CommandContext(object):
     """Replace the artifact's contents with the given string."""
     raise NotImplementedError
 
+  def subprocess_environment(self):
+    """Returns the environment (a dict) in which subprocesses should run.  The
+    same object may be shared by many commands, so do not modify it."""
+    return subprocess_environment(os.environ)
+
   def subprocess(self, args, **kwargs):
     """Runs a subprocess.  The parameters are the same as those to the Popen
     function in the standard subprocess module.  Additionally, the "stdin"
     argument is allowed to be a string, in which case it will be fed into the
-    process via a pipe.  Returns a triplet:  (exit_code, stdout, stderr).
-    stdout and stderr are the values returned by the communicate() method of
-    the Popen object -- i.e. strings if you passed subprocess.PIPE for the
-    corresponding parameters, or None otherwise."""
+    process via a pipe, and the "stdout" and "stderr" arguments are allowed to
+    be file-like objects which are not real files (such as the log passed to
+    Command.run()), in which case output is passed to their write() methods
+    as it is produced, so that it need not all be held in memory at once.
+    Returns a triplet:  (exit_code, stdout, stderr).  stdout and stderr are
+    the values returned by the communicate() method of the Popen object --
+    i.e. strings if you passed subprocess.PIPE for the corresponding
+    parameters, or None otherwise."""
     raise NotImplementedError
 
+  def worker_subprocess(self, args, env=None, cwd=None):
+    """Like subprocess(), but the program (args[0]) is a persistent worker as
+    described in worker.py, so the request may be sent to an already-running
+    instance of it.  Returns (exit_code, stdout, stderr), where stdout and
+    stderr are strings.  The default implementation just runs the program
+    normally."""
+
+    return self.subprocess(args, stdout = subprocess.PIPE,
+                           stderr = subprocess.PIPE, env = env, cwd = cwd)
+
   def message(self, text):
     """Provides a message to be printed to the console reporting the result
     of this action."""
@@ -117,6 +150,39 @@ class ArtifactEnumerator(object):
     need to be recompiled."""
     raise NotImplementedError
 
+  def read_dependencies(self, artifact):
+    """Given a dep file produced by this command (see read_previous_output()),
+    returns the list of files it names as dependencies, or None if there is no
+    previous copy.  Implementations may answer from a DepsLog rather than
+    re-parsing the file."""
+    text = self.read_previous_output(artifact)
+    if text is None:
+      return None
+    return parse_dep_file(text)
+
+  def read_includes(self, artifact):
+    """Like read(), but returns the #includes in the artifact as
+    scan_includes() (see include_scanner.py) would, or False where read()
+    would return None.  Implementations may answer from an IncludeCache
+    rather than re-reading the artifact."""
+    text = self.read(artifact)
+    if text is None:
+      return False
+    return scan_includes(text)
+
+  def read_disk_includes(self, filename):
+    """Like read_includes(), but for a file which is not an artifact, named as
+    for add_disk_input().  Returns False if the file doesn't exist.  This does
+    not make the file an input."""
+    try:
+      file = open(filename, "rU")
+    except IOError:
+      return False
+    try:
+      return scan_includes(file.read())
+    finally:
+      file.close()
+
 class ScriptWriter(object):
   def add_command(self, text):
     """Add a command which should be executed as part of the current action."""
@@ -141,6 +207,12 @@ class ScriptWriter(object):
     """Report that the given artifact is an output to the command."""
     raise NotImplementedError
 
+  def add_dep_file(self, artifact):
+    """Report that the given output artifact of the command is a make-style
+    dependency list (as written by GCC's -MD), naming further inputs.  Writers
+    which can't make use of it may ignore it."""
+    pass
+
   def artifact_filename_expression(self, artifact):
     """Returns a shell expression which expands to the on-disk name of the
     given artifact.  Calling this method also implies calls to
@@ -354,7 +426,7 @@ class EnvironmentCommand(Command):
   def write_script(self, script_writer):
     if self.__default is None:
       script_writer.add_command(
-          "test \"${%s+set}\" = set || die %s" %
+          "test \"${%s+set}\" = set || { echo %s >&2; exit 1; }" %
           (self.__env_name, pipes.quote(self.__error_message_if_unset)))
       expression = "${%s}" % self.__env_name
     else:
@@ -507,7 +579,18 @@ class SubprocessCommand(Command):
 
   def __init__(self, action, args, implicit = [],
                capture_stdout=None, capture_stderr=None,
-               capture_exit_status=None, working_dir=None):
+               capture_exit_status=None, working_dir=None, worker=False,
+               env=None):
+    """|env| is a dict of environment variables to set for this command,
+    overriding those of the configuration.
+
+    If |worker| is true, the program supports being run as a persistent
+    worker, as described in worker.py.  The runner may then send the command
+    to an already-running instance of the program rather than start a new
+    one.  The first argument must be the program itself, not an interpreter
+    running it.  The command's results must not depend on whether it was run
+    in a worker."""
+
     typecheck(action, Action)
     typecheck(args, list)
     typecheck(implicit, list, Artifact)
@@ -515,6 +598,8 @@ class SubprocessCommand(Command):
     typecheck(capture_stderr, Artifact)
     typecheck(capture_exit_status, Artifact)
     typecheck(working_dir, basestring)
+    typecheck(worker, bool)
+    typecheck(env, dict)
 
     self.__verify_args(args)
 
@@ -525,6 +610,8 @@ class SubprocessCommand(Command):
     self.__capture_stderr = capture_stderr
     self.__capture_exit_status = capture_exit_status
     self.__working_dir = working_dir
+    self.__worker = worker
+    self.__env = env
 
   def enumerate_artifacts(self, artifact_enumerator):
     if self.__capture_stdout is not None:
@@ -565,11 +652,15 @@ class SubprocessCommand(Command):
   def run(self, context, log):
     formatted_args = list(self.__format_args(self.__args, context))
 
-    # Capture stdout/stderr if requested.
+    if self.__worker:
+      return self.__run_in_worker(context, log, formatted_args)
+
+    # Capture stdout/stderr if requested.  Output which goes to the log is
+    # streamed into it, and output which goes to an artifact on disk is
+    # written there directly, so neither needs to be buffered in memory.
+    files = []
     if self.__capture_stdout is None:
-      # The log is not a unix file descriptor, so we must use a pipe and then
-      # write to in manually.
-      stdout = subprocess.PIPE
+      stdout = log
     else:
       disk_path = context.get_disk_path(self.__capture_stdout,
                                         use_temporary = False)
@@ -577,13 +668,12 @@ class SubprocessCommand(Command):
         stdout = subprocess.PIPE
       else:
         stdout = open(disk_path, "wb")
+        files.append(stdout)
 
     if self.__capture_stderr is self.__capture_stdout:
       stderr = subprocess.STDOUT
     elif self.__capture_stderr is None:
-      # The log is not a unix file descriptor, so we must use a pipe and then
-      # write to in manually.
-      stderr = subprocess.PIPE
+      stderr = log
     else:
       disk_path = context.get_disk_path(self.__capture_stderr,
                                         use_temporary = False)
@@ -591,36 +681,63 @@ class SubprocessCommand(Command):
         stderr = subprocess.PIPE
       else:
         stderr = open(disk_path, "wb")
+        files.append(stderr)
+
+    try:
+      exit_code, stdout_text, stderr_text = \
+          context.subprocess(formatted_args,
+                             stdout = stdout, stderr = stderr,
+                             env = self.__make_env(context),
+                             cwd = self.__cwd(context))
+    finally:
+      for file in files:
+        file.close()
 
-    env = os.environ.copy()
-    # TODO(kenton):  We should *add* src to the existing PYTHONPATH instead of
-    #   overwrite, but there is one problem:  The SEBS Python archive may be
-    #   in PYTHONPATH, and we do NOT want programs that we run to be able to
-    #   take advantage of that to import SEBS implementation modules.
-    env["PYTHONPATH"] = "src"
+    if stdout == subprocess.PIPE:
+      context.write(self.__capture_stdout, stdout_text)
+    if stderr == subprocess.PIPE:
+      context.write(self.__capture_stderr, stderr_text)
 
-    if self.__working_dir is None:
-      cwd = None
-    else:
-      cwd = os.path.join(os.getcwd(),
-                         context.get_disk_directory_path(self.__working_dir))
+    return self.__finish(context, log, formatted_args, exit_code)
 
+  def __run_in_worker(self, context, log, formatted_args):
     exit_code, stdout_text, stderr_text = \
-        context.subprocess(formatted_args,
-                           stdout = stdout, stderr = stderr,
-                           env = env, cwd = cwd)
-
-    if stdout == subprocess.PIPE:
+        context.worker_subprocess(formatted_args,
+                                  env = self.__make_env(context),
+                                  cwd = self.__cwd(context))
+
+    # The worker hands us its output as strings, so we have to do the
+    # redirection ourselves.
+    if self.__capture_stderr is not None and \
+       self.__capture_stderr is self.__capture_stdout:
+      context.write(self.__capture_stdout, stdout_text + stderr_text)
+    else:
       if self.__capture_stdout is None:
         log.write(stdout_text)
       else:
         context.write(self.__capture_stdout, stdout_text)
-    if stderr == subprocess.PIPE:
       if self.__capture_stderr is None:
         log.write(stderr_text)
       else:
         context.write(self.__capture_stderr, stderr_text)
 
+    return self.__finish(context, log, formatted_args, exit_code)
+
+  def __make_env(self, context):
+    env = context.subprocess_environment()
+    if self.__env:
+      env = dict(env)
+      env.update(self.__env)
+    return env
+
+  def __cwd(self, context):
+    if self.__working_dir is None:
+      return None
+    else:
+      return os.path.join(os.getcwd(),
+                          context.get_disk_directory_path(self.__working_dir))
+
+  def __finish(self, context, log, formatted_args, exit_code):
     if self.__capture_exit_status is not None:
       if exit_code == 0:
         context.write(self.__capture_exit_status, "true")
@@ -638,6 +755,7 @@ class SubprocessCommand(Command):
   def print_(self, output):
     if self.__working_dir is not None:
       output.write("cd %s && " % self.__working_dir)
+    output.write(self.__env_prefix())
 
     class DummyContext(CommandContext):
       def get_disk_path(self, artifact):
@@ -712,6 +830,13 @@ class SubprocessCommand(Command):
     if self.__working_dir is not None:
       hasher.update("/")
       _hash_string_and_length(self.__working_dir, hasher)
+    if self.__env:
+      hasher.update("=")
+      hasher.update(str(len(self.__env)))
+      hasher.update(" ")
+      for name, value in sorted(self.__env.items()):
+        _hash_string_and_length(name, hasher)
+        _hash_string_and_length(value, hasher)
 
     # Hash implicit files in sorted order so that use of hash sets by the
     # creator doesn't cause problems.
@@ -763,10 +888,13 @@ class SubprocessCommand(Command):
         script_writer.add_input(artifact)
 
     command_parts = []
-    command_parts.append(
+    command_parts.append(self.__env_prefix() +
         " ".join(self.__script_args(self.__args, script_writer)))
 
-    if self.__capture_stdout is not None:
+    # Output captured to a memory artifact goes to a shell variable instead.
+    stdout_to_memory = self.__capture_stdout is not None and \
+                       self.__capture_stdout.filename.startswith("mem/")
+    if self.__capture_stdout is not None and not stdout_to_memory:
       command_parts.append(">%s" %
         script_writer.artifact_filename_expression(
           self.__capture_stdout))
@@ -777,6 +905,9 @@ class SubprocessCommand(Command):
         command_parts.append("2>%s" %
           script_writer.artifact_filename_expression(
             self.__capture_stderr))
+    if stdout_to_memory:
+      command_parts = [script_writer.echo_expression(
+          '"$(%s)"' % " ".join(command_parts), self.__capture_stdout)]
     if self.__capture_exit_status is not None:
       command_parts.append("&& %s || %s" %
         (script_writer.echo_expression("true", self.__capture_exit_status),
@@ -794,6 +925,12 @@ class SubprocessCommand(Command):
 
     script_writer.add_command(command)
 
+  def __env_prefix(self):
+    if not self.__env:
+      return ""
+    return "".join(["%s=%s " % (name, pipes.quote(value))
+                    for name, value in sorted(self.__env.items())])
+
   def __script_args(self, args, script_writer):
     for arg in args:
       if isinstance(arg, basestring):
@@ -818,28 +955,32 @@ class SubprocessCommand(Command):
 class DepFileCommand(Command):
   """A Command which produces a dependency list as part of its execution, e.g.
   as GCC does when given the -MD command-line flag.  Wraps some other command
-  that does the actual work."""
+  that does the actual work.
+
+  If |include_scanner| is given, it is an IncludeScanner (see
+  include_scanner.py) listing generated headers which the command may read.
+  Only those which the scanner finds to be included are inputs, so on a clean
+  build, when there is no dependency list yet, the command doesn't wait for
+  unrelated code generation.  (The dependency list alone isn't enough even
+  later, since it may be out of date.)"""
 
-  def __init__(self, real_command, dep_artifact):
+  def __init__(self, real_command, dep_artifact, include_scanner=None):
     typecheck(real_command, Command)
     typecheck(dep_artifact, Artifact)
     self.__command = real_command
     self.__dep_artifact = dep_artifact
+    self.__include_scanner = include_scanner
 
   def enumerate_artifacts(self, artifact_enumerator):
     self.__command.enumerate_artifacts(artifact_enumerator)
 
-    dep_text = artifact_enumerator.read_previous_output(self.__dep_artifact)
-    if dep_text is not None:
-      # Parse text that looks like:
-      #   foo.o: foo.h bar.h \
-      #     baz.h qux.h
-      dep_text = dep_text.replace("\\\n", " ")  # remove escaped newlines
-      parts = dep_text.split()
-      for part in parts:
-        # Skip tokens like "foo.o:".  The rest are files.
-        if not part.endswith(":"):
-          artifact_enumerator.add_disk_input(part)
+    if self.__include_scanner is not None:
+      self.__include_scanner.enumerate_artifacts(artifact_enumerator)
+
+    deps = artifact_enumerator.read_dependencies(self.__dep_artifact)
+    if deps is not None:
+      for dep in deps:
+        artifact_enumerator.add_disk_input(dep)
 
   def run(self, context, log):
     return self.__command.run(context, log)
@@ -857,7 +998,57 @@ class DepFileCommand(Command):
     #   and we wouldn't be able to deal with conditional includes very well.
     #   Maybe that doesn't matter.  Alternatively, maybe we could actually
     #   include code in the script to parse depfiles?
+    if self.__include_scanner is not None:
+      for header in self.__include_scanner.generated_headers:
+        script_writer.add_input(header)
+    self.__command.write_script(script_writer)
+    script_writer.add_dep_file(self.__dep_artifact)
+
+class OptionalOutputCommand(Command):
+  """A Command which may or may not write |output_artifact| as a side effect,
+  depending on options it reads at run time -- e.g. GCC writes a .dwo file
+  only when given -gsplit-dwarf.  Wraps the command that does the actual work.
+  The artifact is removed before that command runs, and written empty if the
+  command didn't write it, so that it is always present and never stale."""
+
+  def __init__(self, real_command, output_artifact):
+    typecheck(real_command, Command)
+    typecheck(output_artifact, Artifact)
+    self.__command = real_command
+    self.__output_artifact = output_artifact
+
+  def enumerate_artifacts(self, artifact_enumerator):
+    self.__command.enumerate_artifacts(artifact_enumerator)
+    artifact_enumerator.add_output(self.__output_artifact)
+
+  def run(self, context, log):
+    path = context.get_disk_path(self.__output_artifact, use_temporary=False)
+    if path is None:
+      log.write("%s: optional output must be on disk.\n" %
+                self.__output_artifact.filename)
+      return False
+    if os.path.lexists(path):
+      os.remove(path)
+    if not self.__command.run(context, log):
+      return False
+    if not os.path.exists(path):
+      context.write(self.__output_artifact, "")
+    return True
+
+  def print_(self, output):
+    self.__command.print_(output)
+
+  def hash(self, hasher):
+    hasher.update("OptionalOutputCommand:")
+    self.__command.hash(hasher)
+    _hash_string_and_length(self.__output_artifact.filename, hasher)
+
+  def write_script(self, script_writer):
+    filename = script_writer.artifact_filename_expression(
+        self.__output_artifact)
+    script_writer.add_command("rm -f %s" % filename)
     self.__command.write_script(script_writer)
+    script_writer.add_command("test -e %s || : > %s" % (filename, filename))
 
 # ====================================================================
 
@@ -31,14 +31,19 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import cStringIO
+import hashlib
+import os
+import shutil
 import subprocess
+import tempfile
 import unittest
 
 from sebs.core import Artifact, Action, DefinitionError, ContentToken, Context
 from sebs.command import CommandContext, ArtifactEnumerator, Command, \
                          EchoCommand, EnvironmentCommand, DoAllCommand, \
-                         ConditionalCommand, SubprocessCommand
-from sebs.filesystem import VirtualDirectory
+                         ConditionalCommand, SubprocessCommand, \
+                         OptionalOutputCommand
+from sebs.filesystem import DiskDirectory, VirtualDirectory
 
 def _print_command(command):
   out = cStringIO.StringIO()
@@ -52,6 +57,7 @@ class MockCommandContext(CommandContext):
     self.subprocess_kwargs = None
     self.subprocess_result = (0, "", None)
     self.diskpath_prefix = diskpath_prefix
+    self.environment = {"PATH": "/bin", "PYTHONPATH": "src"}
 
   def get_disk_path(self, artifact, use_temporary=True):
     if self.diskpath_prefix is None:
@@ -68,11 +74,21 @@ class MockCommandContext(CommandContext):
   def write(self, artifact, content):
     self.__dir.write(artifact.filename, content)
 
+  def subprocess_environment(self):
+    return self.environment
+
   def subprocess(self, args, **kwargs):
     assert self.subprocess_kwargs is None  # Should not call twice.
     self.subprocess_args = args
     self.subprocess_kwargs = kwargs
-    return self.subprocess_result
+
+    # Simulate streaming into file-like objects.
+    result = list(self.subprocess_result)
+    for i, name in [(1, "stdout"), (2, "stderr")]:
+      if hasattr(kwargs.get(name), "write") and result[i] is not None:
+        kwargs[name].write(result[i])
+        result[i] = None
+    return tuple(result)
 
 class MockRuleContext(Context):
   def __init__(self, *kwargs):
@@ -394,6 +410,46 @@ class CommandTest(unittest.TestCase):
         "}\n",
         _print_command(command))
 
+class OptionalOutputCommandTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def testOptionalOutput(self):
+    dwo = Artifact("foo.dwo", None)
+    path = os.path.join(self.dir, "foo.dwo")
+    mock_command = MockCommand("compile")
+    command = OptionalOutputCommand(mock_command, dwo)
+
+    enumerator = MockArtifactEnumerator()
+    command.enumerate_artifacts(enumerator)
+    self.assertEquals([dwo], enumerator.outputs)
+
+    # A stale file is replaced by an empty one if the command doesn't write
+    # it.
+    open(path, "w").write("stale")
+    context = MockCommandContext(DiskDirectory(self.dir), self.dir + "/")
+    log = cStringIO.StringIO()
+    self.assertTrue(command.run(context, log))
+    self.assertEquals("Ran MockCommand compile\n", log.getvalue())
+    self.assertEquals("", open(path).read())
+
+    # What the command writes is kept.
+    class WritingCommand(MockCommand):
+      def run(self, context, log):
+        open(path, "w").write("debug info")
+        return True
+    command = OptionalOutputCommand(WritingCommand("compile"), dwo)
+    self.assertTrue(command.run(context, log))
+    self.assertEquals("debug info", open(path).read())
+
+    mock_command.fails = True
+    command = OptionalOutputCommand(mock_command, dwo)
+    self.assertFalse(command.run(context, log))
+    self.assertFalse(os.path.exists(path))
+
 class SubprocessCommandTest(unittest.TestCase):
   def setUp(self):
     self.__action = Action(None, "dummy", "dummy")
@@ -502,7 +558,7 @@ class SubprocessCommandTest(unittest.TestCase):
     context.subprocess_result = (0, "some text", None)
     log = cStringIO.StringIO()
     self.assertTrue(command.run(context, log))
-    self.assertTrue(context.subprocess_kwargs["stdout"] is subprocess.PIPE)
+    self.assertTrue(context.subprocess_kwargs["stdout"] is log)
     self.assertTrue(context.subprocess_kwargs["stderr"] is subprocess.STDOUT)
     self.assertEquals("some text", log.getvalue())
     self.assertEquals("foo\n", _print_command(command))
@@ -515,7 +571,7 @@ class SubprocessCommandTest(unittest.TestCase):
     log = cStringIO.StringIO()
     self.assertTrue(command.run(context, log))
     self.assertTrue(context.subprocess_kwargs["stdout"] is subprocess.PIPE)
-    self.assertTrue(context.subprocess_kwargs["stderr"] is subprocess.PIPE)
+    self.assertTrue(context.subprocess_kwargs["stderr"] is log)
     self.assertEquals("some text", self.__dir.read("filename"))
     self.assertEquals("error text", log.getvalue())
     self.assertEquals("foo > filename\n", _print_command(command))
@@ -527,9 +583,7 @@ class SubprocessCommandTest(unittest.TestCase):
     context.subprocess_result = (0, "some text", "error text")
     log = cStringIO.StringIO()
     self.assertTrue(command.run(context, log))
-    # TODO(kenton): Uncomment when bug with writing to log is solved.
-    #self.assertTrue(context.subprocess_kwargs["stdout"] is log)
-    self.assertTrue(context.subprocess_kwargs["stdout"] is subprocess.PIPE)
+    self.assertTrue(context.subprocess_kwargs["stdout"] is log)
     self.assertTrue(context.subprocess_kwargs["stderr"] is subprocess.PIPE)
     self.assertEquals("some text", log.getvalue())
     self.assertEquals("error text", self.__dir.read("filename"))
@@ -593,5 +647,59 @@ class SubprocessCommandTest(unittest.TestCase):
     self.assertTrue(command.run(context, cStringIO.StringIO()))
     self.assertEquals("false", self.__dir.read("filename"))
 
+  def testEnvironment(self):
+    # By default the context's environment is used as-is, without copying.
+    command = SubprocessCommand(self.__action, ["foo"])
+    context = MockCommandContext(self.__dir)
+    self.assertTrue(command.run(context, cStringIO.StringIO()))
+    self.assertTrue(context.subprocess_kwargs["env"] is context.environment)
+
+    # Overrides are applied on top of it.
+    command_with_env = SubprocessCommand(self.__action, ["foo"],
+                                         env = {"FOO": "bar baz", "PATH": "/"})
+    context = MockCommandContext(self.__dir)
+    self.assertTrue(command_with_env.run(context, cStringIO.StringIO()))
+    self.assertEquals({"FOO": "bar baz", "PATH": "/", "PYTHONPATH": "src"},
+                      context.subprocess_kwargs["env"])
+    self.assertEquals({"PATH": "/bin", "PYTHONPATH": "src"},
+                      context.environment)
+    self.assertEquals("FOO='bar baz' PATH=/ foo\n",
+                      _print_command(command_with_env))
+
+    # Overrides are part of the hash.
+    hasher = hashlib.md5()
+    command.hash(hasher)
+    hasher_with_env = hashlib.md5()
+    command_with_env.hash(hasher_with_env)
+    self.assertNotEqual(hasher.digest(), hasher_with_env.digest())
+
+  def testWorker(self):
+    # The default worker_subprocess() runs the command normally with both
+    # streams piped.
+    command = SubprocessCommand(self.__action, ["foo", "bar"], worker = True)
+    context = MockCommandContext(self.__dir)
+    context.subprocess_result = (0, "some output\n", "some error\n")
+    log = cStringIO.StringIO()
+    self.assertTrue(command.run(context, log))
+    self.assertEquals(["foo", "bar"], context.subprocess_args)
+    self.assertTrue(context.subprocess_kwargs["stdout"] is subprocess.PIPE)
+    self.assertTrue(context.subprocess_kwargs["stderr"] is subprocess.PIPE)
+    self.assertEquals("some output\nsome error\n", log.getvalue())
+
+    # Since workers return strings, combined output is concatenated.
+    command = SubprocessCommand(self.__action, ["foo"], worker = True,
+                                capture_stdout = self.__artifact,
+                                capture_stderr = self.__artifact)
+    context = MockCommandContext(self.__dir)
+    context.subprocess_result = (1, "out ", "err")
+    log = cStringIO.StringIO()
+    self.assertFalse(command.run(context, log))
+    self.assertEquals("out err", self.__dir.read("filename"))
+    self.assertEquals("Command failed with exit code 1: foo\n",
+                      log.getvalue())
+
+    # Printing is unaffected.
+    self.assertEquals("foo > filename 2>&1\n", _print_command(command))
+
 if __name__ == "__main__":
   unittest.main()
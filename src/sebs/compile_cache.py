@@ -0,0 +1,240 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Compiles a C++ source file, reusing a previous result if possible.
+
+Usage:
+  compile_cache.py -o OBJECT -d DEPFILE [--cache_dir=DIR] -- COMPILER... -- SOURCE
+
+COMPILER is the compiler command and flags.  OBJECT receives the compiled
+code and DEPFILE a make-style list of the files it was compiled from.
+
+Like ccache, the result is looked up by a hash of the compiler's identity,
+the flags, and the preprocessed source, so comment-only or whitespace-only
+changes to headers, touching files, moving the source tree, or building the
+same code in a different output directory all hit the cache.  Include
+directories are not hashed since their effect is captured by preprocessing.
+Note that objects compiled with -g record the directory they were compiled
+in; use -fdebug-prefix-map if that matters.
+
+Cached objects are stored in DIR, which defaults to ~/.cache/sebs/compile.
+Delete it to clear the cache.
+"""
+
+import getopt
+import hashlib
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+
+class UsageError(Exception):
+  pass
+
+# Change this to invalidate all existing cache entries.
+_CACHE_VERSION = "1"
+
+# Maps compiler names to identities.  Only matters when running as a
+# persistent worker.
+_compiler_identities = {}
+
+def _compiler_identity(compiler):
+  """Returns a string identifying the compiler executable, based on its
+  resolved path, size, and modification time.  This is cheaper than running
+  "compiler --version" and catches upgrades that don't change the version."""
+
+  if os.sep in compiler:
+    path = compiler
+  else:
+    path = compiler
+    for dir in os.environ.get("PATH", "").split(os.pathsep):
+      candidate = os.path.join(dir, compiler)
+      if os.path.isfile(candidate) and os.access(candidate, os.X_OK):
+        path = candidate
+        break
+  path = os.path.realpath(path)
+  stat = os.stat(path)
+  key = (path, stat.st_size, stat.st_mtime)
+  if compiler not in _compiler_identities or \
+     _compiler_identities[compiler][0] != key:
+    _compiler_identities[compiler] = (key, "%s %d %r" % key)
+  return _compiler_identities[compiler][1]
+
+def _hashed_flags(flags):
+  """Returns the flags which should be part of the hash:  everything but
+  include directories."""
+
+  result = []
+  skip_next = False
+  for flag in flags:
+    if skip_next:
+      skip_next = False
+    elif flag in ("-I", "-isystem", "-iquote"):
+      skip_next = True
+    elif not flag.startswith("-I"):
+      result.append(flag)
+  return result
+
+def _run_command(command, stdout = None):
+  """Runs a command, forwarding its error output to ours.  (We may be running
+  as a persistent worker, in which case our real stdout is not for the
+  compiler.)  Returns true on success."""
+
+  if stdout is None:
+    proc = subprocess.Popen(command, stdout = subprocess.PIPE,
+                            stderr = subprocess.STDOUT)
+    sys.stderr.write(proc.communicate()[0])
+  else:
+    proc = subprocess.Popen(command, stdout = stdout, stderr = subprocess.PIPE)
+    sys.stderr.write(proc.communicate()[1])
+  return proc.returncode == 0
+
+def _copy_atomically(source, dest):
+  """Copies |source| to |dest| such that nobody ever sees a partial |dest|,
+  even if other builds are doing the same thing concurrently."""
+
+  (fd, temp) = tempfile.mkstemp(dir = os.path.dirname(dest) or ".",
+                                prefix = ".tmp")
+  os.close(fd)
+  try:
+    shutil.copyfile(source, temp)
+    # mkstemp() creates the file readable only by us.
+    umask = os.umask(0)
+    os.umask(umask)
+    os.chmod(temp, 0666 & ~umask)
+    os.rename(temp, dest)
+  except:
+    os.remove(temp)
+    raise
+
+def main(argv):
+  try:
+    opts, args = getopt.getopt(argv[1:], "ho:d:", ["help", "cache_dir="])
+  except getopt.error, message:
+    raise UsageError(message)
+
+  output = None
+  depfile = None
+  cache_dir = ""
+
+  for name, value in opts:
+    if name in ("-h", "--help"):
+      print __doc__
+      return 0
+    elif name == "-o":
+      output = value
+    elif name == "-d":
+      depfile = value
+    elif name == "--cache_dir":
+      cache_dir = value
+
+  if output is None:
+    raise UsageError("Missing required flag -o.")
+  if depfile is None:
+    raise UsageError("Missing required flag -d.")
+  if "--" not in args or args.index("--") != len(args) - 2:
+    raise UsageError("Expected: COMPILER... -- SOURCE")
+  compiler = args[:-2]
+  source = args[-1]
+
+  if cache_dir == "":
+    cache_dir = os.path.join(os.path.expanduser("~"), ".cache", "sebs",
+                             "compile")
+
+  # With split DWARF the compiler also writes a .dwo file, which we don't
+  # cache, so just compile.
+  if "-gsplit-dwarf" in compiler:
+    if _run_command(compiler + ["-MD", "-MF", depfile, "-c", source,
+                                "-o", output]):
+      return 0
+    else:
+      return 1
+
+  # Preprocess, producing the depfile at the same time.
+  preprocessed = tempfile.TemporaryFile()
+  try:
+    if not _run_command(compiler + ["-E", "-MD", "-MF", depfile,
+                                    "-MT", output, source],
+                        stdout = preprocessed):
+      return 1
+
+    hasher = hashlib.sha1()
+    for part in [_CACHE_VERSION, _compiler_identity(compiler[0])] + \
+                _hashed_flags(compiler[1:]):
+      hasher.update("%d %s" % (len(part), part))
+    preprocessed.seek(0)
+    for line in preprocessed:
+      # With -g, GCC records the working directory in a line marker like
+      # '# 1 "/path/to/cwd//"'.  Leave it out so that building the same code
+      # elsewhere still hits the cache.
+      if not (line.startswith("# 1 \"") and line.endswith("//\"\n")):
+        hasher.update(line)
+  finally:
+    preprocessed.close()
+
+  digest = hasher.hexdigest()
+  cached = os.path.join(cache_dir, digest[:2], digest[2:] + ".o")
+
+  if os.path.exists(cached):
+    _copy_atomically(cached, output)
+    # Make sure the output looks newer than its inputs.
+    os.utime(output, None)
+    return 0
+
+  if not _run_command(compiler + ["-c", source, "-o", output]):
+    return 1
+
+  # The cache is only an optimization, so failing to store into it is not an
+  # error.
+  try:
+    if not os.path.exists(os.path.dirname(cached)):
+      os.makedirs(os.path.dirname(cached))
+    _copy_atomically(output, cached)
+  except (IOError, OSError), e:
+    print >>sys.stderr, "warning: couldn't write to compile cache: %s" % e
+
+  return 0
+
+def _run(argv):
+  try:
+    return main(argv)
+  except UsageError, error:
+    print >>sys.stderr, error.message
+    print >>sys.stderr, "for help use --help"
+    return 2
+
+if __name__ == "__main__":
+  if "--persistent_worker" in sys.argv[1:]:
+    from sebs import worker
+    sys.exit(worker.run_worker(_run))
+  sys.exit(_run(sys.argv))
@@ -0,0 +1,76 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sebs import compile_cache
+
+class CompileCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.cache_dir = os.path.join(self.dir, "cache")
+    self.old_cwd = os.getcwd()
+
+  def tearDown(self):
+    os.chdir(self.old_cwd)
+    shutil.rmtree(self.dir)
+
+  def compileIn(self, tree):
+    """Compiles foo.cc with debug info inside directory |tree|, which is
+    created if necessary, and returns the cache entries afterwards."""
+
+    os.makedirs(os.path.join(self.dir, tree))
+    os.chdir(os.path.join(self.dir, tree))
+    open("foo.cc", "w").write("int Foo() { return 123; }\n")
+    self.assertEquals(0, compile_cache.main(
+        ["compile_cache.py", "-o", "foo.o", "-d", "foo.d",
+         "--cache_dir=" + self.cache_dir,
+         "--", "g++", "-O2", "-g", "--", "foo.cc"]))
+    self.assertTrue(os.path.exists("foo.o"))
+
+    entries = []
+    for subdir in os.listdir(self.cache_dir):
+      entries.extend(os.listdir(os.path.join(self.cache_dir, subdir)))
+    return entries
+
+  def testHitAfterMovingTree(self):
+    first = self.compileIn("first")
+    self.assertEquals(1, len(first))
+    # The second directory's compile must reuse the first's entry rather than
+    # add its own.
+    self.assertEquals(first, self.compileIn("second/tree"))
+
+if __name__ == "__main__":
+  unittest.main()
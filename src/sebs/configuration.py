@@ -59,10 +59,15 @@
 # Background server that accepts commands and doesn't have to reload sebs files.
 
 import cPickle
+import hashlib
 import os
 import shutil
 
-from sebs.filesystem import DiskDirectory, VirtualDirectory, MappedDirectory
+from sebs.command import subprocess_environment
+from sebs.deps_log import DepsLog
+from sebs.include_scanner import IncludeCache
+from sebs.filesystem import DiskDirectory, VirtualDirectory, MappedDirectory, \
+                            StatCachingDirectory
 from sebs.helpers import typecheck
 
 class _WorkingDirMapping(MappedDirectory.Mapping):
@@ -71,43 +76,81 @@ class _WorkingDirMapping(MappedDirectory.Mapping):
   "mem" subdirectory into a VirtualDirectory.  This class implements a
   mapping which can be used with MappedDirectory to accomplish these things."""
 
-  def __init__(self, source_dir, output_dir, mem_dir, env_dir, alt_configs):
+  def __init__(self, source_dir, output_dir, mem_dir, env_dir, alt_configs,
+               environ):
     super(_WorkingDirMapping, self).__init__()
     self.__source_dir = source_dir
     self.__output_dir = output_dir
     self.__mem_dir = mem_dir
     self.__env_dir = env_dir
     self.__alt_configs = alt_configs
+    self.__environ = environ
 
     if env_dir.exists("$config"):
       self.__configured_env = set(env_dir.read("$config").split(","))
     else:
       self.__configured_env = set()
 
+    # Maps the first component of a filename to a method which maps filenames
+    # with that prefix.  Filenames whose first component isn't listed here go
+    # to the output directory, except for those starting with "src" which are
+    # handled specially in map().
+    self.__prefix_table = {
+      "mem": self.__map_mem,
+      "env": self.__map_env,
+      "alt": self.__map_alt
+    }
+
+    # Every file access in the build goes through map(), often many times for
+    # the same file, so we remember results.
+    self.__cache = {}
+
   def map(self, filename):
+    try:
+      return self.__cache[filename]
+    except KeyError:
+      pass
+
     # Note:  We intentionally consider any directory name starting with "src"
     #   (including, e.g., "src-unofficial") as a source directory.
     if filename.startswith("src"):
-      return (self.__source_dir, filename)
-    elif filename.startswith("mem/"):
-      return (self.__mem_dir, filename[4:])
-    elif filename.startswith("env/"):
-      env_name = filename[4:]
-      self.__update_env(env_name)
-      return (self.__env_dir, env_name)
-    elif filename.startswith("alt/"):
-      parts = filename[4:].split("/", 1)
-      config = self.__alt_configs.get(parts[0])
-      if len(parts) > 1 and config is not None:
-        return (config.root_dir, parts[1])
+      result = (self.__source_dir, filename)
+    else:
+      (prefix, slash, rest) = filename.partition("/")
+      handler = self.__prefix_table.get(prefix)
+      if handler is None or slash == "":
+        result = (self.__output_dir, filename)
       else:
-        return (self.__output_dir, filename)
+        result = handler(filename, rest)
+        if result is None:
+          # Don't cache.
+          return (self.__output_dir, filename)
+
+    self.__cache[filename] = result
+    return result
+
+  def __map_mem(self, filename, rest):
+    return (self.__mem_dir, rest)
+
+  def __map_env(self, filename, rest):
+    # Since results are cached, this means we check each environment variable
+    # for changes once per build.
+    self.__update_env(rest)
+    return (self.__env_dir, rest)
+
+  def __map_alt(self, filename, rest):
+    parts = rest.split("/", 1)
+    config = self.__alt_configs.get(parts[0])
+    if len(parts) > 1 and config is not None:
+      return (config.root_dir, parts[1])
     else:
-      return (self.__output_dir, filename)
+      # The config may not have been registered yet, so return None to avoid
+      # caching this result.
+      return None
 
   def __update_env(self, filename):
-    """Every time an environment variable is accessed we check to see if it has
-    changed."""
+    """The first time an environment variable is accessed we check to see if it
+    has changed since the last build."""
 
     if filename.startswith("set/"):
       env_name = filename[4:]
@@ -118,12 +161,12 @@ class _WorkingDirMapping(MappedDirectory.Mapping):
     # configured.
     if env_name not in self.__configured_env:
       if filename.startswith("set/"):
-        if env_name in os.environ:
+        if env_name in self.__environ:
           value = "true"
         else:
           value = "false"
       else:
-        value = os.environ.get(env_name, "")
+        value = self.__environ.get(env_name, "")
 
       if not self.__env_dir.exists(filename) or \
          self.__env_dir.read(filename) != value:
@@ -170,6 +213,9 @@ class Configuration(object):
       all_configs[output_path] = self
 
     self.name = output_path
+    # We look at the environment only through this snapshot, taken once per
+    # build, so that every action sees the same thing.
+    self.environ = dict(os.environ)
     self.source_dir = DiskDirectory(".")
     if output_path is None:
       self.output_dir = self.source_dir
@@ -180,6 +226,8 @@ class Configuration(object):
     self.env_dir = VirtualDirectory()
     _restore_pickle(self.mem_dir, self.output_dir, "mem.pickle")
     _restore_pickle(self.env_dir, self.output_dir, "env.pickle")
+    self.deps_log = DepsLog(self.output_dir.get_disk_path("deps.log"))
+    self.include_cache = IncludeCache()
     self.alt_configs = {}
     self.__make_root_dir()
 
@@ -201,15 +249,59 @@ class Configuration(object):
   def __make_root_dir(self):
     self.mapping = _WorkingDirMapping(self.source_dir, self.output_dir,
                                       self.mem_dir, self.env_dir,
-                                      self.alt_configs)
-    self.root_dir = MappedDirectory(self.mapping)
+                                      self.alt_configs, self.environ)
+    # File metadata is cached for the lifetime of the Configuration, which is
+    # one build.  Runners invalidate the outputs of each action they execute.
+    self.root_dir = StatCachingDirectory(MappedDirectory(self.mapping))
+    self.__make_subprocess_env()
+
+  def __make_subprocess_env(self):
+    """Computes subprocess_env, the environment in which commands run, and
+    subprocess_env_digest.  The latter is None unless the environment was
+    restricted to an allow-list using "sebs configure --allow_env", in which
+    case it is a hash of the whole environment that commands see.  Since such
+    an environment includes nothing incidental, the hash can safely be part of
+    each action's cache key, so that changing one of the allowed variables
+    causes everything to be rebuilt."""
+
+    allowed = self.allowed_env()
+    if allowed is None:
+      self.subprocess_env = subprocess_environment(self.environ)
+      self.subprocess_env_digest = None
+    else:
+      environ = {}
+      for name in allowed:
+        if name in self.environ:
+          environ[name] = self.environ[name]
+      self.subprocess_env = subprocess_environment(environ)
+
+      hasher = hashlib.md5()
+      for name, value in sorted(self.subprocess_env.items()):
+        hasher.update("%d %s%d %s" % (len(name), name, len(value), value))
+      self.subprocess_env_digest = hasher.digest()
+
+  def allowed_env(self):
+    """Returns the list of environment variables which commands may see, or
+    None if they see the whole environment."""
+
+    if self.env_dir.exists("$allowed_env"):
+      allowed = self.env_dir.read("$allowed_env")
+      if allowed != "":
+        return allowed.split(",")
+    return None
 
   def save(self):
+    self.deps_log.close()
     if not self.mem_dir.empty():
       _save_pickle(self.mem_dir, self.root_dir, "mem.pickle")
     if not self.env_dir.empty():
       _save_pickle(self.env_dir, self.root_dir, "env.pickle")
 
+  def sync(self):
+    """Flushes files written to the output directory during this build to
+    permanent storage.  See Directory.sync()."""
+    self.output_dir.sync()
+
   def getenv(self, name):
     if self.root_dir.read("env/set/" + name) == "true":
       return self.root_dir.read("env/" + name)
@@ -221,11 +313,13 @@ class Configuration(object):
       if self.root_dir.exists(dir):
         shutil.rmtree(self.root_dir.get_disk_path(dir))
 
-    for file in [ "mem.pickle", "env.pickle" ]:
+    self.deps_log.close()
+    for file in [ "mem.pickle", "env.pickle", "deps.log" ]:
       if self.root_dir.exists(file):
         os.remove(self.root_dir.get_disk_path(file))
 
     self.mem_dir = VirtualDirectory()
+    self.deps_log = DepsLog(self.output_dir.get_disk_path("deps.log"))
 
     if expunge:
       # Try to remove the output directory itself -- will fail if not empty.
@@ -241,8 +335,9 @@ class Configuration(object):
       # Restore the parts of env.pickle that were set explicitly.
       new_env_dir = VirtualDirectory()
 
-      if self.env_dir.exists("$mappings"):
-        new_env_dir.write("$mappings", self.env_dir.read("$mappings"))
+      for name in ["$mappings", "$allowed_env"]:
+        if self.env_dir.exists(name):
+          new_env_dir.write(name, self.env_dir.read(name))
       if self.env_dir.exists("$config"):
         locked_vars = self.env_dir.read("$config")
         new_env_dir.write("$config", locked_vars)
@@ -33,6 +33,8 @@
 Implements fancy console output.
 """
 
+import threading
+
 from helpers import typecheck
 
 class ColoredText(object):
@@ -73,6 +75,12 @@ class Console(object):
 
     raise NotImplementedError
 
+  def flush(self):
+    """Makes sure everything written so far is actually shown.  Call this
+    before writing to the same output by other means, and when done."""
+
+    raise NotImplementedError
+
 def make_console(out):
   if out.isatty():
     return _AnsiConsole(out)
@@ -119,6 +127,9 @@ class _SerialConsole(Console):
     self.__out.write(_add_newline(self.__format_text(final_text)))
     self.__out.flush()
 
+  def flush(self):
+    self.__out.flush()
+
   def __format_text(self, text):
     if isinstance(text, basestring):
       return text
@@ -196,43 +207,152 @@ class _LineLimiter(object):
     else:
       self.out.write(text)
 
+class _BufferedWriter(object):
+  """Collects written text in memory until take() is called."""
+
+  def __init__(self):
+    self.__parts = []
+
+  def write(self, text):
+    self.__parts.append(text)
+
+  def take(self):
+    result = "".join(self.__parts)
+    self.__parts = []
+    return result
+
 class _AnsiConsole(Console):
-  def __init__(self, out):
+  """Keeps pending lines at the bottom of the terminal.  Redrawing them on
+  every change would make the terminal the bottleneck when many actions run
+  at once, so changes are only recorded in memory, and a separate thread
+  repaints at most once per |frame_interval| seconds.  Finished lines and
+  written text are buffered and inserted above the pending lines with the
+  next repaint."""
+
+  def __init__(self, out, frame_interval = 0.05):
     self.__out = out
+    self.__frame_interval = frame_interval
     self.__pending = []
     self.pending_lines = 0
 
+    # Protects everything below, and the text of pending messages.
+    self.__lock = threading.Lock()
+    # Text to insert above the pending lines on the next repaint.
+    self.__buffer = _BufferedWriter()
+    # True if the screen doesn't reflect the latest changes.
+    self.__dirty = False
+    # Thread which repaints the screen, or None if nothing has changed since
+    # it last ran.  It exits once a frame passes without changes.
+    self.__painter = None
+    # Notified by flush() to let the painter exit without waiting for the
+    # rest of its frame.
+    self.__wakeup = threading.Condition(self.__lock)
+
+    # Held while writing to |out|, so that only one thread paints at a time.
+    self.__paint_lock = threading.Lock()
+
   def write(self, text):
-    self.__clear_pending()
-    self.__format_text(self.__out, text)
-    self.__write_pending()
+    self.__lock.acquire()
+    try:
+      self.__format_text(self.__buffer, text)
+      self.__changed()
+    finally:
+      self.__lock.release()
 
   def add_pending(self, text):
-    self.__clear_pending()
-    result = _AnsiPendingMessage(self, text)
-    self.__pending.append(result)
-    self.__write_pending()
+    self.__lock.acquire()
+    try:
+      result = _AnsiPendingMessage(self, text)
+      self.__pending.append(result)
+      self.__changed()
+    finally:
+      self.__lock.release()
     return result
 
   def _update_pending(self, pending_message):
-    self.__clear_pending()
-    self.__write_pending()
+    self.__lock.acquire()
+    try:
+      self.__changed()
+    finally:
+      self.__lock.release()
 
   def _finish_pending(self, pending_message, final_text):
-    self.__clear_pending()
-    self.__pending.remove(pending_message)
-    self.__format_text(self.__out, final_text)
-    self.__write_pending()
-
-  def __clear_pending(self):
+    self.__lock.acquire()
+    try:
+      self.__pending.remove(pending_message)
+      self.__format_text(self.__buffer, final_text)
+      self.__changed()
+    finally:
+      self.__lock.release()
+
+  def flush(self):
+    self.__paint()
+
+    self.__lock.acquire()
+    try:
+      painter = self.__painter
+      self.__wakeup.notify()
+    finally:
+      self.__lock.release()
+
+    # The painter is idle now, so wait for it to exit rather than leave it
+    # running while the program shuts down.
+    if painter is not None and painter is not threading.currentThread():
+      painter.join()
+
+  def __changed(self):
+    # Must be called with the lock held.
+    self.__dirty = True
+    if self.__painter is None:
+      self.__painter = threading.Thread(target = self.__paint_loop)
+      self.__painter.setDaemon(True)
+      self.__painter.start()
+
+  def __paint_loop(self):
+    self.__lock.acquire()
+    try:
+      while self.__dirty:
+        self.__lock.release()
+        try:
+          self.__paint()
+        finally:
+          self.__lock.acquire()
+        # Anything which changes while we wait is painted in one go.
+        self.__wakeup.wait(self.__frame_interval)
+      self.__painter = None
+    finally:
+      self.__lock.release()
+
+  def __paint(self):
+    self.__paint_lock.acquire()
+    try:
+      frame = _BufferedWriter()
+      self.__lock.acquire()
+      try:
+        if not self.__dirty:
+          return
+        self.__dirty = False
+        self.__clear_pending(frame)
+        frame.write(self.__buffer.take())
+        self.__write_pending(frame)
+      finally:
+        self.__lock.release()
+
+      # Write the whole frame at once, without holding up other threads.
+      self.__out.write(frame.take())
+      self.__out.flush()
+    finally:
+      self.__paint_lock.release()
+
+  def __clear_pending(self, out):
     if self.pending_lines > 0:
-      self.__out.write(_ANSI_MOVE_CURSOR_UP % self.pending_lines)
-      self.__out.write(_ANSI_CLEAR_BELOW_CURSOR)
+      out.write(_ANSI_MOVE_CURSOR_UP % self.pending_lines)
+      out.write(_ANSI_CLEAR_BELOW_CURSOR)
       self.pending_lines = 0
 
-  def __write_pending(self):
+  def __write_pending(self, out):
     if len(self.__pending) > 0:
-      limiter = _LineLimiter(self.__out, 80, "\b\b\b...")
+      limiter = _LineLimiter(out, 80, "\b\b\b...")
 
       for pending_message in self.__pending:
         limiter.write("*")
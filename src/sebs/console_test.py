@@ -0,0 +1,125 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import re
+import threading
+import unittest
+
+from sebs.console import ColoredText, _AnsiConsole
+
+class MockTerminal(object):
+  def __init__(self):
+    self.writes = []
+    self.lock = threading.Lock()
+
+  def write(self, text):
+    self.lock.acquire()
+    try:
+      self.writes.append(text)
+    finally:
+      self.lock.release()
+
+  def flush(self):
+    pass
+
+  def isatty(self):
+    return True
+
+  def text(self):
+    return "".join(self.writes)
+
+class AnsiConsoleTest(unittest.TestCase):
+  def testOutput(self):
+    terminal = MockTerminal()
+    console = _AnsiConsole(terminal)
+
+    console.write("foo")
+    pending = console.add_pending("bar")
+    console.flush()
+    self.assertEquals("foo\n*bar\n", terminal.text())
+
+    pending.update("baz")
+    console.write(ColoredText(ColoredText.RED, "qux"))
+    pending.finish()
+    console.flush()
+
+    # The pending line is cleared, then the new text written in its place.
+    self.assertEquals("foo\n*bar\n"
+                      "\033[1F\033[0J"
+                      "\033[31mqux\n\033[0m"
+                      "baz\n", terminal.text())
+    self.assertEquals(0, console.pending_lines)
+
+  def testRateLimit(self):
+    terminal = MockTerminal()
+    # Long enough that nothing after the first change is painted before
+    # flush().
+    console = _AnsiConsole(terminal, frame_interval = 60)
+
+    pending = [console.add_pending("action %d" % i) for i in range(100)]
+    for i in range(100):
+      console.write("line %d" % i)
+      pending[i].update("updated %d" % i)
+      pending[i].finish()
+
+    self.assertTrue(len(terminal.writes) <= 1)
+
+    console.flush()
+    self.assertTrue(len(terminal.writes) <= 2)
+    self.assertTrue(terminal.text().endswith("line 99\nupdated 99\n"))
+
+  def testConcurrentWriters(self):
+    terminal = MockTerminal()
+    console = _AnsiConsole(terminal, frame_interval = 0.001)
+
+    def write_lines(prefix):
+      for i in range(200):
+        console.add_pending("%s%d" % (prefix, i)).finish()
+
+    threads = [threading.Thread(target = write_lines, args = [prefix])
+               for prefix in "abcd"]
+    for thread in threads:
+      thread.start()
+    for thread in threads:
+      thread.join()
+    console.flush()
+
+    # Drop control codes and pending lines; each finished line should appear
+    # exactly once, in order.
+    text = re.sub("\033\\[[0-9]*[A-Za-z]", "", terminal.text())
+    lines = [line for line in text.split("\n") if not line.startswith("*")]
+    for prefix in "abcd":
+      self.assertEquals(["%s%d" % (prefix, i) for i in range(200)],
+                        [line for line in lines if line.startswith(prefix)])
+
+if __name__ == "__main__":
+  unittest.main()
@@ -225,7 +225,9 @@ class Context(object):
                    was invoked).  Useful for error messages.
     directory      The directory (relative to "src") containing the SEBS
                    file.
-    timestamp      The last modification time of the SEBS file."""
+    timestamp      The last modification time of the SEBS file.
+    build_files    The set of full filenames of the SEBS file and all of the
+                   files it imports, directly or indirectly."""
 
   __current_context = None
 
@@ -450,6 +452,12 @@ class ArgumentSpec(object):
       spec = self.spec_map[name]
       if isinstance(spec, tuple):
         arg_type = spec[0]
+        if value is None and spec[1] is None:
+          # Passing None explicitly is the same as omitting an argument which
+          # defaults to None.  This lets rules pass their arguments on to
+          # other rules, as cpp.Test does.
+          result.__dict__[name] = None
+          continue
       else:
         arg_type = spec
       result.__dict__[name] = self.__validate_arg(
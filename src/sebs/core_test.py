@@ -107,6 +107,13 @@ class CoreTest(unittest.TestCase):
     self.assertEqual(None, rule.args.artifact_arg)
     self.assertEqual([], rule.args.list_artifact_arg)
 
+    # Explicit None is OK for arguments that default to None.
+    rule = MockRule(context = context, artifact_arg = None)
+    rule.expand_once()
+    self.assertEqual(None, rule.args.artifact_arg)
+    self.assertRaises(TypeError,
+        MockRule(context = context, int_arg = None).expand_once)
+
     # Set everything.
     rule = MockRule(context = context,
                     int_arg = 123,
@@ -124,6 +124,94 @@ expect_contains output.txt '> PASS: test: sebs/cpp_test/cpp_test.sebs:passing_te
 expect_contains tmp/sebs/cpp_test/passing_test_output.txt \
   '^BarFunction(test) FooFunction(test) $'
 
+echo "Running test with precompiled header..."
+
+expect_success "$SEBS test sebs/cpp_test/cpp_test.sebs:pch_test"
+
+expect_contains output.txt '> precompile: src/sebs/cpp_test/pch.h$'
+expect_contains output.txt '> PASS: test: sebs/cpp_test/cpp_test.sebs:pch_test$'
+
+expect_contains tmp/sebs/cpp_test/pch_test_output.txt \
+  '^BarFunction(pch) '
+
+echo "Running test linked against a thin archive..."
+
+expect_success "$SEBS test sebs/cpp_test/cpp_test.sebs:thin_test"
+
+expect_contains output.txt '> PASS: test: sebs/cpp_test/cpp_test.sebs:thin_test$'
+expect_contains tmp/sebs/cpp_test/thin_test_output.txt '^BazFunction(thin) '
+
+echo "Running test linked against a shared library..."
+
+expect_success "$SEBS test sebs/cpp_test/cpp_test.sebs:shared_test"
+
+expect_contains output.txt '> PASS: test: sebs/cpp_test/cpp_test.sebs:shared_test$'
+expect_contains tmp/sebs/cpp_test/shared_test_output.txt '^QuxFunction(shared) '
+expect_success "test -e lib/sebs/cpp_test/libqux.so"
+
+echo "Running sharded test..."
+
+expect_success "$SEBS test -j3 --test_jobs=2 sebs/cpp_test/cpp_test.sebs:sharded_test"
+
+expect_contains output.txt 'test: sebs/cpp_test/cpp_test.sebs:sharded_test (shard 3 of 3)$'
+expect_contains output.txt '> PASS: merge: sebs/cpp_test/cpp_test.sebs:sharded_test$'
+expect_contains tmp/sebs/cpp_test/sharded_test_output.txt '^==== shard 3 of 3 ====$'
+expect_contains tmp/sebs/cpp_test/sharded_test_output.txt '^case 5$'
+
+echo "Running unity build test..."
+
+expect_success "$SEBS test sebs/cpp_test/cpp_test.sebs:unity_test"
+
+expect_contains output.txt '> PASS: test: sebs/cpp_test/cpp_test.sebs:unity_test$'
+expect_success "test -e tmp/sebs/cpp_test/unity_test_unity_0.o"
+expect_success "test -e tmp/sebs/cpp_test/unity_test_unity_1.o"
+
+echo "Building through the compile cache..."
+
+export COMPILE_CACHE_DIR=$PWD/tmp/compile_cache
+expect_success "$SEBS build sebs/cpp_test/cpp_test.sebs:cached_prog"
+expect_success "bin/sebs/cpp_test/sebs_cpp_cached_test"
+expect_contains output.txt '^BarFunction(cached) '
+expect_success "test -d tmp/compile_cache"
+
+# A fresh object should be copied out of the cache.
+rm tmp/sebs/cpp_test/cached_main.o
+expect_success "$SEBS build sebs/cpp_test/cpp_test.sebs:cached_prog"
+expect_success "test -e tmp/sebs/cpp_test/cached_main.o"
+unset COMPILE_CACHE_DIR
+
+echo "Building with split DWARF..."
+
+# Modification times are compared to the second, so make sure changing the
+# option looks newer than what was built with it.
+sleep 1
+export SPLIT_DWARF=true
+expect_success "$SEBS test sebs/cpp_test/cpp_test.sebs:unity_test"
+expect_contains output.txt '> PASS: test: sebs/cpp_test/cpp_test.sebs:unity_test$'
+expect_success "test -s tmp/sebs/cpp_test/unity_test_unity_0.dwo"
+
+# Editing a source recompiles its whole batch, rewriting the batch's .dwo
+# rather than splitting the source out into a part with a .dwo of its own.
+touch -d 2000-01-01 tmp/sebs/cpp_test/unity_test_unity_0.dwo old_marker
+sleep 1
+touch src/sebs/cpp_test/foo.cc
+expect_success "$SEBS test sebs/cpp_test/cpp_test.sebs:unity_test"
+expect_success "test tmp/sebs/cpp_test/unity_test_unity_0.dwo -nt old_marker"
+expect_success "test ! -e tmp/sebs/cpp_test/unity_test_unity_0.o.parts"
+rm old_marker
+
+export COMPILE_CACHE_DIR=$PWD/tmp/compile_cache
+expect_success "$SEBS build sebs/cpp_test/cpp_test.sebs:cached_prog"
+expect_success "test -s tmp/sebs/cpp_test/cached_main.dwo"
+sleep 1
+unset SPLIT_DWARF
+
+# Without split DWARF, the .dwo is empty rather than stale.
+expect_success "$SEBS build sebs/cpp_test/cpp_test.sebs:cached_prog"
+expect_success "test -e tmp/sebs/cpp_test/cached_main.dwo"
+expect_success "test ! -s tmp/sebs/cpp_test/cached_main.dwo"
+unset COMPILE_CACHE_DIR
+
 echo "Running failing test..."
 
 expect_failure "$SEBS test sebs/cpp_test/cpp_test.sebs:failing_test"
@@ -0,0 +1,237 @@
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""A compact, persistent record of the dependency lists of actions.
+
+Parsing each action's dep file (see DepFileCommand) every time the build
+decides whether the action is up-to-date means reading and tokenizing
+thousands of small files per build.  A DepsLog keeps the parsed lists in a
+single binary file per configuration instead.  It is loaded in one read the
+first time it is needed, then each lookup is a dictionary access plus a check
+that the dep file hasn't changed since it was recorded, which costs a stat()
+the builder has usually cached already.  A dep file counts as changed if its
+mtime or its size differs, so that rewriting it within the filesystem's
+timestamp granularity is still usually noticed.
+
+The builder records a dep file when the action writing it completes.
+
+The file is a header followed by records, which are only ever appended:
+
+  path record:  uint32 length, then that many bytes of path.  Paths are
+                numbered in the order they appear, starting from zero.
+  deps record:  uint32 (0x80000000 | length), then the dep file's path id,
+                its mtime as a double, its size as a uint64, and one uint32
+                path id per dependency.
+
+All integers are little-endian.  When a dep file is recorded again, the newer
+record wins; once most records are stale the file is rewritten.  A record
+truncated by a crash is dropped.
+"""
+
+import os
+import struct
+import threading
+
+_MAGIC = "# sebs deps\n"
+_VERSION = 2
+_HEADER = _MAGIC + struct.pack("<I", _VERSION)
+_DEPS_FLAG = 0x80000000
+# Size of a deps record before its dependency ids.
+_DEPS_HEADER_SIZE = struct.calcsize("<IdQ")
+
+# Don't bother compacting logs with fewer records than this.
+_MIN_COMPACTION_RECORDS = 1000
+
+def parse_dep_file(text):
+  """Returns the list of files named as dependencies in |text|, which looks
+  like:
+    foo.o: foo.h bar.h \\
+      baz.h qux.h"""
+
+  text = text.replace("\\\n", " ")  # remove escaped newlines
+  # Skip tokens like "foo.o:".  The rest are files.
+  return [part for part in text.split() if not part.endswith(":")]
+
+class DepsLog(object):
+  def __init__(self, filename):
+    self.__filename = filename
+    self.__lock = threading.Lock()
+    self.__loaded = False
+    self.__file = None
+
+    # Path table:  ids to paths and back.
+    self.__paths = []
+    self.__path_ids = {}
+    # Maps dep file paths to (mtime, size, [dependency paths]).
+    self.__entries = {}
+    # Number of deps records in the file, including stale ones.
+    self.__record_count = 0
+
+  def lookup(self, name, mtime, size):
+    """Returns the dependencies recorded for the dep file |name|, or None if
+    there is no record of it or it has changed since (i.e. its mtime is no
+    longer |mtime| or its size is no longer |size|)."""
+
+    self.__lock.acquire()
+    try:
+      self.__load()
+      entry = self.__entries.get(name)
+    finally:
+      self.__lock.release()
+
+    if entry is None or entry[0] != mtime or entry[1] != size:
+      return None
+    return entry[2]
+
+  def record(self, name, mtime, size, deps):
+    """Records that the dep file |name|, last modified at |mtime| and |size|
+    bytes long, lists |deps|."""
+
+    self.__lock.acquire()
+    try:
+      self.__load()
+      if self.__entries.get(name) == (mtime, size, deps):
+        return
+      if self.__file is None:
+        self.__open_for_append()
+      self.__write_deps(self.__file, name, mtime, size, deps)
+    finally:
+      self.__lock.release()
+
+  def close(self):
+    self.__lock.acquire()
+    try:
+      if self.__file is not None:
+        self.__file.close()
+        self.__file = None
+    finally:
+      self.__lock.release()
+
+  def __load(self):
+    if self.__loaded:
+      return
+    self.__loaded = True
+
+    if not os.path.exists(self.__filename):
+      return
+    file = open(self.__filename, "rb")
+    data = file.read()
+    file.close()
+
+    if not data.startswith(_HEADER):
+      # Unknown version or garbage.  It's only a cache, so start over.
+      os.remove(self.__filename)
+      return
+
+    unpack_from = struct.unpack_from
+    pos = len(_HEADER)
+    end = len(data)
+    paths = self.__paths
+    while pos + 4 <= end:
+      (size,) = unpack_from("<I", data, pos)
+      is_deps = size & _DEPS_FLAG
+      size &= ~_DEPS_FLAG
+      if pos + 4 + size > end:
+        break
+      pos += 4
+      if is_deps:
+        if size < _DEPS_HEADER_SIZE or \
+           (size - _DEPS_HEADER_SIZE) % 4 != 0:
+          break
+        count = (size - _DEPS_HEADER_SIZE) / 4
+        values = unpack_from("<IdQ%dI" % count, data, pos)
+        try:
+          self.__entries[paths[values[0]]] = \
+              (values[1], values[2], [paths[id] for id in values[3:]])
+        except IndexError:
+          break
+        self.__record_count += 1
+      else:
+        path = data[pos:pos + size]
+        self.__path_ids[path] = len(paths)
+        paths.append(path)
+      pos += size
+
+    if pos != end:
+      # Drop a partial record at the end, left by a crash, so that we can
+      # append after it.
+      file = open(self.__filename, "r+b")
+      file.truncate(pos)
+      file.close()
+
+    if self.__record_count > _MIN_COMPACTION_RECORDS and \
+       self.__record_count > 3 * len(self.__entries):
+      self.__compact()
+
+  def __open_for_append(self):
+    if os.path.exists(self.__filename):
+      self.__file = open(self.__filename, "ab")
+    else:
+      self.__file = open(self.__filename, "wb")
+      self.__file.write(_HEADER)
+
+  def __compact(self):
+    """Rewrites the file with only the current records."""
+
+    entries = self.__entries
+    self.__paths = []
+    self.__path_ids = {}
+    self.__entries = {}
+    self.__record_count = 0
+
+    temp_name = self.__filename + ".tmp"
+    file = open(temp_name, "wb")
+    file.write(_HEADER)
+    for name, (mtime, size, deps) in entries.iteritems():
+      self.__write_deps(file, name, mtime, size, deps)
+    file.close()
+    os.rename(temp_name, self.__filename)
+
+  def __path_id(self, file, path):
+    id = self.__path_ids.get(path)
+    if id is None:
+      id = len(self.__paths)
+      file.write(struct.pack("<I", len(path)))
+      file.write(path)
+      self.__paths.append(path)
+      self.__path_ids[path] = id
+    return id
+
+  def __write_deps(self, file, name, mtime, size, deps):
+    name_id = self.__path_id(file, name)
+    dep_ids = [self.__path_id(file, dep) for dep in deps]
+    file.write(struct.pack("<IIdQ%dI" % len(dep_ids),
+                           _DEPS_FLAG | (_DEPS_HEADER_SIZE + 4 * len(dep_ids)),
+                           name_id, mtime, size, *dep_ids))
+    # Store the interned copies.
+    self.__entries[name] = (mtime, size, [self.__paths[id] for id in dep_ids])
+    self.__record_count += 1
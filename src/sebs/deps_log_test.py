@@ -0,0 +1,154 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import struct
+import tempfile
+import unittest
+
+from sebs import deps_log
+from sebs.deps_log import DepsLog, parse_dep_file
+
+class ParseDepFileTest(unittest.TestCase):
+  def testParse(self):
+    self.assertEquals(["foo.cc", "foo.h", "bar.h", "baz.h"],
+                      parse_dep_file("foo.o: foo.cc foo.h \\\n  bar.h\n"
+                                     "baz.h\n"))
+    self.assertEquals([], parse_dep_file(""))
+
+class DepsLogTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.filename = os.path.join(self.dir, "deps.log")
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def testRecordAndLookup(self):
+    log = DepsLog(self.filename)
+    self.assertTrue(log.lookup("foo.o.d", 12.5, 30) is None)
+    log.record("foo.o.d", 12.5, 30, ["foo.cc", "common.h"])
+    log.record("bar.o.d", 13.0, 30, ["bar.cc", "common.h"])
+    self.assertEquals(["foo.cc", "common.h"], log.lookup("foo.o.d", 12.5, 30))
+    log.close()
+
+    log = DepsLog(self.filename)
+    self.assertEquals(["foo.cc", "common.h"], log.lookup("foo.o.d", 12.5, 30))
+    self.assertEquals(["bar.cc", "common.h"], log.lookup("bar.o.d", 13.0, 30))
+    # Paths are interned.
+    self.assertTrue(log.lookup("foo.o.d", 12.5, 30)[1] is
+                    log.lookup("bar.o.d", 13.0, 30)[1])
+    # A changed dep file doesn't match, even if its mtime is the same.
+    self.assertTrue(log.lookup("foo.o.d", 14.0, 30) is None)
+    self.assertTrue(log.lookup("foo.o.d", 12.5, 31) is None)
+    log.close()
+
+  def testNewerRecordWins(self):
+    log = DepsLog(self.filename)
+    log.record("foo.o.d", 1.0, 30, ["foo.cc", "old.h"])
+    log.record("foo.o.d", 2.0, 30, ["foo.cc", "new.h"])
+    log.close()
+
+    log = DepsLog(self.filename)
+    self.assertTrue(log.lookup("foo.o.d", 1.0, 30) is None)
+    self.assertEquals(["foo.cc", "new.h"], log.lookup("foo.o.d", 2.0, 30))
+    log.close()
+
+  def testTruncatedRecord(self):
+    log = DepsLog(self.filename)
+    log.record("foo.o.d", 1.0, 30, ["foo.cc"])
+    log.record("bar.o.d", 1.0, 30, ["bar.cc"])
+    log.close()
+
+    # Chop off part of the last record, as if we crashed while writing it.
+    size = os.path.getsize(self.filename)
+    file = open(self.filename, "r+b")
+    file.truncate(size - 3)
+    file.close()
+
+    log = DepsLog(self.filename)
+    self.assertEquals(["foo.cc"], log.lookup("foo.o.d", 1.0, 30))
+    self.assertTrue(log.lookup("bar.o.d", 1.0, 30) is None)
+    log.record("baz.o.d", 1.0, 30, ["baz.cc"])
+    log.close()
+
+    log = DepsLog(self.filename)
+    self.assertEquals(["foo.cc"], log.lookup("foo.o.d", 1.0, 30))
+    self.assertEquals(["baz.cc"], log.lookup("baz.o.d", 1.0, 30))
+    log.close()
+
+  def testBadHeader(self):
+    file = open(self.filename, "wb")
+    file.write("garbage")
+    file.close()
+
+    log = DepsLog(self.filename)
+    self.assertTrue(log.lookup("foo.o.d", 1.0, 30) is None)
+    log.record("foo.o.d", 1.0, 30, ["foo.cc"])
+    log.close()
+
+    log = DepsLog(self.filename)
+    self.assertEquals(["foo.cc"], log.lookup("foo.o.d", 1.0, 30))
+    log.close()
+
+  def testOldVersion(self):
+    file = open(self.filename, "wb")
+    file.write(deps_log._MAGIC + struct.pack("<I", 1))
+    file.write(struct.pack("<I", 7) + "foo.o.d")
+    file.close()
+
+    # It's only a cache, so the old file is simply discarded.
+    log = DepsLog(self.filename)
+    self.assertTrue(log.lookup("foo.o.d", 1.0, 30) is None)
+    log.close()
+    self.assertFalse(os.path.exists(self.filename))
+
+  def testCompaction(self):
+    log = DepsLog(self.filename)
+    for i in range(deps_log._MIN_COMPACTION_RECORDS * 2):
+      log.record("foo.o.d", float(i), 30, ["foo.cc", "foo.h"])
+    log.close()
+    size = os.path.getsize(self.filename)
+
+    log = DepsLog(self.filename)
+    last = float(deps_log._MIN_COMPACTION_RECORDS * 2 - 1)
+    self.assertEquals(["foo.cc", "foo.h"], log.lookup("foo.o.d", last, 30))
+    log.close()
+    self.assertTrue(os.path.getsize(self.filename) < size / 100)
+
+    log = DepsLog(self.filename)
+    self.assertEquals(["foo.cc", "foo.h"], log.lookup("foo.o.d", last, 30))
+    log.close()
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,106 @@
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Depsets:  immutable sets of items which share structure with each other.
+
+A rule which collects something from all of its transitive dependencies --
+libraries to link, generated headers, etc. -- would naively copy each
+dependency's collection into its own, which costs time and memory quadratic
+in the depth of the dependency graph.  A Depset instead holds its own direct
+items plus references to its dependencies' Depsets, forming a DAG which is
+only flattened when the complete list is actually needed (e.g. once per
+link).
+"""
+
+class Depset(object):
+  """An immutable set made up of |direct| items plus the contents of the
+  Depsets in |transitive|.
+
+  to_list() orders the items topologically:  each node's direct items come
+  before the items of the Depsets it includes, and an item reachable along
+  several paths appears only once, after everything that leads to it.  So if
+  each library's Depset has the library as a direct item and its
+  dependencies' Depsets as transitive, the list is in the order the linker
+  needs.  Otherwise, earlier direct and transitive elements come first."""
+
+  __slots__ = ["__direct", "__transitive", "__list"]
+
+  def __init__(self, direct = [], transitive = []):
+    # Within the direct items, only the first occurrence of each counts.
+    seen = set()
+    self.__direct = tuple(
+        [item for item in direct if not (item in seen or seen.add(item))])
+    # Dropping empty Depsets keeps chains of rules which add nothing from
+    # deepening the DAG.
+    self.__transitive = tuple(
+        [depset for depset in transitive if not depset.is_empty()])
+    self.__list = None
+
+  def is_empty(self):
+    return len(self.__direct) == 0 and len(self.__transitive) == 0
+
+  def to_list(self):
+    """Returns the items as a list, computed on the first call and cached."""
+
+    if self.__list is None:
+      # Compute a post-order traversal of the DAG -- in which each item
+      # comes after everything it leads to -- visiting everything backwards,
+      # then reverse it.  An explicit stack avoids Python's recursion limit
+      # on deep graphs.
+      result = []
+      seen_items = set()
+      seen_nodes = set()
+      stack = [(self, False)]
+      while len(stack) > 0:
+        (node, children_done) = stack.pop()
+        if children_done:
+          for item in reversed(node.__direct):
+            if item not in seen_items:
+              seen_items.add(item)
+              result.append(item)
+        elif node not in seen_nodes:
+          seen_nodes.add(node)
+          stack.append((node, True))
+          for child in node.__transitive:
+            stack.append((child, False))
+      result.reverse()
+      self.__list = result
+    return list(self.__list)
+
+  def __iter__(self):
+    return iter(self.to_list())
+
+  def __len__(self):
+    return len(self.to_list())
+
+  def __repr__(self):
+    return "Depset(%r)" % self.to_list()
@@ -0,0 +1,77 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+from sebs.depset import Depset
+
+class DepsetTest(unittest.TestCase):
+  def testEmpty(self):
+    self.assertTrue(Depset().is_empty())
+    self.assertTrue(Depset([], [Depset(), Depset()]).is_empty())
+    self.assertEquals([], Depset().to_list())
+
+  def testOrder(self):
+    self.assertEquals(["a", "b", "c", "d"],
+                      Depset(["a", "b"], [Depset(["c"]), Depset(["d"])])
+                        .to_list())
+
+  def testDiamond(self):
+    # Each library comes before everything it depends on, and only once.
+    base = Depset(["base"])
+    left = Depset(["left"], [base])
+    right = Depset(["right"], [base])
+    top = Depset(["top"], [left, right])
+    self.assertEquals(["top", "left", "right", "base"], top.to_list())
+
+    # A dependency of a later library still ends up after the earlier ones.
+    other = Depset(["other"], [right])
+    self.assertEquals(["left", "other", "right", "base"],
+                      Depset([], [left, other]).to_list())
+
+  def testDuplicateDirectItems(self):
+    self.assertEquals(["a", "b"], Depset(["a", "b", "a"]).to_list())
+
+  def testDeepChain(self):
+    # Flattening must not recurse once per level.
+    depset = Depset()
+    for i in range(5000):
+      depset = Depset([i], [depset])
+    self.assertEquals(range(4999, -1, -1), depset.to_list())
+
+  def testResultIsCopy(self):
+    depset = Depset(["a"])
+    depset.to_list().append("b")
+    self.assertEquals(["a"], depset.to_list())
+
+if __name__ == "__main__":
+  unittest.main()
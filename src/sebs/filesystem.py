@@ -29,13 +29,22 @@
 # (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
+import errno
 import glob
 import os
 import shutil
+import stat as statmodule
+import tempfile
 import time
 
 from sebs.helpers import typecheck
 
+try:
+  import fcntl
+except ImportError:
+  # Not a Unix system.
+  fcntl = None
+
 class Directory(object):
   """Abstract base class for a directory in which builds may be performed."""
 
@@ -56,6 +65,25 @@ class Directory(object):
     1970."""
     raise NotImplementedError
 
+  def getmtime_if_exists(self, filename):
+    """Like getmtime(), but returns None if the file does not exist rather than
+    raising an error.  Equivalent to calling exists() followed by getmtime(),
+    but subclasses may implement it with a single lookup."""
+
+    if self.exists(filename):
+      return self.getmtime(filename)
+    else:
+      return None
+
+  def getsize_if_exists(self, filename):
+    """Returns the size of the file in bytes, or None if it does not exist.
+    The default implementation reads the whole file."""
+
+    if self.exists(filename):
+      return len(self.read(filename))
+    else:
+      return None
+
   def touch(self, filename, mtime=None):
     """Set the modification time of the file to the current time, or to mtime
     if given."""
@@ -101,6 +129,58 @@ class Directory(object):
     iterator over matching filenames."""
     raise NotImplementedError
 
+  def invalidate(self, filename):
+    """Indicates that the given file may have been modified by something other
+    than this object, e.g. by a subprocess.  Directories which cache file
+    metadata must forget what they know about the file.  The default
+    implementation does nothing."""
+    pass
+
+  def sync(self):
+    """Makes sure that everything written with write(), or reported modified
+    with invalidate(), since the last call to sync() has actually reached
+    permanent storage, along with the directory entries naming it.  The
+    default implementation does nothing."""
+    pass
+
+def _get_umask():
+  # There is no way to read the umask without also setting it, so we only do
+  # it once, before any other threads exist.
+  mask = os.umask(0)
+  os.umask(mask)
+  return mask
+
+_UMASK = _get_umask()
+
+# ioctl from linux/fs.h which makes the destination file share the source
+# file's data blocks (a "reflink", as in "cp --reflink"), on filesystems that
+# support it, e.g. btrfs and XFS.
+_FICLONE = 0x40049409
+
+# Much larger than shutil's default, so that large files are copied with few
+# system calls.
+_COPY_BUFFER_SIZE = 1 << 20
+
+def _copy_file_contents(source, dest):
+  """Copies the contents of the file object |source|, starting from its current
+  seek point, into the empty file object |dest|.  Avoids copying the data
+  through our address space if the OS and filesystem allow it."""
+
+  if fcntl is not None:
+    try:
+      if source.tell() == 0:
+        fcntl.ioctl(dest.fileno(), _FICLONE, source.fileno())
+        source.seek(0, os.SEEK_END)
+        return
+    except (IOError, OSError), e:
+      if e.errno not in (errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV,
+                         errno.EINVAL, errno.EBADF, errno.ENOSYS,
+                         errno.ESPIPE):
+        raise
+      # Not supported here; fall back to copying.
+
+  shutil.copyfileobj(source, dest, _COPY_BUFFER_SIZE)
+
 class DiskDirectory(Directory):
   def __init__(self, path):
     typecheck(path, basestring)
@@ -109,6 +189,12 @@ class DiskDirectory(Directory):
 
     self.__path = os.path.normpath(path)
 
+    # Files written or invalidated since the last sync().  We don't fsync()
+    # each file as it is written since that would make builds dramatically
+    # slower; instead, the caller can choose to sync everything at once at the
+    # end.
+    self.__unsynced_files = set()
+
   def exists(self, filename):
     return os.path.exists(os.path.join(self.__path, filename))
 
@@ -118,6 +204,18 @@ class DiskDirectory(Directory):
   def getmtime(self, filename):
     return os.path.getmtime(os.path.join(self.__path, filename))
 
+  def getmtime_if_exists(self, filename):
+    try:
+      return os.stat(os.path.join(self.__path, filename)).st_mtime
+    except os.error:
+      return None
+
+  def getsize_if_exists(self, filename):
+    try:
+      return os.stat(os.path.join(self.__path, filename)).st_size
+    except os.error:
+      return None
+
   def touch(self, filename, mtime=None):
     path = os.path.join(self.__path, filename)
     if mtime is None:
@@ -143,15 +241,69 @@ class DiskDirectory(Directory):
     if not os.path.exists(dirname):
       os.makedirs(dirname)
 
-    # TODO(kenton):  Write to temp file and atomically rename?  Does it matter?
-    dest = open(path, "wb")
-    if isinstance(content, file):
-      shutil.copyfileobj(content, dest)
-    else:
-      dest.write(content)
-    dest.close()
-    if mtime is not None:
-      os.utime(path, (mtime, mtime))
+    # Keep the permissions of the file we're replacing, if any.  Otherwise use
+    # the same permissions open() would have.
+    try:
+      mode = statmodule.S_IMODE(os.stat(path).st_mode)
+    except os.error:
+      mode = 0666 & ~_UMASK
+
+    # Write to a temporary file and then rename it over the destination, so
+    # that if we are interrupted we never leave behind a truncated file with a
+    # fresh timestamp which a later build would think is up-to-date.
+    (fd, temp_path) = tempfile.mkstemp(
+        prefix = "." + os.path.basename(path) + ".", suffix = ".tmp",
+        dir = dirname)
+    try:
+      dest = os.fdopen(fd, "wb")
+      try:
+        if isinstance(content, file):
+          _copy_file_contents(content, dest)
+        else:
+          dest.write(content)
+      finally:
+        dest.close()
+      os.chmod(temp_path, mode)
+      if mtime is not None:
+        os.utime(temp_path, (mtime, mtime))
+      os.rename(temp_path, path)
+    except:
+      os.remove(temp_path)
+      raise
+
+    self.__unsynced_files.add(path)
+
+  def invalidate(self, filename):
+    # Something else, e.g. an action's subprocess, wrote the file, so sync()
+    # has to flush it too.
+    self.__unsynced_files.add(os.path.join(self.__path, filename))
+
+  def sync(self):
+    # fsync() all the files first, then all the directories containing them,
+    # so that the renames are durable too.  Directories up to our own are
+    # included since the build may have created them.
+    dirs = set()
+    for path in self.__unsynced_files:
+      self.__fsync(path)
+      dirname = os.path.dirname(path)
+      while dirname not in dirs and dirname.startswith(self.__path):
+        dirs.add(dirname)
+        dirname = os.path.dirname(dirname)
+    # Directories which were themselves invalidated are done already.
+    for dirname in dirs - self.__unsynced_files:
+      self.__fsync(dirname)
+    self.__unsynced_files = set()
+
+  def __fsync(self, path):
+    try:
+      fd = os.open(path, os.O_RDONLY)
+    except os.error:
+      # File has since been removed; nothing to sync.
+      return
+    try:
+      os.fsync(fd)
+    finally:
+      os.close(fd)
 
   def execfile(self, filename, globals):
     # Can't just call execfile() because we want the filename in tracebacks
@@ -224,6 +376,22 @@ class VirtualDirectory(Directory):
     (mtime, content) = self.__files[filename]
     return mtime
 
+  def getmtime_if_exists(self, filename):
+    typecheck(filename, basestring)
+    entry = self.__files.get(filename)
+    if entry is None:
+      if filename in self.__dirs:
+        raise os.error("Not a file: " + filename)
+      return None
+    return entry[0]
+
+  def getsize_if_exists(self, filename):
+    typecheck(filename, basestring)
+    entry = self.__files.get(filename)
+    if entry is None:
+      return None
+    return len(entry[1])
+
   def touch(self, filename, mtime=None):
     typecheck(filename, basestring)
     if filename not in self.__files:
@@ -298,38 +466,64 @@ class MappedDirectory(Directory):
     super(MappedDirectory, self).__init__()
     self.__mapping = mapping
 
-  def __do_mapping(self, method, filename, *args):
-    (directory, mapped_name) = self.__mapping.map(filename)
-    return getattr(directory, method)(mapped_name, *args)
+  # Each method below calls the mapped directory's method directly rather than
+  # sharing a helper which uses getattr(), since this is the most frequently
+  # executed code in a build.
 
   def exists(self, filename):
-    return self.__do_mapping("exists", filename)
+    (directory, mapped_name) = self.__mapping.map(filename)
+    return directory.exists(mapped_name)
 
   def isdir(self, filename):
-    return self.__do_mapping("isdir", filename)
+    (directory, mapped_name) = self.__mapping.map(filename)
+    return directory.isdir(mapped_name)
 
   def getmtime(self, filename):
-    return self.__do_mapping("getmtime", filename)
+    (directory, mapped_name) = self.__mapping.map(filename)
+    return directory.getmtime(mapped_name)
+
+  def getmtime_if_exists(self, filename):
+    (directory, mapped_name) = self.__mapping.map(filename)
+    return directory.getmtime_if_exists(mapped_name)
+
+  def getsize_if_exists(self, filename):
+    (directory, mapped_name) = self.__mapping.map(filename)
+    return directory.getsize_if_exists(mapped_name)
 
   def touch(self, filename, mtime=None):
-    return self.__do_mapping("touch", filename, mtime)
+    (directory, mapped_name) = self.__mapping.map(filename)
+    return directory.touch(mapped_name, mtime)
 
   def read(self, filename):
-    return self.__do_mapping("read", filename)
+    (directory, mapped_name) = self.__mapping.map(filename)
+    return directory.read(mapped_name)
 
   def write(self, filename, content, mtime=None):
-    return self.__do_mapping("write", filename, content, mtime)
+    (directory, mapped_name) = self.__mapping.map(filename)
+    return directory.write(mapped_name, content, mtime)
 
   def execfile(self, filename, context):
     # TODO(kenton):  The exec'd file will see its own name as the post-mapping
     #   name, not the virtual name.  Do we care?
-    return self.__do_mapping("execfile", filename, context)
+    (directory, mapped_name) = self.__mapping.map(filename)
+    return directory.execfile(mapped_name, context)
 
   def mkdir(self, filename):
-    return self.__do_mapping("mkdir", filename)
+    (directory, mapped_name) = self.__mapping.map(filename)
+    return directory.mkdir(mapped_name)
 
   def get_disk_path(self, filename):
-    return self.__do_mapping("get_disk_path", filename)
+    (directory, mapped_name) = self.__mapping.map(filename)
+    return directory.get_disk_path(mapped_name)
+
+  def invalidate(self, filename):
+    (directory, mapped_name) = self.__mapping.map(filename)
+    return directory.invalidate(mapped_name)
+
+  def sync(self):
+    # We don't know which directories the mapping uses, so we can't do
+    # anything here.  The caller should sync the underlying directories.
+    pass
 
   def expand_glob(self, pattern):
     # We actually have to map back the results, complicating matters.
@@ -344,3 +538,235 @@ class MappedDirectory(Directory):
     prefix = pattern[:-len(mapped_pattern)]
     for mapped_name in directory.expand_glob(mapped_pattern):
       yield prefix + mapped_name
+
+class StatCache(object):
+  """Caches the results of stat()ing files on disk, so that each path is
+  stat()ed at most once until it is invalidated.  The first time a file in
+  some particular directory is looked up, the directory's listing is read and
+  cached as well; after that, files in the same directory which do not exist
+  can be answered without any system calls at all.
+
+  Paths are normalized before lookup, so "./foo/bar" and "foo/bar" share an
+  entry.  The cache does not notice changes made by other processes, so callers
+  must invalidate() paths which they know have been modified."""
+
+  def __init__(self):
+    # Maps normalized paths to os.stat() results, or None if the file does not
+    # exist.
+    self.__stats = {}
+    # Maps normalized directory names to sets of entry names, or None if the
+    # directory could not be listed.
+    self.__listings = {}
+
+  def stat(self, path):
+    """Returns the os.stat() result for the given path, or None if the file
+    does not exist."""
+
+    typecheck(path, basestring)
+    path = os.path.normpath(path)
+
+    try:
+      return self.__stats[path]
+    except KeyError:
+      pass
+
+    (dirname, basename) = os.path.split(path)
+    if basename in ("", ".", ".."):
+      # Can't answer from a listing.
+      result = self.__do_stat(path)
+    else:
+      listing = self.__list(dirname)
+      if listing is not None and basename not in listing:
+        result = None
+      else:
+        result = self.__do_stat(path)
+
+    self.__stats[path] = result
+    return result
+
+  def getmtime(self, path):
+    """Returns the modification time of the given path, or None if it does not
+    exist."""
+
+    result = self.stat(path)
+    if result is None:
+      return None
+    return result.st_mtime
+
+  def invalidate(self, path):
+    """Forget anything known about the given path, including whether it exists
+    in its parent directory."""
+
+    typecheck(path, basestring)
+    path = os.path.normpath(path)
+    self.__stats.pop(path, None)
+    self.__listings.pop(os.path.dirname(path) or ".", None)
+
+  def clear(self):
+    """Forget everything."""
+
+    self.__stats = {}
+    self.__listings = {}
+
+  def __list(self, dirname):
+    if dirname == "":
+      dirname = "."
+
+    try:
+      return self.__listings[dirname]
+    except KeyError:
+      pass
+
+    try:
+      result = set(os.listdir(dirname))
+    except os.error:
+      # Directory doesn't exist or can't be read.  We still cache this answer:
+      # if the directory is later created by an action, the action's outputs
+      # will be invalidated, which invalidates this listing too.
+      result = None
+    self.__listings[dirname] = result
+    return result
+
+  def __do_stat(self, path):
+    try:
+      return os.stat(path)
+    except os.error:
+      return None
+
+class StatCachingDirectory(Directory):
+  """A directory which wraps some other directory and caches metadata --
+  existence, type, and modification time -- of the files within it.  Files that
+  live on disk are stat()ed at most once; virtual files are looked up in the
+  wrapped directory at most once.  The cache is automatically updated when
+  files are modified through this object.  When files are modified by other
+  means (e.g. by a subprocess writing to a disk path) invalidate() must be
+  called.
+
+  A StatCachingDirectory is meant to live for the duration of one build."""
+
+  def __init__(self, directory, stat_cache=None):
+    typecheck(directory, Directory)
+    typecheck(stat_cache, StatCache)
+    super(StatCachingDirectory, self).__init__()
+
+    if stat_cache is None:
+      stat_cache = StatCache()
+
+    self.__directory = directory
+    self.__stat_cache = stat_cache
+    # Maps filenames to (disk_path, mtime, isdir), where disk_path is None for
+    # files that aren't on disk.  For disk files the remaining fields are unused
+    # since the information is kept in the StatCache instead.
+    self.__entries = {}
+
+  def __lookup(self, filename):
+    """Returns (mtime, isdir).  mtime is None if the file does not exist, or if
+    it is a directory without a modification time (i.e. a virtual one)."""
+
+    entry = self.__entries.get(filename)
+    if entry is None:
+      disk_path = self.__directory.get_disk_path(filename)
+      if disk_path is None:
+        if self.__directory.isdir(filename):
+          entry = (None, None, True)
+        else:
+          entry = (None, self.__directory.getmtime_if_exists(filename), False)
+      else:
+        entry = (disk_path, None, None)
+      self.__entries[filename] = entry
+
+    (disk_path, mtime, isdir) = entry
+    if disk_path is None:
+      return (mtime, isdir)
+
+    result = self.__stat_cache.stat(disk_path)
+    if result is None:
+      return (None, False)
+    return (result.st_mtime, statmodule.S_ISDIR(result.st_mode))
+
+  def exists(self, filename):
+    (mtime, isdir) = self.__lookup(filename)
+    return mtime is not None or isdir
+
+  def isdir(self, filename):
+    (mtime, isdir) = self.__lookup(filename)
+    return isdir
+
+  def getmtime(self, filename):
+    (mtime, isdir) = self.__lookup(filename)
+    if mtime is None:
+      # Let the underlying directory raise the appropriate error.
+      return self.__directory.getmtime(filename)
+    return mtime
+
+  def getmtime_if_exists(self, filename):
+    (mtime, isdir) = self.__lookup(filename)
+    if mtime is None and isdir:
+      return self.__directory.getmtime_if_exists(filename)
+    return mtime
+
+  def getsize_if_exists(self, filename):
+    self.__lookup(filename)
+    disk_path = self.__entries[filename][0]
+    if disk_path is None:
+      return self.__directory.getsize_if_exists(filename)
+    result = self.__stat_cache.stat(disk_path)
+    if result is None:
+      return None
+    return result.st_size
+
+  def touch(self, filename, mtime=None):
+    try:
+      self.__directory.touch(filename, mtime)
+    finally:
+      self.invalidate(filename)
+
+  def read(self, filename):
+    return self.__directory.read(filename)
+
+  def write(self, filename, content, mtime=None):
+    try:
+      self.__directory.write(filename, content, mtime)
+    finally:
+      self.invalidate(filename)
+
+  def execfile(self, filename, context):
+    return self.__directory.execfile(filename, context)
+
+  def mkdir(self, filename):
+    try:
+      self.__directory.mkdir(filename)
+    finally:
+      self.invalidate(filename)
+
+  def get_disk_path(self, filename):
+    return self.__directory.get_disk_path(filename)
+
+  def expand_glob(self, pattern):
+    return self.__directory.expand_glob(pattern)
+
+  def sync(self):
+    self.__directory.sync()
+
+  def invalidate(self, filename):
+    entry = self.__entries.pop(filename, None)
+    if entry is None:
+      disk_path = self.__directory.get_disk_path(filename)
+    else:
+      disk_path = entry[0]
+    if disk_path is not None:
+      # Invalidate parents too, since write() and mkdir() may have created
+      # them.
+      while True:
+        self.__stat_cache.invalidate(disk_path)
+        parent = os.path.dirname(disk_path)
+        if parent == disk_path or parent == "":
+          break
+        disk_path = parent
+    else:
+      # Parents of virtual files may have been created too.
+      parent = os.path.dirname(filename)
+      while parent != "":
+        self.__entries.pop(parent, None)
+        parent = os.path.dirname(parent)
+    self.__directory.invalidate(filename)
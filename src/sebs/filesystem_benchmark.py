@@ -0,0 +1,208 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Benchmarks for the Directory implementations.
+
+Usage:
+  filesystem_benchmark.py [-s SIZES] [-n ITERATIONS] [-d DIRECTORY] [BENCHMARKS]
+
+Options:
+  -s SIZES        Comma-separated list of file sizes, in megabytes, to use for
+                  the "write" benchmark.  Default: 100,300
+  -n ITERATIONS   Number of calls to make in the "mapping" benchmark.
+                  Default: 1000000
+  -d DIRECTORY    Directory in which to create temporary files.  Should be on
+                  the filesystem you build on, since whether files can be
+                  reflinked depends on the filesystem.  Default: the system
+                  temp directory.
+
+Benchmarks:
+  mapping         Measures the per-call overhead which a Configuration's
+                  MappedDirectory adds on top of the directories it maps to,
+                  for each kind of path.
+  write           Copies large files into a DiskDirectory with write(), as
+                  SubprocessRunner does when capturing outputs, and compares
+                  against a plain buffered copy.
+
+If no benchmarks are named, all of them are run.
+"""
+
+import getopt
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+from sebs.configuration import _WorkingDirMapping
+from sebs.filesystem import DiskDirectory, VirtualDirectory, MappedDirectory
+
+class UsageError(Exception):
+  pass
+
+def _time(function, repeat=3):
+  """Runs function() |repeat| times and returns the fastest time in seconds."""
+
+  best = None
+  for i in xrange(repeat):
+    start = time.time()
+    function()
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def _report(name, seconds, megabytes = None):
+  if megabytes is None:
+    print "  %-40s %10.3f ms" % (name, seconds * 1000)
+  else:
+    print "  %-40s %10.3f ms  %8.1f MB/s" % (
+        name, seconds * 1000, megabytes / seconds)
+
+def benchmark_mapping(iterations):
+  source_dir = VirtualDirectory()
+  output_dir = VirtualDirectory()
+  mem_dir = VirtualDirectory()
+  env_dir = VirtualDirectory()
+
+  source_dir.write("src/foo/bar.cc", "", 1)
+  output_dir.write("tmp/foo/bar.o", "", 1)
+  mem_dir.write("foo/bar_result", "true", 1)
+  env_dir.write("PATH", os.environ.get("PATH", ""), 1)
+
+  mapping = _WorkingDirMapping(source_dir, output_dir, mem_dir, env_dir, {})
+  mapped_dir = MappedDirectory(mapping)
+
+  cases = [
+    ("src/foo/bar.cc", source_dir, "src/foo/bar.cc"),
+    ("tmp/foo/bar.o", output_dir, "tmp/foo/bar.o"),
+    ("mem/foo/bar_result", mem_dir, "foo/bar_result"),
+    ("env/PATH", env_dir, "PATH"),
+  ]
+
+  print "mapping, %d calls to getmtime() per path:" % iterations
+  for (filename, real_dir, real_name) in cases:
+    indices = xrange(iterations)
+    def mapped():
+      for i in indices:
+        mapped_dir.getmtime(filename)
+    def direct():
+      for i in indices:
+        real_dir.getmtime(real_name)
+
+    overhead = _time(mapped) - _time(direct)
+    print "  %-40s %10.1f ns/call overhead" % (
+        filename, overhead * 1e9 / iterations)
+
+def benchmark_write(tempdir, sizes):
+  dir = DiskDirectory(tempdir)
+  chunk = os.urandom(1 << 20)
+
+  for size in sizes:
+    print "write, %d MB:" % size
+
+    source_path = os.path.join(tempdir, "source")
+    source = open(source_path, "wb")
+    for i in xrange(size):
+      source.write(chunk)
+    source.close()
+
+    def plain_copy():
+      source = open(source_path, "rb")
+      dest = open(os.path.join(tempdir, "plain"), "wb")
+      shutil.copyfileobj(source, dest)
+      dest.close()
+      source.close()
+
+    def directory_write():
+      source = open(source_path, "rb")
+      dir.write("written", source)
+      source.close()
+
+    _report("shutil.copyfileobj()", _time(plain_copy), size)
+    _report("DiskDirectory.write()", _time(directory_write), size)
+
+    for name in ["source", "plain", "written"]:
+      os.remove(os.path.join(tempdir, name))
+
+_BENCHMARKS = {
+  "mapping": lambda tempdir, options: benchmark_mapping(options.iterations),
+  "write": lambda tempdir, options: benchmark_write(tempdir, options.sizes),
+}
+
+class _Options(object):
+  def __init__(self):
+    self.sizes = [100, 300]
+    self.iterations = 1000000
+
+def main(argv):
+  try:
+    opts, args = getopt.getopt(argv[1:], "hs:n:d:", ["help"])
+  except getopt.error, message:
+    raise UsageError(message)
+
+  options = _Options()
+  parent_dir = None
+
+  for name, value in opts:
+    if name in ("-h", "--help"):
+      print __doc__
+      return 0
+    elif name == "-s":
+      options.sizes = [int(size) for size in value.split(",")]
+    elif name == "-n":
+      options.iterations = int(value)
+    elif name == "-d":
+      parent_dir = value
+
+  if len(args) == 0:
+    args = sorted(_BENCHMARKS.keys())
+  for name in args:
+    if name not in _BENCHMARKS:
+      raise UsageError("Unknown benchmark: %s" % name)
+
+  tempdir = tempfile.mkdtemp(dir = parent_dir)
+  try:
+    for name in args:
+      _BENCHMARKS[name](tempdir, options)
+  finally:
+    shutil.rmtree(tempdir)
+
+  return 0
+
+if __name__ == "__main__":
+  try:
+    sys.exit(main(sys.argv))
+  except UsageError, error:
+    print >>sys.stderr, error.message
+    print >>sys.stderr, "for help use --help"
+    sys.exit(2)
@@ -37,7 +37,7 @@ import time
 import unittest
 
 from sebs.filesystem import Directory, DiskDirectory, VirtualDirectory, \
-                            MappedDirectory
+                            MappedDirectory, StatCache, StatCachingDirectory
 
 class DirectoryTest(object):
   """Base class for DiskDirectoryTest and VirtualDirectoryTest.  Defines test
@@ -75,6 +75,8 @@ class DirectoryTest(object):
     self.addFile("foo", 123, "Hello world!")
 
     self.assertEquals(123, self.dir.getmtime("foo"))
+    self.assertEquals(123, self.dir.getmtime_if_exists("foo"))
+    self.assertEquals(None, self.dir.getmtime_if_exists("bar"))
 
     # Make sure touch() sets mtime to the current time.
     start = time.time()
@@ -89,6 +91,14 @@ class DirectoryTest(object):
     self.dir.touch("foo", 321)
     self.assertEquals(321, self.dir.getmtime("foo"))
 
+  def testGetSize(self):
+    self.addFile("foo", 123, "Hello world!")
+    self.assertEquals(12, self.dir.getsize_if_exists("foo"))
+    self.assertEquals(None, self.dir.getsize_if_exists("bar"))
+
+    self.dir.write("foo", "Hi")
+    self.assertEquals(2, self.dir.getsize_if_exists("foo"))
+
   def testRead(self):
     self.addFile("foo", 123, "Hello world!")
     self.assertEquals("Hello world!", self.dir.read("foo"))
@@ -165,6 +175,81 @@ class DiskDirectoryTest(DirectoryTest, unittest.TestCase):
     self.assertEquals(os.path.join(self.tempdir, "foo/bar"),
                       self.dir.get_disk_path("foo/bar"))
 
+  def testAtomicWrite(self):
+    self.dir.write("foo", "Hello world!")
+    path = os.path.join(self.tempdir, "foo")
+    os.chmod(path, 0750)
+
+    # Overwriting keeps the existing permissions and leaves no temporary files
+    # behind.
+    self.dir.write("foo", "Goodbye world!", 123)
+    self.assertEquals("Goodbye world!", self.dir.read("foo"))
+    self.assertEquals(123, self.dir.getmtime("foo"))
+    self.assertEquals(0750, os.stat(path).st_mode & 0777)
+    self.assertEquals(["foo"], os.listdir(self.tempdir))
+
+    # If writing fails, the original file is untouched.
+    class BrokenFile(file):
+      def read(self, *args):
+        raise IOError("broken")
+    broken = BrokenFile(path, "rb")
+    broken.seek(1)  # Prevent reflinking, which wouldn't call read().
+    try:
+      self.assertRaises(IOError, self.dir.write, "foo", broken)
+    finally:
+      broken.close()
+    self.assertEquals("Goodbye world!", self.dir.read("foo"))
+    self.assertEquals(["foo"], os.listdir(self.tempdir))
+
+    # Just make sure sync() doesn't crash, including on files that have been
+    # deleted since being written.
+    self.dir.write("bar/baz", "qux")
+    os.remove(os.path.join(self.tempdir, "foo"))
+    self.dir.sync()
+
+  def testSyncInvalidated(self):
+    synced = set()
+    def fsync(fd):
+      stat = os.fstat(fd)
+      synced.add((stat.st_dev, stat.st_ino))
+    def inode(name):
+      stat = os.stat(os.path.join(self.tempdir, name))
+      return (stat.st_dev, stat.st_ino)
+
+    # A file written by something else, e.g. a subprocess, is synced once
+    # reported with invalidate(), along with the directories containing it.
+    self.addDirectory("foo/bar")
+    self.addFile("foo/bar/baz", 123, "qux")
+    self.addFile("unrelated", 123, "")
+    self.dir.invalidate("foo/bar/baz")
+
+    original_fsync = os.fsync
+    os.fsync = fsync
+    try:
+      self.dir.sync()
+    finally:
+      os.fsync = original_fsync
+
+    self.assertEquals(set([inode("foo/bar/baz"), inode("foo/bar"),
+                           inode("foo"), inode(".")]),
+                      synced)
+
+  def testWriteFromFile(self):
+    source_path = os.path.join(self.tempdir, "source")
+    f = open(source_path, "wb")
+    f.write("0123456789" * 100000)
+    f.close()
+
+    source = open(source_path, "rb")
+    self.dir.write("foo", source)
+    self.assertEquals("0123456789" * 100000, self.dir.read("foo"))
+
+    # Copying starts from the current seek point.
+    source.seek(5)
+    self.dir.write("bar", source)
+    self.assertEquals(("0123456789" * 100000)[5:], self.dir.read("bar"))
+    source.close()
+
   def testGlob(self):
     self.dir.write("foo.qux", "")
     self.dir.write("bar.qux", "")
@@ -267,5 +352,88 @@ class MappedDirectoryTest(DirectoryTest, unittest.TestCase):
     finally:
       shutil.rmtree(tempdir)
 
+class StatCachingDirectoryTest(DirectoryTest, unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.dir = StatCachingDirectory(DiskDirectory(self.tempdir))
+    super(StatCachingDirectoryTest, self).setUp()
+
+  def tearDown(self):
+    super(StatCachingDirectoryTest, self).tearDown()
+    shutil.rmtree(self.tempdir)
+
+  def addFile(self, name, mtime, content):
+    path = os.path.join(self.tempdir, name)
+    f = open(path, "wb")
+    f.write(content)
+    f.close()
+    os.utime(path, (mtime, mtime))
+    self.dir.invalidate(name)
+
+  def addDirectory(self, name):
+    os.makedirs(os.path.join(self.tempdir, name))
+    self.dir.invalidate(name)
+
+  def testCaching(self):
+    self.addFile("foo", 123, "Hello world!")
+    self.assertEquals(123, self.dir.getmtime("foo"))
+    self.assertFalse(self.dir.exists("bar"))
+
+    # Changes made behind the directory's back are not noticed...
+    path = os.path.join(self.tempdir, "foo")
+    os.utime(path, (321, 321))
+    open(os.path.join(self.tempdir, "bar"), "wb").close()
+    self.assertEquals(123, self.dir.getmtime("foo"))
+    self.assertFalse(self.dir.exists("bar"))
+
+    # ...until invalidated.
+    self.dir.invalidate("foo")
+    self.dir.invalidate("bar")
+    self.assertEquals(321, self.dir.getmtime("foo"))
+    self.assertTrue(self.dir.exists("bar"))
+
+    # Changes made through the directory are noticed immediately.
+    self.dir.touch("foo", 456)
+    self.assertEquals(456, self.dir.getmtime("foo"))
+    self.assertFalse(self.dir.exists("baz/qux"))
+    self.dir.write("baz/qux", "blah", 789)
+    self.assertTrue(self.dir.isdir("baz"))
+    self.assertEquals(789, self.dir.getmtime("baz/qux"))
+
+  def testVirtual(self):
+    virtual_dir = VirtualDirectory()
+    dir = StatCachingDirectory(virtual_dir)
+    self.assertFalse(dir.exists("foo/bar"))
+    dir.write("foo/bar", "blah", 123)
+    self.assertTrue(dir.isdir("foo"))
+    self.assertEquals(123, dir.getmtime("foo/bar"))
+    self.assertEquals(123, dir.getmtime_if_exists("foo/bar"))
+
+class StatCacheTest(unittest.TestCase):
+  def setUp(self):
+    self.tempdir = tempfile.mkdtemp()
+    self.cache = StatCache()
+
+  def tearDown(self):
+    shutil.rmtree(self.tempdir)
+
+  def testStat(self):
+    path = os.path.join(self.tempdir, "foo")
+    self.assertEquals(None, self.cache.getmtime(path))
+    self.assertEquals(None, self.cache.stat(os.path.join(path, "bar")))
+
+    open(path, "wb").close()
+    os.utime(path, (123, 123))
+    self.assertEquals(None, self.cache.getmtime(path))
+    self.cache.invalidate(path)
+    self.assertEquals(123, self.cache.getmtime(path))
+    # Equivalent paths share the same entry.
+    os.utime(path, (321, 321))
+    self.assertEquals(123,
+        self.cache.getmtime(os.path.join(self.tempdir, ".", "foo")))
+
+    self.cache.clear()
+    self.assertEquals(321, self.cache.getmtime(path))
+
 if __name__ == "__main__":
   unittest.main()
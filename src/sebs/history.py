@@ -0,0 +1,186 @@
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""
+Records what each action cost to run, across builds, so that slow or
+memory-hungry actions can be found.  See "sebs stats".
+"""
+
+import sqlite3
+import time
+
+from sebs.helpers import typecheck
+
+class ResourceUsage(object):
+  """Resources consumed by the subprocesses of one action.  Times are in
+  seconds, max_rss is the peak resident set size of the largest subprocess in
+  kilobytes, and in_blocks/out_blocks count filesystem reads and writes.
+  Subprocesses for which the OS did not provide a resource usage (e.g.
+  requests to persistent workers, which run inside a long-lived process)
+  contribute only to wall time."""
+
+  def __init__(self):
+    self.wall_time = 0.0
+    self.user_time = 0.0
+    self.system_time = 0.0
+    self.max_rss = 0
+    self.in_blocks = 0
+    self.out_blocks = 0
+
+  def add(self, wall_time, rusage = None):
+    """Accounts for one subprocess.  |rusage| is a resource.struct_rusage, as
+    returned by os.wait4(), or None."""
+
+    self.wall_time += wall_time
+    if rusage is not None:
+      self.user_time += rusage.ru_utime
+      self.system_time += rusage.ru_stime
+      self.max_rss = max(self.max_rss, rusage.ru_maxrss)
+      self.in_blocks += rusage.ru_inblock
+      self.out_blocks += rusage.ru_oublock
+
+class BuildHistory(object):
+  """A database of resource usage, stored with sqlite.  Each build is recorded
+  as a row of the "builds" table, and each action it ran as a row of the
+  "actions" table.  Not thread-safe; the builder lock must be held when
+  recording."""
+
+  def __init__(self, filename):
+    typecheck(filename, basestring)
+    # The builder calls us from whichever thread happens to hold its lock.
+    self.__db = sqlite3.connect(filename, check_same_thread = False)
+    self.__db.executescript("""
+        CREATE TABLE IF NOT EXISTS builds (
+          id INTEGER PRIMARY KEY,
+          start_time REAL,
+          command TEXT);
+        CREATE TABLE IF NOT EXISTS actions (
+          build INTEGER REFERENCES builds(id),
+          config TEXT,
+          verb TEXT,
+          name TEXT,
+          success INTEGER,
+          wall_time REAL,
+          user_time REAL,
+          system_time REAL,
+          max_rss INTEGER,
+          in_blocks INTEGER,
+          out_blocks INTEGER);
+        CREATE INDEX IF NOT EXISTS actions_by_build ON actions(build);
+        CREATE INDEX IF NOT EXISTS actions_by_name ON actions(verb, name);
+        """)
+    self.__build = None
+
+  def start_build(self, command, start_time = None):
+    """Begins recording a new build.  |command| describes it, e.g. the
+    command line."""
+
+    if start_time is None:
+      start_time = time.time()
+    cursor = self.__db.execute(
+        "INSERT INTO builds (start_time, command) VALUES (?, ?)",
+        (start_time, command))
+    self.__build = cursor.lastrowid
+
+  def record(self, config_name, action, success, usage):
+    """Records that |action| was executed in the configuration with the given
+    name (None for the default config)."""
+
+    typecheck(usage, ResourceUsage)
+    assert self.__build is not None
+    self.__db.execute(
+        "INSERT INTO actions VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (self.__build, config_name, action.verb, action.name, int(success),
+         usage.wall_time, usage.user_time, usage.system_time, usage.max_rss,
+         usage.in_blocks, usage.out_blocks))
+
+  def close(self):
+    """Commits everything recorded.  Rows are only written at this point,
+    since committing after every action would cost an fsync() each."""
+
+    self.__db.commit()
+    self.__db.close()
+
+  # ------------------------------------------------------------------
+  # Queries.  Each returns a list of tuples.
+
+  def last_build(self):
+    """Returns (id, start_time, command) for the most recent build which ran
+    at least one action, or None."""
+
+    return self.__db.execute(
+        "SELECT id, start_time, command FROM builds "
+        "WHERE id IN (SELECT build FROM actions) "
+        "ORDER BY id DESC LIMIT 1").fetchone()
+
+  def top_actions(self, build, order_by, count):
+    """Returns the |count| actions from the given build with the largest value
+    of |order_by|, which must be one of the columns of ResourceUsage.  Each
+    result is (config, verb, name, wall_time, user_time + system_time,
+    max_rss)."""
+
+    if order_by not in ResourceUsage().__dict__:
+      raise ValueError("Not a resource: %s" % order_by)
+    return self.__db.execute(
+        "SELECT config, verb, name, wall_time, user_time + system_time, "
+        "max_rss FROM actions WHERE build = ? "
+        "ORDER BY %s DESC LIMIT ?" % order_by, (build, count)).fetchall()
+
+  def build_totals(self, count):
+    """Summarizes the last |count| builds which ran actions, oldest first.
+    Each result is (id, start_time, command, actions_run, total wall_time,
+    total CPU time, largest max_rss)."""
+
+    rows = self.__db.execute(
+        "SELECT builds.id, start_time, command, COUNT(*), SUM(wall_time), "
+        "SUM(user_time + system_time), MAX(max_rss) "
+        "FROM builds JOIN actions ON actions.build = builds.id "
+        "GROUP BY builds.id ORDER BY builds.id DESC LIMIT ?",
+        (count,)).fetchall()
+    rows.reverse()
+    return rows
+
+  def action_trend(self, name, count):
+    """Returns the history of actions whose name contains |name| over the last
+    |count| builds in which they ran, oldest first.  Each result is
+    (build id, config, verb, name, wall_time, user_time + system_time,
+    max_rss)."""
+
+    rows = self.__db.execute(
+        "SELECT build, config, verb, name, wall_time, "
+        "user_time + system_time, max_rss FROM actions "
+        "WHERE build IN (SELECT DISTINCT build FROM actions "
+        "                WHERE instr(name, ?) > 0 "
+        "                ORDER BY build DESC LIMIT ?) "
+        "AND instr(name, ?) > 0 ORDER BY build, verb, name",
+        (name, count, name)).fetchall()
+    return rows
@@ -0,0 +1,117 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import resource
+import unittest
+
+from sebs.core import Action
+from sebs.history import BuildHistory, ResourceUsage
+
+class MockRusage(object):
+  def __init__(self, utime, stime, maxrss):
+    self.ru_utime = utime
+    self.ru_stime = stime
+    self.ru_maxrss = maxrss
+    self.ru_inblock = 1
+    self.ru_oublock = 2
+
+def _usage(wall, cpu, rss):
+  usage = ResourceUsage()
+  usage.add(wall, MockRusage(cpu, 0.0, rss))
+  return usage
+
+class ResourceUsageTest(unittest.TestCase):
+  def testAdd(self):
+    usage = ResourceUsage()
+    usage.add(1.5, MockRusage(1.0, 0.25, 100))
+    usage.add(2.0, MockRusage(0.5, 0.25, 300))
+    usage.add(0.5)
+    self.assertEquals(4.0, usage.wall_time)
+    self.assertEquals(1.5, usage.user_time)
+    self.assertEquals(0.5, usage.system_time)
+    self.assertEquals(300, usage.max_rss)
+    self.assertEquals(2, usage.in_blocks)
+    self.assertEquals(4, usage.out_blocks)
+
+    # Real rusage objects work too.
+    usage.add(0.0, resource.getrusage(resource.RUSAGE_SELF))
+
+class BuildHistoryTest(unittest.TestCase):
+  def setUp(self):
+    self.history = BuildHistory(":memory:")
+    self.foo = Action(None, "compile", "foo")
+    self.bar = Action(None, "compile", "bar")
+    self.baz = Action(None, "link", "baz")
+
+  def tearDown(self):
+    self.history.close()
+
+  def testQueries(self):
+    self.assertTrue(self.history.last_build() is None)
+
+    self.history.start_build("sebs build first", 1000.0)
+    self.history.record(None, self.foo, True, _usage(1.0, 1.0, 100))
+    self.history.record(None, self.bar, True, _usage(3.0, 2.0, 50))
+
+    self.history.start_build("sebs build second", 2000.0)
+    self.history.record(None, self.foo, True, _usage(2.0, 1.5, 200))
+    self.history.record("alt", self.baz, False, _usage(0.5, 0.5, 400))
+
+    # A build which ran nothing doesn't count.
+    self.history.start_build("sebs build nothing", 3000.0)
+
+    (build, start_time, command) = self.history.last_build()
+    self.assertEquals(2000.0, start_time)
+    self.assertEquals("sebs build second", command)
+
+    self.assertEquals([(None, "compile", "foo", 2.0, 1.5, 200),
+                       ("alt", "link", "baz", 0.5, 0.5, 400)],
+                      self.history.top_actions(build, "wall_time", 10))
+    self.assertEquals([("alt", "link", "baz", 0.5, 0.5, 400)],
+                      self.history.top_actions(build, "max_rss", 1))
+    self.assertRaises(ValueError, self.history.top_actions,
+                      build, "name; DROP TABLE actions", 1)
+
+    totals = self.history.build_totals(10)
+    self.assertEquals(2, len(totals))
+    self.assertEquals(("sebs build first", 2, 4.0, 3.0, 100), totals[0][2:])
+    self.assertEquals(("sebs build second", 2, 2.5, 2.0, 400), totals[1][2:])
+    self.assertEquals(totals[1:], self.history.build_totals(1))
+
+    trend = self.history.action_trend("fo", 10)
+    self.assertEquals([(None, "compile", "foo", 1.0, 1.0, 100),
+                       (None, "compile", "foo", 2.0, 1.5, 200)],
+                      [row[1:] for row in trend])
+    self.assertEquals(trend[1:], self.history.action_trend("fo", 1))
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,200 @@
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+
+"""Approximate C/C++ include scanning.
+
+A compile's depfile tells us which headers it read, but only after the first
+time it runs.  On a clean build, without that information, each compile would
+have to wait for every header generated by its dependencies, even ones it
+never includes, which serializes compilation behind code generation.  An
+IncludeScanner instead finds the headers a set of sources include by looking
+for #include lines -- much like the preprocessor, but ignoring conditionals,
+so it may over-approximate -- and reports only the generated headers among
+them as inputs.
+
+Scanning happens whenever inputs are enumerated, not just on the first build,
+so that the set of inputs is stable and sources aren't recompiled just
+because a header they don't include was regenerated.  Scanning is skipped
+entirely when there are no generated headers to look for.  Files are read
+through the ArtifactEnumerator, which looks up each one's includes in an
+IncludeCache so that an unchanged file is only scanned once.
+"""
+
+import os
+import re
+
+from sebs.core import Artifact
+from sebs.filesystem import Directory
+from sebs.helpers import typecheck
+
+_INCLUDE_PATTERN = re.compile(
+    r'^[ \t]*#[ \t]*(?:include|import)[ \t]*(?:([<"])([^>"\n]*)[>"])?',
+    re.MULTILINE)
+
+def scan_includes(text):
+  """Returns a list of (quoted, name) for each #include in |text|, where
+  |quoted| is true for #include "name" and false for #include <name>.  Returns
+  None if some #include names its file with a macro, since then we can't tell
+  what it includes."""
+
+  result = []
+  for match in _INCLUDE_PATTERN.finditer(text):
+    if match.group(1) is None:
+      return None
+    result.append((match.group(1) == '"', match.group(2)))
+  return result
+
+class IncludeCache(object):
+  """Remembers the result of scan_includes() for files in a Directory, keyed
+  on their modification times, so that each file is only read again once it
+  has changed.  Each Configuration has one."""
+
+  def __init__(self):
+    # Maps file names to (mtime, includes).
+    self.__entries = {}
+
+  def scan(self, dir, filename):
+    """Returns scan_includes() of the file's contents, or False if it doesn't
+    exist."""
+
+    typecheck(dir, Directory)
+    typecheck(filename, basestring)
+
+    mtime = dir.getmtime_if_exists(filename)
+    if mtime is None:
+      return False
+    cached = self.__entries.get(filename)
+    if cached is not None and cached[0] == mtime:
+      return cached[1]
+    if dir.isdir(filename):
+      return False
+    includes = scan_includes(dir.read(filename))
+    self.__entries[filename] = (mtime, includes)
+    return includes
+
+def _include_name(artifact):
+  """Returns the name by which |artifact| would be #included, given that each
+  top-level directory is on the include path (e.g. "tmp/foo/bar.h" is
+  included as "foo/bar.h")."""
+
+  return artifact.filename.split("/", 1)[-1]
+
+class IncludeScanner(object):
+  """Finds which of |generated_headers| the given |sources| include, directly
+  or indirectly.  Headers which aren't generated are looked for on disk in
+  each of |include_dirs|, which are relative to the working directory."""
+
+  def __init__(self, sources, generated_headers,
+               include_dirs = ["src", "include"]):
+    typecheck(sources, list, Artifact)
+    typecheck(generated_headers, list, Artifact)
+    typecheck(include_dirs, list, basestring)
+
+    self.sources = sources
+    self.generated_headers = generated_headers
+    self.__include_dirs = include_dirs
+    self.__generated_by_name = {}
+    for header in generated_headers:
+      self.__generated_by_name[_include_name(header)] = header
+
+  def enumerate_artifacts(self, artifact_enumerator):
+    """Reports the generated headers which the sources include as inputs.
+    Sources and generated headers are scanned through |artifact_enumerator|,
+    so a header which isn't built yet is still reported, and the scan
+    continues into it when the enumeration is repeated after it has been
+    built."""
+
+    if len(self.__generated_by_name) == 0:
+      return
+
+    # Search over include names.  Sources are represented by their include
+    # names too, which is what quoted includes are resolved relative to.
+    # Names which aren't found (e.g. system headers) are ignored.
+    seen = set()
+    missing = set()
+    queue = []
+    for source in self.sources:
+      includes = artifact_enumerator.read_includes(source)
+      if includes is False:
+        continue
+      if includes is None:
+        self.__add_all(artifact_enumerator)
+        return
+      queue.append((_include_name(source), includes))
+
+    while len(queue) > 0:
+      (including_name, includes) = queue.pop()
+      for (quoted, name) in includes:
+        # Quoted includes are looked for next to the including file first.
+        candidates = [name]
+        if quoted:
+          candidates.insert(0, os.path.normpath(
+              os.path.join(os.path.dirname(including_name), name)))
+
+        for candidate in candidates:
+          if candidate in seen:
+            break
+          if candidate in missing:
+            continue
+          sub_includes = self.__scan(candidate, artifact_enumerator)
+          if sub_includes is False:
+            missing.add(candidate)
+            continue
+          seen.add(candidate)
+          if sub_includes is None:
+            self.__add_all(artifact_enumerator)
+            return
+          queue.append((candidate, sub_includes))
+          break
+
+  def __scan(self, name, artifact_enumerator):
+    """Finds the header included as |name| and returns its includes, like
+    ArtifactEnumerator.read_disk_includes().  A generated header which isn't
+    built yet is reported as having no includes."""
+
+    header = self.__generated_by_name.get(name)
+    if header is not None:
+      includes = artifact_enumerator.read_includes(header)
+      if includes is False:
+        return []
+      return includes
+
+    for dir in self.__include_dirs:
+      includes = artifact_enumerator.read_disk_includes(
+          os.path.join(dir, name))
+      if includes is not False:
+        return includes
+    return False
+
+  def __add_all(self, artifact_enumerator):
+    for header in self.generated_headers:
+      artifact_enumerator.add_input(header)
@@ -0,0 +1,151 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+from sebs.command import ArtifactEnumerator
+from sebs.core import Action, Artifact
+from sebs.filesystem import VirtualDirectory
+from sebs.include_scanner import IncludeCache, IncludeScanner, scan_includes
+
+class MockArtifactEnumerator(ArtifactEnumerator):
+  def __init__(self, readable_artifacts):
+    self.readable_artifacts = readable_artifacts
+    self.reads = []
+    self.inputs = []
+
+  def add_input(self, artifact):
+    self.inputs.append(artifact)
+
+  def read(self, artifact):
+    self.reads.append(artifact)
+    return self.readable_artifacts.get(artifact)
+
+class ScanIncludesTest(unittest.TestCase):
+  def testScanIncludes(self):
+    self.assertEquals(
+      [(True, "foo/bar.h"), (False, "vector"), (True, "baz.h"),
+       (True, "qux.h")],
+      scan_includes('#include "foo/bar.h"\n'
+                    '#include <vector>\n'
+                    '  #  include   "baz.h"  // comment\n'
+                    'int i;  #include "not_an_include.h"\n'
+                    '#import "qux.h"\n'))
+    self.assertEquals([], scan_includes("int main() {}\n"))
+
+  def testMacroInclude(self):
+    self.assertTrue(scan_includes('#include "foo.h"\n'
+                                  '#include FOO_HEADER\n') is None)
+
+class CountingDirectory(VirtualDirectory):
+  def __init__(self):
+    super(CountingDirectory, self).__init__()
+    self.reads = []
+
+  def read(self, filename):
+    self.reads.append(filename)
+    return super(CountingDirectory, self).read(filename)
+
+class IncludeCacheTest(unittest.TestCase):
+  def testRescanOnlyWhenModified(self):
+    dir = CountingDirectory()
+    dir.write("foo.h", '#include "bar.h"\n', 1)
+    cache = IncludeCache()
+
+    self.assertEquals([(True, "bar.h")], cache.scan(dir, "foo.h"))
+    self.assertEquals([(True, "bar.h")], cache.scan(dir, "foo.h"))
+    self.assertEquals(["foo.h"], dir.reads)
+
+    dir.write("foo.h", '#include <baz>\n', 2)
+    self.assertEquals([(False, "baz")], cache.scan(dir, "foo.h"))
+    self.assertEquals(["foo.h", "foo.h"], dir.reads)
+
+    self.assertTrue(cache.scan(dir, "missing.h") is False)
+
+class IncludeScannerTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    action = Action(None, "generate")
+    self.source = Artifact("src/foo/foo.cc", None)
+    self.one = Artifact("tmp/gen/one.h", action)
+    self.two = Artifact("tmp/gen/two.h", action)
+    self.three = Artifact("tmp/foo/three.h", action)
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def addFile(self, name, content):
+    path = os.path.join(self.dir, name)
+    if not os.path.exists(os.path.dirname(path)):
+      os.makedirs(os.path.dirname(path))
+    file = open(path, "w")
+    file.write(content)
+    file.close()
+
+  def scan(self, readable):
+    scanner = IncludeScanner([self.source], [self.one, self.two, self.three],
+                             include_dirs = [self.dir])
+    enumerator = MockArtifactEnumerator(readable)
+    scanner.enumerate_artifacts(enumerator)
+    return enumerator
+
+  def testOnlyIncludedHeaders(self):
+    self.addFile("plain/plain.h", '#include "gen/one.h"\n#include <vector>\n')
+    source_text = '#include "plain/plain.h"\n#include <string>\n'
+
+    # gen/one.h isn't built yet, so we can't see into it.
+    enumerator = self.scan({self.source: source_text})
+    self.assertEquals([self.source, self.one], enumerator.reads)
+
+    # Once it's built, we find what it includes.  three.h is found relative
+    # to the source.
+    enumerator = self.scan({self.source: source_text + '#include "three.h"',
+                            self.one: '#include "gen/two.h"\n'})
+    self.assertEquals(set([self.source, self.one, self.two, self.three]),
+                      set(enumerator.reads))
+
+  def testMacroIncludeUsesAllHeaders(self):
+    self.addFile("plain/plain.h", '#include GENERATED\n')
+    enumerator = self.scan({self.source: '#include "plain/plain.h"\n'})
+    self.assertEquals([self.one, self.two, self.three], enumerator.inputs)
+
+  def testNoGeneratedHeaders(self):
+    scanner = IncludeScanner([self.source], [], include_dirs = [self.dir])
+    enumerator = MockArtifactEnumerator({self.source: '#include "foo.h"\n'})
+    scanner.enumerate_artifacts(enumerator)
+    self.assertEquals([], enumerator.reads)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,232 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Benchmarks link times with each linker cpp.sebs can select.
+
+Usage:
+  link_benchmark.py [-f FILES] [-n FUNCTIONS] [-r REPEAT] [-d DIRECTORY]
+                    [LINKERS]
+
+Options:
+  -f FILES        Number of source files to generate.  Default: 200
+  -n FUNCTIONS    Number of functions in each file.  Default: 100
+  -r REPEAT       Number of times to run each link; the fastest is reported.
+                  Default: 3
+  -d DIRECTORY    Directory in which to create temporary files.  Default: the
+                  system temp directory.
+
+Generates a tree of C++ sources shaped like a typical sebs project -- one
+static library per file plus a main program -- and compiles it twice with
+$CXX (default g++) and $CXXFLAGS (default -O2 -g), once as-is and once with
+-gsplit-dwarf.  It then times linking the program with each of LINKERS, as
+the LINKER option passes them to -fuse-ld, and reports the size of the
+result.  The default is to try the compiler's default linker, bfd, gold, and
+lld; linkers which aren't installed are skipped.
+"""
+
+import getopt
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+class UsageError(Exception):
+  pass
+
+_DEFAULT_LINKERS = ["default", "bfd", "gold", "lld"]
+
+def _time(function, repeat):
+  """Runs function() |repeat| times and returns the fastest time in seconds."""
+
+  best = None
+  for i in xrange(repeat):
+    start = time.time()
+    function()
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def _run(command):
+  proc = subprocess.Popen(command, stdout = subprocess.PIPE,
+                          stderr = subprocess.STDOUT)
+  output = proc.communicate()[0]
+  if proc.returncode != 0:
+    raise subprocess.CalledProcessError(proc.returncode, " ".join(command),
+                                        output)
+
+def _linker_flags(linker):
+  if linker == "default":
+    return []
+  else:
+    return ["-fuse-ld=" + linker]
+
+def _generate(tempdir, files, functions):
+  """Writes the sources and returns their paths.  Each file's functions call
+  into the previous file so that the linker has symbols to resolve."""
+
+  sources = []
+  for i in xrange(files):
+    path = os.path.join(tempdir, "lib%d.cc" % i)
+    out = open(path, "w")
+    for j in xrange(functions):
+      if i > 0:
+        out.write("int f%d_%d(int x);\n" % (i - 1, j))
+      out.write("int f%d_%d(int x) {\n" % (i, j))
+      out.write("  int result = x * %d;\n" % (j + 1))
+      if i > 0:
+        out.write("  result += f%d_%d(x - 1);\n" % (i - 1, j))
+      out.write("  return result;\n}\n")
+    out.close()
+    sources.append(path)
+
+  path = os.path.join(tempdir, "main.cc")
+  out = open(path, "w")
+  for j in xrange(functions):
+    out.write("int f%d_%d(int x);\n" % (files - 1, j))
+  out.write("int main(int argc, char* argv[]) {\n  int result = 0;\n")
+  for j in xrange(functions):
+    out.write("  result += f%d_%d(argc);\n" % (files - 1, j))
+  out.write("  return result & 1;\n}\n")
+  out.close()
+  sources.append(path)
+  return sources
+
+def _compile(cxx, sources, flags, outdir):
+  """Compiles each source to an object and each object but the last (main)
+  into its own archive.  Returns the link inputs, main first and libraries in
+  dependency order."""
+
+  os.mkdir(outdir)
+  objects = []
+  for source in sources:
+    name = os.path.splitext(os.path.basename(source))[0]
+    obj = os.path.join(outdir, name + ".o")
+    _run(cxx + flags + ["-c", source, "-o", obj])
+    objects.append(obj)
+
+  libs = []
+  for obj in objects[:-1]:
+    lib = obj[:-len(".o")] + ".a"
+    _run(["ar", "-qcs", lib, obj])
+    libs.append(lib)
+  libs.reverse()
+  return [objects[-1]] + libs
+
+def _available(cxx, linker, tempdir):
+  source = os.path.join(tempdir, "probe.cc")
+  open(source, "w").write("int main() { return 0; }\n")
+  try:
+    _run(cxx + _linker_flags(linker) +
+         [source, "-o", os.path.join(tempdir, "probe")])
+    return True
+  except subprocess.CalledProcessError:
+    return False
+
+def benchmark(tempdir, options, linkers):
+  cxx = os.environ.get("CXX", "g++").split()
+  cxxflags = os.environ.get("CXXFLAGS", "-O2 -g").split()
+
+  linkers = [linker for linker in linkers
+             if _available(cxx, linker, tempdir)]
+  if len(linkers) == 0:
+    print "No linkers available."
+    return
+
+  sources = _generate(tempdir, options.files, options.functions)
+  output = os.path.join(tempdir, "program")
+
+  print "link, %d files x %d functions:" % (options.files, options.functions)
+  for (label, flags) in [("", cxxflags),
+                         (" -gsplit-dwarf", cxxflags + ["-gsplit-dwarf"])]:
+    outdir = os.path.join(tempdir, "objects%d" % len(flags))
+    inputs = _compile(cxx, sources, flags, outdir)
+
+    for linker in linkers:
+      command = cxx + cxxflags + _linker_flags(linker) + \
+                ["-o", output] + inputs
+      seconds = _time(lambda: _run(command), options.repeat)
+      print "  %-40s %10.3f ms  %8.1f MB" % (
+          linker + label, seconds * 1000,
+          os.path.getsize(output) / float(1 << 20))
+
+class _Options(object):
+  def __init__(self):
+    self.files = 200
+    self.functions = 100
+    self.repeat = 3
+
+def main(argv):
+  try:
+    opts, args = getopt.getopt(argv[1:], "hf:n:r:d:", ["help"])
+  except getopt.error, message:
+    raise UsageError(message)
+
+  options = _Options()
+  parent_dir = None
+
+  for name, value in opts:
+    if name in ("-h", "--help"):
+      print __doc__
+      return 0
+    elif name == "-f":
+      options.files = int(value)
+    elif name == "-n":
+      options.functions = int(value)
+    elif name == "-r":
+      options.repeat = int(value)
+    elif name == "-d":
+      parent_dir = value
+
+  if options.files < 1:
+    raise UsageError("Need at least one file.")
+
+  if len(args) == 0:
+    args = _DEFAULT_LINKERS
+
+  tempdir = tempfile.mkdtemp(dir = parent_dir)
+  try:
+    benchmark(tempdir, options, args)
+  finally:
+    shutil.rmtree(tempdir)
+
+  return 0
+
+if __name__ == "__main__":
+  try:
+    sys.exit(main(sys.argv))
+  except UsageError, error:
+    print >>sys.stderr, error.message
+    print >>sys.stderr, "for help use --help"
+    sys.exit(2)
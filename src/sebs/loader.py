@@ -36,6 +36,8 @@ from sebs.core import Rule, Test, Artifact, Action, Context, DefinitionError, \
 from sebs.filesystem import Directory
 from sebs.helpers import typecheck
 import sebs.command as command
+import sebs.depset as depset
+import sebs.include_scanner as include_scanner
 
 class _ContextImpl(Context):
   def __init__(self, loader, filename, root_dir):
@@ -47,6 +49,7 @@ class _ContextImpl(Context):
     self.full_filename = os.path.join("src", filename)
     self.directory = os.path.dirname(filename)
     self.timestamp = root_dir.getmtime(self.full_filename)
+    self.build_files = set([self.full_filename])
     self.__root_dir = root_dir
 
   def local_filename(self, artifact):
@@ -196,7 +199,10 @@ class _Builtins(object):
     self.ConditionalCommand = command.ConditionalCommand
     self.SubprocessCommand  = command.SubprocessCommand
     self.DepFileCommand     = command.DepFileCommand
+    self.OptionalOutputCommand = command.OptionalOutputCommand
     self.MirrorCommand      = command.MirrorCommand
+    self.IncludeScanner     = include_scanner.IncludeScanner
+    self.Depset             = depset.Depset
 
     self.__loader = loader
     self.__context = context
@@ -220,6 +226,8 @@ class _Builtins(object):
     (result, timestamp) = self.__loader.load_with_timestamp(name)
     if timestamp > self.__context.timestamp:
       self.__context.timestamp = timestamp
+    (_, imported_context) = self.__loader.load_file(name.rsplit(":", 1)[0])
+    self.__context.build_files.update(imported_context.build_files)
     return result
 
   def disable(self):
@@ -130,6 +130,20 @@ sebs.import_("qux.sebs")
     self.assertEqual(1, self.loader.load_with_timestamp("qux.sebs")[1])
     self.assertEqual(2, self.loader.load_with_timestamp("quux.sebs")[1])
 
+  def testBuildFiles(self):
+    self.dir.add("src/foo.sebs", 0, """""")
+    self.dir.add("src/bar.sebs", 0, """
+foo = sebs.import_("foo.sebs")
+""")
+    self.dir.add("src/baz.sebs", 0, """sebs.import_("bar.sebs:foo")""")
+
+    self.assertEqual(set(["src/foo.sebs"]),
+                     self.loader.load_file("foo.sebs")[1].build_files)
+    self.assertEqual(set(["src/foo.sebs", "src/bar.sebs"]),
+                     self.loader.load_file("bar.sebs")[1].build_files)
+    self.assertEqual(set(["src/foo.sebs", "src/bar.sebs", "src/baz.sebs"]),
+                     self.loader.load_file("baz.sebs")[1].build_files)
+
 class _MockGlobbingVirtualDirectory(VirtualDirectory):
   def expand_glob(self, pattern):
     if pattern == "src/foo/*":
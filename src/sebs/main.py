@@ -63,11 +63,13 @@ import getopt
 import os
 import sys
 import threading
+import time
 
 from sebs.builder import Builder
 from sebs.configuration import Configuration
 from sebs.core import Rule, Test
 from sebs.helpers import typecheck
+from sebs.history import BuildHistory
 from sebs.loader import Loader, BuildFile
 from sebs.console import make_console, ColoredText
 from sebs.runner import SubprocessRunner, CachingRunner
@@ -76,6 +78,9 @@ from sebs.script import ScriptBuilder
 class UsageError(Exception):
   pass
 
+# Like cache.pickle, shared by all configurations.
+_HISTORY_FILE = "history.db"
+
 def _args_to_rules(loader, args):
   """Given a list of command-line arguments like 'foo/bar.sebs:baz', return an
   iterator of rules which should be built."""
@@ -103,6 +108,31 @@ def _args_to_rules(loader, args):
     else:
       yield target
 
+def _read_changed_files(filename):
+  """Reads a list of changed files, one per line, from |filename| ("-" for
+  stdin).  Names are taken relative to the current directory, which must be
+  the root of the SEBS tree, so "git diff --name-only" output can be used
+  directly."""
+
+  if filename == "-":
+    lines = sys.stdin.readlines()
+  else:
+    file = open(filename, "rU")
+    try:
+      lines = file.readlines()
+    finally:
+      file.close()
+
+  result = set()
+  for line in lines:
+    name = line.strip()
+    if name == "":
+      continue
+    if os.path.isabs(name):
+      name = os.path.relpath(name)
+    result.add(os.path.normpath(name).replace("\\", "/"))
+  return result
+
 def _restore_pickle(obj, filename):
   if os.path.exists(filename):
     db = open(filename, "rb")
@@ -118,12 +148,13 @@ def _save_pickle(obj, filename):
 
 def configure(config, argv):
   try:
-    opts, args = getopt.getopt(argv[1:], "C:o", [])
+    opts, args = getopt.getopt(argv[1:], "C:o", ["allow_env="])
   except getopt.error, message:
     raise UsageError(message)
 
   output = False
   mappings = {}
+  allowed_env = []
   for name, value in opts:
     if name == "-C":
       parts = value.split("=", 1)
@@ -133,6 +164,11 @@ def configure(config, argv):
         mappings[parts[0]] = parts[1]
     elif name == "-o":
       output = True
+    elif name == "--allow_env":
+      for var in value.split(","):
+        if not var.replace("_", "").isalnum():
+          raise UsageError("%s: Invalid environment variable name." % var)
+        allowed_env.append(var)
 
   if output:
     if config.env_dir.exists("$mappings"):
@@ -142,6 +178,9 @@ def configure(config, argv):
           continue
         print "-C" + mapping
 
+    if config.allowed_env() is not None:
+      print "--allow_env=" + ",".join(config.allowed_env())
+
     if config.env_dir.exists("$config"):
       locked_vars = config.env_dir.read("$config").split(",")
     else:
@@ -188,11 +227,16 @@ def configure(config, argv):
     config.env_dir.write("$mappings",
         ":".join(["=".join(mapping) for mapping in mappings.items()]))
 
+    # If non-empty, commands will see only these environment variables.
+    config.env_dir.write("$allowed_env", ",".join(allowed_env))
+
 # --------------------------------------------------------------------
 
 def build(config, argv):
   try:
-    opts, args = getopt.getopt(argv[1:], "vj:", [])
+    opts, args = getopt.getopt(argv[1:], "vj:",
+        ["sync", "noworkers", "max_log_size=", "test_jobs=",
+         "changed_files="])
   except getopt.error, message:
     raise UsageError(message)
 
@@ -201,28 +245,59 @@ def build(config, argv):
   verbose = False
   console = make_console(sys.stdout)
   threads = 1
+  sync = False
+  use_workers = True
+  max_log_size = SubprocessRunner.DEFAULT_MAX_LOG_SIZE
+  test_jobs = None
+  changed_files = None
 
   for name, value in opts:
     if name == "-v":
       verbose = True
     elif name == "-j":
       threads = int(value)
+    elif name == "--sync":
+      sync = True
+    elif name == "--noworkers":
+      use_workers = False
+    elif name == "--max_log_size":
+      max_log_size = int(value)
+    elif name == "--test_jobs":
+      test_jobs = int(value)
+      if test_jobs < 1:
+        raise UsageError("--test_jobs must be at least 1.")
+    elif name == "--changed_files":
+      if argv[0] != "test":
+        raise UsageError("--changed_files only applies to tests.")
+      changed_files = _read_changed_files(value)
+
+  history = BuildHistory(_HISTORY_FILE)
+  history.start_build(" ".join(argv))
 
   if runner is None:
-    runner = SubprocessRunner(console, verbose)
-    caching_runner = CachingRunner(runner, console)
+    subprocess_runner = SubprocessRunner(console, verbose, use_workers,
+                                         history, max_log_size)
+    caching_runner = CachingRunner(subprocess_runner, console)
     runner = caching_runner
 
     # Note that all configurations share a common cache.pickle.
     _restore_pickle(caching_runner, "cache.pickle")
 
   loader = Loader(config.root_dir)
-  builder = Builder(console)
+  builder = Builder(console, test_jobs)
 
   if argv[0] == "test":
-    for rule in _args_to_rules(loader, args):
-      if isinstance(rule, Test):
-        builder.add_test(config, rule)
+    tests = [rule for rule in _args_to_rules(loader, args)
+             if isinstance(rule, Test)]
+    if changed_files is not None:
+      # Only run the tests which depend on something that changed.  Tests
+      # whose dependencies can't be known before building count as affected.
+      affected = builder.affected_tests(config, tests, changed_files)
+      console.write("%d of %d tests are affected by the changed files." %
+                    (len(affected), len(tests)))
+      tests = affected
+    for test in tests:
+      builder.add_test(config, test)
   else:
     # caihsiaoster: Support ":all" to build all targets in the sebs
     prefix = args[0].split(":", 1)
@@ -260,6 +335,15 @@ def build(config, argv):
       thread.join()
   finally:
     _save_pickle(caching_runner, "cache.pickle")
+    subprocess_runner.shutdown()
+    history.close()
+    console.flush()
+
+  if sync:
+    # Outputs are written without fsync()ing them one by one, so do them all
+    # at once now.
+    for linked_config in config.get_all_linked_configs():
+      linked_config.sync()
 
   if builder.failed:
     return 1
@@ -274,18 +358,24 @@ def build(config, argv):
 
 def script(config, argv):
   try:
-    opts, args = getopt.getopt(argv[1:], "o:", [])
+    opts, args = getopt.getopt(argv[1:], "o:", ["format="])
   except getopt.error, message:
     raise UsageError(message)
 
   filename = None
+  format = "sh"
 
   for name, value in opts:
     if name == "-o":
       filename = value
+    elif name == "--format":
+      if value not in ScriptBuilder.FORMATS:
+        raise UsageError("--format must be one of: %s" %
+                         ", ".join(ScriptBuilder.FORMATS))
+      format = value
 
   loader = Loader(config.root_dir)
-  builder = ScriptBuilder()
+  builder = ScriptBuilder(format)
 
   for rule in _args_to_rules(loader, args):
     if isinstance(rule, Test):
@@ -303,9 +393,88 @@ def script(config, argv):
 
   if filename is not None:
     out.close()
-    mask = os.umask(0)
-    os.umask(mask)
-    os.chmod(filename, 0777 & ~mask)
+    if format == "sh":
+      mask = os.umask(0)
+      os.umask(mask)
+      os.chmod(filename, 0777 & ~mask)
+
+# --------------------------------------------------------------------
+
+def _format_rss(kilobytes):
+  return "%.1fMB" % (kilobytes / 1024.0)
+
+def stats(config, argv):
+  try:
+    opts, args = getopt.getopt(argv[1:], "n:b:a:", [])
+  except getopt.error, message:
+    raise UsageError(message)
+
+  count = 10
+  build_count = 10
+  action_name = None
+
+  for name, value in opts:
+    if name == "-n":
+      count = int(value)
+    elif name == "-b":
+      build_count = int(value)
+    elif name == "-a":
+      action_name = value
+
+  if not os.path.exists(_HISTORY_FILE):
+    print "No builds recorded yet."
+    return 0
+
+  history = BuildHistory(_HISTORY_FILE)
+  try:
+    if action_name is not None:
+      print "History of actions matching \"%s\":" % action_name
+      print "  %6s %8s %8s %9s  %s" % ("build", "wall", "cpu", "max rss",
+                                       "action")
+      for build, config_name, verb, name, wall, cpu, rss in \
+          history.action_trend(action_name, build_count):
+        if config_name is not None:
+          name = "%s: %s" % (config_name, name)
+        print "  %6d %7.2fs %7.2fs %9s  %s: %s" % (
+            build, wall, cpu, _format_rss(rss), verb, name)
+      return 0
+
+    last_build = history.last_build()
+    if last_build is None:
+      print "No builds recorded yet."
+      return 0
+
+    (build, start_time, command) = last_build
+    print "Last build: #%d at %s: %s" % (
+        build, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time)),
+        command)
+
+    for title, column in [("Slowest actions", "wall_time"),
+                          ("Largest memory use", "max_rss")]:
+      print
+      print "%s:" % title
+      print "  %8s %8s %9s  %s" % ("wall", "cpu", "max rss", "action")
+      for config_name, verb, name, wall, cpu, rss in \
+          history.top_actions(build, column, count):
+        if config_name is not None:
+          name = "%s: %s" % (config_name, name)
+        print "  %7.2fs %7.2fs %9s  %s: %s" % (
+            wall, cpu, _format_rss(rss), verb, name)
+
+    print
+    print "Recent builds:"
+    print "  %6s %19s %7s %9s %9s %9s  %s" % (
+        "build", "started", "actions", "wall", "cpu", "max rss", "command")
+    for build, start_time, command, actions, wall, cpu, rss in \
+        history.build_totals(build_count):
+      print "  %6d %19s %7d %8.2fs %8.2fs %9s  %s" % (
+          build,
+          time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start_time)),
+          actions, wall, cpu, _format_rss(rss), command)
+  finally:
+    history.close()
+
+  return 0
 
 # --------------------------------------------------------------------
 
@@ -328,6 +497,10 @@ def clean(config, argv):
   #   are specific to the configs being cleaned.
   if os.path.exists("cache.pickle"):
     os.remove("cache.pickle")
+  # The build history, on the other hand, is not a cache, so only goes away
+  # with --expunge.
+  if expunge and os.path.exists(_HISTORY_FILE):
+    os.remove(_HISTORY_FILE)
 
   for linked_config in config.get_all_linked_configs():
     if linked_config.name is None:
@@ -368,6 +541,8 @@ def main(argv):
       return script(config, args)
     elif args[0] == "clean":
       return clean(config, args)
+    elif args[0] == "stats":
+      return stats(config, args)
     else:
       raise UsageError("Unknown command: %s" % args[0])
   finally:
@@ -33,28 +33,183 @@
 """Constructs a par file from a set of Python sources.
 
 Usage:
-  make_py_binary.py -m MAIN_MODULE -o PARFILE [-p PYTHONPATH] SOURCE_FILES
+  make_py_binary.py -m MAIN_MODULE -o PARFILE [-p PYTHONPATH] [-z] [-s]
+                    SOURCE_FILES
+  make_py_binary.py -c -o PYCFILE [-p PYTHONPATH] SOURCE_FILE
+
+Options:
+  -m MAIN_MODULE  Module to run, as it would be passed to "python -m".
+  -o PARFILE      Where to write the par file.
+  -p PYTHONPATH   Colon-separated directories which SOURCE_FILES are relative
+                  to.  Each file is stored under its name relative to the first
+                  directory containing it.
+  -z              Compress the archive members.  This makes the par smaller but
+                  a little slower to start.
+  -s              Also store each module's source, so that tracebacks can
+                  quote it.  See below for why this isn't the default.
+  -c              Instead of building a par, compile SOURCE_FILE to the .pyc
+                  which a par would contain for it.
+
+A SOURCE_FILE may be given as SOURCE=PYCFILE, where PYCFILE was written by
+"make_py_binary.py -c" for SOURCE with the same PYTHONPATH.  The par then
+includes PYCFILE rather than compiling SOURCE again, so that a build system
+can compile each module separately and only recompile the ones which changed.
+
+A par file is a zip archive preceded by a "#!" line, so that it can be run
+directly.  Each module is stored compiled to a .pyc, so that importing it
+doesn't have to compile it again on every run.  Packages which have no
+__init__.py among SOURCE_FILES get an empty one.
+
+A .pyc can only be loaded by the Python version which compiled it, so the "#!"
+line names the interpreter running this script.  The par's __main__.py is
+stored as source, and exits with an explanation if it is run by any other
+version anyway (e.g. "python2.6 PARFILE").
+
+The output depends only on the inputs:  members are sorted by name and all
+timestamps are fixed, so rebuilding unchanged sources produces an identical
+file on the same machine.  The exception is -s:  zipimport only uses a .pyc whose recorded
+modification time matches its .py's timestamp in the archive, which it
+interprets in the local time zone.  With -s the .pyc files therefore record
+that timestamp in the build machine's time zone, so the par depends on it, and
+run in another time zone the par compiles every module on each start.  Without
+-s there is no .py to compare against, and zipimport skips the check.
 """
 
 import getopt
+import imp
+import marshal
 import os
-import stat
+import struct
 import sys
-import tempfile
+import time
 import zipfile
 
 class UsageError(Exception):
   pass
 
+class CompileError(Exception):
+  pass
+
+# Timestamp recorded for every archive member.  This is the earliest date a
+# zip file can represent.
+_DATE_TIME = (1980, 1, 1, 0, 0, 0)
+
+# Modification time recorded in compiled modules.  zipimport ignores it when
+# the archive has no source for the module.
+_PYC_MTIME = 0
+
+# This has to work in any Python version, so that it can say which one to use.
+_MAIN_TEMPLATE = """import sys
+if tuple(sys.version_info[:2]) != %(version)r:
+  sys.exit("%%s was compiled for Python %%d.%%d, but is being run by %%d.%%d." %%
+           ((sys.argv[0],) + %(version)r + tuple(sys.version_info[:2])))
+import runpy
+runpy.run_module(%(main_module)r, run_name = "__main__", alter_sys = True)
+"""
+
+def compile_source(source, arcname):
+  """Compiles the text of a Python module and returns the contents of the
+  .pyc file which the current interpreter would write for it.  |arcname| is
+  the filename recorded in the code, e.g. for tracebacks."""
+
+  # compile() insists on "\n" line endings and a trailing newline.
+  source = source.replace("\r\n", "\n").replace("\r", "\n")
+  if not source.endswith("\n"):
+    source += "\n"
+  code = compile(source, arcname, "exec")
+  return imp.get_magic() + struct.pack("<I", _PYC_MTIME) + marshal.dumps(code)
+
+def _source_mtime():
+  """Returns the modification time zipimport sees for a .py member, which it
+  converts from the archive's timestamp using local time."""
+
+  return int(time.mktime(_DATE_TIME + (0, 0, -1)))
+
+def _compile_member(content, arcname):
+  try:
+    return compile_source(content, arcname)
+  except SyntaxError, error:
+    raise CompileError("%s:%s: %s" % (arcname, error.lineno, error.msg))
+
+def _arcname(file, path):
+  for dir in path:
+    if file.startswith(dir + "/"):
+      return file[(len(dir) + 1):]
+  return file
+
+def _package_inits(arcnames):
+  """Returns the names of __init__.py files needed to make each directory
+  containing a module in |arcnames| importable as a package."""
+
+  result = set()
+  for arcname in arcnames:
+    dir = os.path.dirname(arcname)
+    while dir != "":
+      result.add(dir + "/__init__.py")
+      dir = os.path.dirname(dir)
+  return result - set(arcnames)
+
+def write_par(output, main_module, members, compress = False,
+              keep_sources = False):
+  """Writes a par file.  |members| maps archive names to contents.  Modules
+  without a corresponding .pyc in |members| are compiled, and a __main__.py
+  which runs |main_module| is added.  Unless |keep_sources| is true, only the
+  .pyc of each module other than __main__ is written."""
+
+  members = dict(members)
+  if "__main__.py" in members:
+    raise UsageError("Sources may not include a top-level __main__.py.")
+  for arcname in _package_inits([name for name in members
+                                 if name.endswith(".py")]):
+    members[arcname] = ""
+
+  for arcname, content in members.items():
+    if arcname.endswith(".py"):
+      if arcname + "c" not in members:
+        members[arcname + "c"] = _compile_member(content, arcname)
+      if keep_sources:
+        pyc = members[arcname + "c"]
+        members[arcname + "c"] = \
+            pyc[:4] + struct.pack("<I", _source_mtime()) + pyc[8:]
+      else:
+        del members[arcname]
+  members["__main__.py"] = _MAIN_TEMPLATE % {
+      "version": tuple(sys.version_info[:2]), "main_module": main_module }
+
+  if compress:
+    compress_type = zipfile.ZIP_DEFLATED
+  else:
+    compress_type = zipfile.ZIP_STORED
+
+  fd = os.open(output, os.O_WRONLY | os.O_TRUNC | os.O_CREAT, 0777)
+  file = os.fdopen(fd, "wb")
+  try:
+    file.write("#! %s\n" % sys.executable)
+    # Offsets in the archive are relative to the start of the file, so the
+    # launcher doesn't stop it from being read as a zip.
+    zip = zipfile.ZipFile(file, "w")
+    for arcname in sorted(members):
+      info = zipfile.ZipInfo(arcname, _DATE_TIME)
+      info.compress_type = compress_type
+      info.create_system = 3  # Unix, so that external_attr is meaningful.
+      info.external_attr = 0644 << 16
+      zip.writestr(info, members[arcname])
+    zip.close()
+  finally:
+    file.close()
+
 def main(argv):
   try:
-    opts, args = getopt.getopt(sys.argv[1:], "hm:o:p:", ["--help"])
+    opts, args = getopt.getopt(argv[1:], "hm:o:p:zsc", ["help"])
   except getopt.error, message:
     raise UsageError(message)
 
   main_module = None
   output = None
   path = []
+  compress = False
+  keep_sources = False
+  compile_only = False
 
   for name, value in opts:
     if name in ("-h", "--help"):
@@ -66,47 +221,55 @@ def main(argv):
       output = value
     elif name == "-p":
       path.extend(value.split(":"))
+    elif name == "-z":
+      compress = True
+    elif name == "-s":
+      keep_sources = True
+    elif name == "-c":
+      compile_only = True
 
-  if main_module is None:
-    raise UsageError("Missing required flag -m.")
   if output is None:
     raise UsageError("Missing required flag -o.")
 
-  temporary = tempfile.NamedTemporaryFile()
-  tempname = temporary.name
-  temporary.close()
-
-  zip = zipfile.ZipFile(tempname, "w")
+  if compile_only:
+    if len(args) != 1:
+      raise UsageError("-c requires exactly one source file.")
+    pyc = _compile_member(open(args[0], "rb").read(),
+                          _arcname(args[0], path))
+    file = open(output, "wb")
+    file.write(pyc)
+    file.close()
+    return 0
 
-  for file in args:
-    arcname = file
-    for dir in path:
-      if file.startswith(dir + "/"):
-        arcname = file[(len(dir) + 1):]
-        break
-    zip.write(file, arcname)
-
-  zip.close()
-
-  fd = os.open(output, os.O_WRONLY | os.O_TRUNC | os.O_CREAT, 0777)
-  file = os.fdopen(fd, "w")
-
-  file.write(
-      "#! /bin/sh\n"
-      "PYTHONPATH=`which $0`:\"$PYTHONPATH\" python -m %s \"$@\" || exit 1\n"
-      "exit 0\n" % main_module)
+  if main_module is None:
+    raise UsageError("Missing required flag -m.")
 
-  temporary = open(tempname, "rb")
-  file.write(temporary.read())
-  temporary.close()
-  os.remove(tempname)
+  members = {}
+  for arg in args:
+    file, _, pyc_file = arg.partition("=")
+    arcname = _arcname(file, path)
+    members[arcname] = open(file, "rb").read()
+    if pyc_file != "":
+      members[arcname + "c"] = open(pyc_file, "rb").read()
 
-  file.close()
+  write_par(output, main_module, members, compress, keep_sources)
+  return 0
 
-if __name__ == "__main__":
+def _run(argv):
   try:
-    sys.exit(main(sys.argv))
+    return main(argv)
   except UsageError, error:
     print >>sys.stderr, error.message
     print >>sys.stderr, "for help use --help"
-    sys.exit(2)
+    return 2
+  except CompileError, error:
+    print >>sys.stderr, error.message
+    return 1
+
+if __name__ == "__main__":
+  if "--persistent_worker" in sys.argv[1:]:
+    # Imported lazily so that this script still works standalone, e.g. from
+    # a generated build script.
+    from sebs import worker
+    sys.exit(worker.run_worker(_run))
+  sys.exit(_run(sys.argv))
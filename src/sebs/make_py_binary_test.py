@@ -0,0 +1,204 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import imp
+import marshal
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+import zipfile
+
+from sebs import make_py_binary
+from sebs.make_py_binary import CompileError, write_par
+
+class MakePyBinaryTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    self.output = os.path.join(self.dir, "foo")
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def readMembers(self, filename):
+    zip = zipfile.ZipFile(filename)
+    result = {}
+    for info in zip.infolist():
+      result[info.filename] = zip.read(info)
+    zip.close()
+    return result
+
+  def testContents(self):
+    write_par(self.output, "foo.bar",
+              {"foo/bar.py": "import sys\nVALUE = 123"})
+
+    self.assertTrue(open(self.output).read().startswith(
+        "#! %s\n" % sys.executable))
+    self.assertTrue(os.access(self.output, os.X_OK))
+
+    members = self.readMembers(self.output)
+    self.assertEquals(["__main__.py", "foo/__init__.pyc", "foo/bar.pyc"],
+                      sorted(members))
+    self.assertTrue("'foo.bar'" in members["__main__.py"])
+
+    # The .pyc holds the compiled module.
+    pyc = members["foo/bar.pyc"]
+    self.assertEquals(imp.get_magic(), pyc[:4])
+    namespace = {}
+    exec marshal.loads(pyc[8:]) in namespace
+    self.assertEquals(123, namespace["VALUE"])
+
+  def testKeepSources(self):
+    write_par(self.output, "foo.bar", {"foo/bar.py": "VALUE = 123\n"},
+              keep_sources = True)
+
+    members = self.readMembers(self.output)
+    self.assertEquals(["__main__.py",
+                       "foo/__init__.py", "foo/__init__.pyc",
+                       "foo/bar.py", "foo/bar.pyc"], sorted(members))
+    self.assertEquals("", members["foo/__init__.py"])
+
+  def testDeterministic(self):
+    members = {"foo/bar.py": "pass\n", "foo/baz.py": "pass\n"}
+    write_par(self.output, "foo.bar", members)
+    first = open(self.output, "rb").read()
+
+    other = os.path.join(self.dir, "other")
+    write_par(other, "foo.bar", dict(reversed(members.items())))
+    self.assertEquals(first, open(other, "rb").read())
+
+    for info in zipfile.ZipFile(other).infolist():
+      self.assertEquals(make_py_binary._DATE_TIME, info.date_time)
+
+  def setTimeZone(self, zone):
+    if zone is None:
+      del os.environ["TZ"]
+    else:
+      os.environ["TZ"] = zone
+    time.tzset()
+
+  def testTimeZone(self):
+    # The par doesn't depend on the time zone it is built in, and zipimport
+    # uses its .pyc files in any other.
+    old_zone = os.environ.get("TZ")
+    try:
+      self.setTimeZone("UTC")
+      write_par(self.output, "foo", {"foo.py": "print 'ran foo'\n"})
+      self.setTimeZone("Asia/Tokyo")
+      other = os.path.join(self.dir, "other")
+      write_par(other, "foo", {"foo.py": "print 'ran foo'\n"})
+    finally:
+      self.setTimeZone(old_zone)
+    self.assertEquals(open(self.output, "rb").read(),
+                      open(other, "rb").read())
+
+    process = subprocess.Popen([sys.executable, "-v", self.output],
+                               stdout = subprocess.PIPE,
+                               stderr = subprocess.STDOUT)
+    log = process.communicate()[0]
+    self.assertEquals(0, process.returncode)
+    self.assertTrue("ran foo" in log)
+    self.assertFalse("bad mtime" in log)
+
+  def testOtherPythonVersion(self):
+    # Another version can't load the .pyc files, but says which to use.
+    write_par(self.output, "foo", {"foo.py": "pass\n"})
+    other_main = self.readMembers(self.output)["__main__.py"].replace(
+        repr(tuple(sys.version_info[:2])), "(1, 5)")
+    main = os.path.join(self.dir, "main.py")
+    open(main, "w").write(other_main)
+    process = subprocess.Popen([sys.executable, main],
+                               stderr = subprocess.PIPE)
+    message = process.communicate()[1]
+    self.assertEquals(1, process.returncode)
+    self.assertEquals("%s was compiled for Python 1.5, but is being run by "
+                      "%d.%d.\n" % ((main,) + sys.version_info[:2]), message)
+
+  def testCompress(self):
+    members = {"foo.py": "x = 1\n" * 1000}
+    write_par(self.output, "foo", members)
+    write_par(self.output + ".z", "foo", members, compress = True)
+
+    self.assertTrue(os.path.getsize(self.output + ".z") <
+                    os.path.getsize(self.output))
+    self.assertEquals(self.readMembers(self.output),
+                      self.readMembers(self.output + ".z"))
+
+  def testSyntaxError(self):
+    self.assertRaises(CompileError, write_par, self.output, "foo",
+                      {"foo.py": "def foo(:\n"})
+
+  def testMain(self):
+    source = os.path.join(self.dir, "src", "foo", "bar.py")
+    os.makedirs(os.path.dirname(source))
+    open(source, "w").write("pass\n")
+
+    self.assertEquals(0, make_py_binary.main(
+        ["make_py_binary.py", "-m", "foo.bar", "-o", self.output,
+         "-p", os.path.join(self.dir, "src"), source]))
+    self.assertTrue("foo/bar.pyc" in self.readMembers(self.output))
+
+  def testPrecompiled(self):
+    # A .pyc given with the source is used as-is.
+    write_par(self.output, "foo",
+              {"foo.py": "pass\n", "foo.pyc": "precompiled"})
+    self.assertEquals("precompiled", self.readMembers(self.output)["foo.pyc"])
+
+  def testCompileOnly(self):
+    source = os.path.join(self.dir, "src", "foo", "bar.py")
+    os.makedirs(os.path.dirname(source))
+    open(source, "w").write("VALUE = 123\n")
+    pyc = os.path.join(self.dir, "bar.pyc")
+
+    src_dir = os.path.join(self.dir, "src")
+    self.assertEquals(0, make_py_binary.main(
+        ["make_py_binary.py", "-c", "-o", pyc, "-p", src_dir, source]))
+    self.assertEquals(make_py_binary.compile_source("VALUE = 123\n",
+                                                    "foo/bar.py"),
+                      open(pyc, "rb").read())
+
+    # Building from the .pyc gives the same par as compiling in one step.
+    self.assertEquals(0, make_py_binary.main(
+        ["make_py_binary.py", "-m", "foo.bar", "-o", self.output,
+         "-p", src_dir, source]))
+    other = os.path.join(self.dir, "other")
+    self.assertEquals(0, make_py_binary.main(
+        ["make_py_binary.py", "-m", "foo.bar", "-o", other,
+         "-p", src_dir, source + "=" + pyc]))
+    self.assertEquals(open(self.output, "rb").read(),
+                      open(other, "rb").read())
+
+if __name__ == "__main__":
+  unittest.main()
@@ -0,0 +1,187 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+"""Benchmarks the startup time of par files built by make_py_binary.py.
+
+Usage:
+  par_benchmark.py [-r REPEAT] [-n RUNS] [-d DIRECTORY] [ARGS]
+
+Options:
+  -r REPEAT       Number of times to time each par; the fastest is reported.
+                  Default: 3
+  -n RUNS         Number of times to run the par within each timing.
+                  Default: 20
+  -d DIRECTORY    Directory in which to create temporary files.  Default: the
+                  system temp directory.
+
+Packages the sebs sources next to this script into a copy of bin/sebs in each
+of the forms listed below, then times running each one with ARGS (default:
+--help), which measures little more than interpreter startup and importing
+sebs.main.
+
+  sources         Uncompressed sources behind a shell launcher which puts the
+                  par on PYTHONPATH and runs "python -m".  This is how
+                  make_py_binary.py used to build pars.
+  precompiled     What make_py_binary.py builds by default.
+  compressed      What make_py_binary.py builds with -z.
+"""
+
+import getopt
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+
+from sebs import make_py_binary
+
+class UsageError(Exception):
+  pass
+
+_MAIN_MODULE = "sebs.main"
+
+def _time(function, repeat):
+  """Runs function() |repeat| times and returns the fastest time in seconds."""
+
+  best = None
+  for i in xrange(repeat):
+    start = time.time()
+    function()
+    elapsed = time.time() - start
+    if best is None or elapsed < best:
+      best = elapsed
+  return best
+
+def _run(command, runs):
+  for i in xrange(runs):
+    proc = subprocess.Popen(command, stdout = subprocess.PIPE,
+                            stderr = subprocess.STDOUT)
+    output = proc.communicate()[0]
+    if proc.returncode != 0:
+      raise subprocess.CalledProcessError(proc.returncode, " ".join(command),
+                                          output)
+
+def _read_sources():
+  """Returns a map from archive names to contents for each non-test module in
+  the sebs package."""
+
+  package_dir = os.path.dirname(os.path.abspath(__file__))
+  members = {}
+  for name in sorted(os.listdir(package_dir)):
+    if name.endswith(".py") and not name.endswith("_test.py"):
+      members["sebs/" + name] = open(os.path.join(package_dir, name)).read()
+  return members
+
+def _write_sources_par(output, members):
+  """Writes a par the way make_py_binary.py did before it precompiled
+  modules."""
+
+  file = open(output, "wb")
+  file.write(
+      "#! /bin/sh\n"
+      "PYTHONPATH=`which $0`:\"$PYTHONPATH\" python -m %s \"$@\" || exit 1\n"
+      "exit 0\n" % _MAIN_MODULE)
+  zip = zipfile.ZipFile(file, "w")
+  for arcname in sorted(members):
+    zip.writestr(arcname, members[arcname])
+  zip.close()
+  file.close()
+  os.chmod(output, 0755)
+
+def benchmark(tempdir, options, args):
+  members = _read_sources()
+
+  pars = []
+  output = os.path.join(tempdir, "sources")
+  _write_sources_par(output, members)
+  pars.append(("sources", output))
+  for label, compress in [("precompiled", False), ("compressed", True)]:
+    output = os.path.join(tempdir, label)
+    make_py_binary.write_par(output, _MAIN_MODULE, members, compress)
+    pars.append((label, output))
+
+  print "sebs %s, %d modules, %d runs:" % (
+      " ".join(args), len(members), options.runs)
+  for label, output in pars:
+    command = [output] + args
+    seconds = _time(lambda: _run(command, options.runs), options.repeat)
+    print "  %-40s %10.3f ms/run  %8.1f kB" % (
+        label, seconds * 1000 / options.runs,
+        os.path.getsize(output) / 1024.0)
+
+class _Options(object):
+  def __init__(self):
+    self.repeat = 3
+    self.runs = 20
+
+def main(argv):
+  try:
+    opts, args = getopt.getopt(argv[1:], "hr:n:d:", ["help"])
+  except getopt.error, message:
+    raise UsageError(message)
+
+  options = _Options()
+  parent_dir = None
+
+  for name, value in opts:
+    if name in ("-h", "--help"):
+      print __doc__
+      return 0
+    elif name == "-r":
+      options.repeat = int(value)
+    elif name == "-n":
+      options.runs = int(value)
+    elif name == "-d":
+      parent_dir = value
+
+  if options.runs < 1:
+    raise UsageError("Need at least one run.")
+
+  if len(args) == 0:
+    args = ["--help"]
+
+  tempdir = tempfile.mkdtemp(dir = parent_dir)
+  try:
+    benchmark(tempdir, options, args)
+  finally:
+    shutil.rmtree(tempdir)
+
+  return 0
+
+if __name__ == "__main__":
+  try:
+    sys.exit(main(sys.argv))
+  except UsageError, error:
+    print >>sys.stderr, error.message
+    print >>sys.stderr, "for help use --help"
+    sys.exit(2)
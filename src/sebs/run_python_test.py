@@ -0,0 +1,112 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Runs a Python test, or one shard of it.
+
+Usage:
+  run_python_test.py MAIN [ARGS...]
+
+Runs MAIN as "python MAIN ARGS..." would.  If the environment variables
+TEST_SHARD_INDEX and TEST_TOTAL_SHARDS are set (see sharding.sebs), only the
+test cases whose position among all of MAIN's cases, modulo
+TEST_TOTAL_SHARDS, is TEST_SHARD_INDEX are run.  MAIN must run its cases with
+unittest.main().
+"""
+
+import os
+import runpy
+import sys
+import unittest
+
+class UsageError(Exception):
+  pass
+
+def _test_cases(suite):
+  if isinstance(suite, unittest.TestSuite):
+    for test in suite:
+      for case in _test_cases(test):
+        yield case
+  else:
+    yield suite
+
+def shard_suite(suite, index, count):
+  """Returns a suite containing the cases of |suite| which belong to shard
+  |index| of |count|."""
+
+  return unittest.TestSuite([case for position, case
+                             in enumerate(_test_cases(suite))
+                             if position % count == index])
+
+def _shard_from_environment():
+  """Returns (index, count) as given by the environment, or None if the test
+  isn't sharded."""
+
+  if "TEST_TOTAL_SHARDS" not in os.environ:
+    return None
+  try:
+    index = int(os.environ.get("TEST_SHARD_INDEX", ""))
+    count = int(os.environ["TEST_TOTAL_SHARDS"])
+  except ValueError:
+    raise UsageError("TEST_SHARD_INDEX and TEST_TOTAL_SHARDS must be numbers.")
+  if count < 1 or index < 0 or index >= count:
+    raise UsageError("Invalid shard %d of %d." % (index, count))
+  return (index, count)
+
+def main(argv):
+  if len(argv) < 2:
+    raise UsageError("Missing MAIN.")
+  if argv[1] in ("-h", "--help"):
+    print __doc__
+    return 0
+
+  shard = _shard_from_environment()
+  if shard is not None:
+    (index, count) = shard
+    run_tests = unittest.TestProgram.runTests
+    def run_shard(program):
+      program.test = shard_suite(program.test, index, count)
+      run_tests(program)
+    unittest.TestProgram.runTests = run_shard
+
+  main_file = argv[1]
+  sys.argv = argv[1:]
+  sys.path[0] = os.path.dirname(os.path.abspath(main_file))
+  runpy.run_path(main_file, run_name = "__main__")
+  return 0
+
+if __name__ == "__main__":
+  try:
+    sys.exit(main(sys.argv))
+  except UsageError, error:
+    print >>sys.stderr, error.message
+    print >>sys.stderr, "for help use --help"
+    sys.exit(2)
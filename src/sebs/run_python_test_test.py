@@ -0,0 +1,111 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from sebs.run_python_test import shard_suite
+
+_MAIN = """import unittest
+class FooTest(unittest.TestCase):
+  def record(self):
+    open("ran.txt", "a").write(self.id().split(".")[-1] + "\\n")
+  def testA(self): self.record()
+  def testB(self): self.record()
+  def testC(self): self.record()
+class BarTest(unittest.TestCase):
+  def testD(self): open("ran.txt", "a").write("testD\\n")
+  def testE(self): open("ran.txt", "a").write("testE\\n")
+if __name__ == "__main__":
+  unittest.main()
+"""
+
+class ShardSuiteTest(unittest.TestCase):
+  def testShards(self):
+    class FooTest(unittest.TestCase):
+      def testA(self): pass
+      def testB(self): pass
+      def testC(self): pass
+
+    suite = unittest.TestLoader().loadTestsFromTestCase(FooTest)
+    self.assertEquals(["testA", "testC"],
+        [case.id().split(".")[-1] for case in shard_suite(suite, 0, 2)])
+    self.assertEquals(["testB"],
+        [case.id().split(".")[-1] for case in shard_suite(suite, 1, 2)])
+    self.assertEquals(0, shard_suite(suite, 3, 4).countTestCases())
+
+class RunPythonTestTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    open(os.path.join(self.dir, "foo_test.py"), "w").write(_MAIN)
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def run_test(self, env):
+    """Runs foo_test.py and returns the names of the cases which ran."""
+
+    runner = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "run_python_test.py")
+    full_env = dict(os.environ)
+    for name in ("TEST_SHARD_INDEX", "TEST_TOTAL_SHARDS"):
+      full_env.pop(name, None)
+    full_env.update(env)
+    proc = subprocess.Popen([sys.executable, runner, "foo_test.py"],
+                            cwd = self.dir, env = full_env,
+                            stdout = subprocess.PIPE,
+                            stderr = subprocess.STDOUT)
+    proc.communicate()
+    self.assertEquals(0, proc.returncode)
+
+    ran_file = os.path.join(self.dir, "ran.txt")
+    ran = open(ran_file).read().split()
+    os.remove(ran_file)
+    return ran
+
+  def testUnsharded(self):
+    self.assertEquals(5, len(self.run_test({})))
+
+  def testShards(self):
+    shards = [set(self.run_test({ "TEST_SHARD_INDEX": str(index),
+                                  "TEST_TOTAL_SHARDS": "2" }))
+              for index in range(2)]
+    self.assertEquals(set(), shards[0] & shards[1])
+    self.assertEquals(set(["testA", "testB", "testC", "testD", "testE"]),
+                      shards[0] | shards[1])
+
+if __name__ == "__main__":
+  unittest.main()
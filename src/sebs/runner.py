@@ -30,18 +30,24 @@
 # OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 
 import cStringIO
+import errno
 #import md5
 import hashlib
 import os
 import subprocess
 import tempfile
 import signal
+import threading
+import time
 
 from sebs.core import Action, Artifact, ContentToken, DefinitionError
 from sebs.filesystem import Directory
 from sebs.helpers import typecheck
 from sebs.command import CommandContext, Command, ArtifactEnumerator
 from sebs.console import ColoredText
+from sebs.include_scanner import IncludeCache
+from sebs.history import BuildHistory, ResourceUsage
+from sebs import worker as worker_protocol
 
 class ActionRunner(object):
   """Abstract interface for an object which can execute actions."""
@@ -59,14 +65,307 @@ class ActionRunner(object):
     TODO(kenton):  Too many arguments, need to organize better."""
     raise NotImplementedError
 
+# Memory-backed directories are often small (64MB by default in Docker
+# containers), and filling one can break other programs, so they're only used
+# while they have at least this much space free.
+_MIN_MEMORY_BACKED_FREE_SPACE = 256 * 1024 * 1024
+
+def _allows_exec(dir):
+  """Returns whether files in |dir| can be executed, i.e. it isn't mounted
+  noexec."""
+
+  try:
+    (fd, path) = tempfile.mkstemp(dir = dir)
+  except OSError:
+    return False
+  try:
+    try:
+      os.write(fd, "#! /bin/sh\n")
+      os.fchmod(fd, 0700)
+    finally:
+      os.close(fd)
+    try:
+      return subprocess.call([path]) == 0
+    except OSError:
+      return False
+  finally:
+    os.remove(path)
+
+def _free_space(dir):
+  stat = os.statvfs(dir)
+  return stat.f_bavail * stat.f_frsize
+
+def _find_memory_backed_dir(candidates = ["/dev/shm", "/run/shm"]):
+  """Returns a writable directory which is backed by RAM rather than disk and
+  which allows executing files, or None if there doesn't seem to be one."""
+
+  for dir in candidates:
+    if os.path.isdir(dir) and os.access(dir, os.W_OK | os.X_OK) and \
+       _allows_exec(dir):
+      return dir
+  return None
+
+def _choose_mem_file_dir(memory_backed_dir, min_free_space):
+  """Returns |memory_backed_dir| if it has |min_free_space| bytes free, or
+  None otherwise."""
+
+  if memory_backed_dir is None:
+    return None
+  try:
+    if _free_space(memory_backed_dir) < min_free_space:
+      return None
+  except OSError:
+    return None
+  return memory_backed_dir
+
+# Found by _mem_file_temp_dir() on first use, since probing it runs a
+# subprocess.
+_memory_backed_dir = None
+_memory_backed_dir_lock = threading.Lock()
+_memory_backed_dir_found = False
+
+def _mem_file_temp_dir():
+  """Returns where to put temporary files representing memory artifacts, when
+  a subprocess needs a disk path for one.  None means the system temp
+  directory.  These files only live for the duration of one action, so
+  there's no reason for them to touch the disk at all, as long as there is
+  memory-backed space to spare.
+
+  Ideally we'd use memfd_create() or pipes via /dev/fd, but the former is not
+  available to us and the latter cannot be re-read, seeked, or executed, all
+  of which commands may expect of an input file."""
+
+  global _memory_backed_dir, _memory_backed_dir_found
+  _memory_backed_dir_lock.acquire()
+  try:
+    if not _memory_backed_dir_found:
+      _memory_backed_dir = _find_memory_backed_dir()
+      _memory_backed_dir_found = True
+  finally:
+    _memory_backed_dir_lock.release()
+  return _choose_mem_file_dir(_memory_backed_dir,
+                              _MIN_MEMORY_BACKED_FREE_SPACE)
+
+class _AccountingPopen(subprocess.Popen):
+  """A Popen which records the child's resource usage, as reported by
+  os.wait4(), in its "rusage" attribute once it has been waited for.  We can't
+  use getrusage(RUSAGE_CHILDREN) since with -j it would lump together all of
+  the subprocesses running in parallel."""
+
+  rusage = None
+
+  def wait(self):
+    # Same as Popen.wait() except for wait4().
+    while self.returncode is None:
+      try:
+        pid, sts, rusage = os.wait4(self.pid, 0)
+      except OSError, e:
+        if e.errno == errno.EINTR:
+          continue
+        if e.errno != errno.ECHILD:
+          raise
+        # SIGCHLD is being ignored, so the status is gone.
+        pid = self.pid
+        sts = 0
+        rusage = None
+      if pid == self.pid:
+        self.rusage = rusage
+        self._handle_exitstatus(sts)
+    return self.returncode
+
+class _BoundedLog(object):
+  """A file-like object which holds on to only the last |limit| bytes written
+  to it, so that an action which produces huge amounts of output can't use up
+  all our memory.  (When output is voluminous, the end usually says what went
+  wrong.)"""
+
+  def __init__(self, limit):
+    self.__limit = limit
+    self.__chunks = []
+    self.__size = 0
+    self.__discarded = 0
+
+  def write(self, text):
+    self.__chunks.append(text)
+    self.__size += len(text)
+    # Trim only once we're well over the limit so that the cost is amortized.
+    if self.__size > self.__limit * 2:
+      self.__trim()
+
+  def __trim(self):
+    text = "".join(self.__chunks)
+    excess = max(len(text) - self.__limit, 0)
+    self.__discarded += excess
+    text = text[excess:]
+    self.__chunks = [text]
+    self.__size = len(text)
+
+  def getvalue(self):
+    self.__trim()
+    if self.__discarded == 0:
+      return self.__chunks[0]
+    else:
+      return "[%d bytes of output omitted]\n%s" % (
+          self.__discarded, self.__chunks[0])
+
+def _stream_pipe(pipe, output):
+  """Copies everything from |pipe| to |output| until EOF, then closes |pipe|."""
+  try:
+    while True:
+      chunk = os.read(pipe.fileno(), 65536)
+      if chunk == "":
+        break
+      output.write(chunk)
+  finally:
+    pipe.close()
+
+def _is_stream(value):
+  """Does |value|, passed as stdout or stderr to CommandContext.subprocess(),
+  need to be streamed to by us rather than given directly to Popen?"""
+  if not hasattr(value, "write"):
+    return False
+  try:
+    value.fileno()
+    return False
+  except (AttributeError, IOError, ValueError):
+    # cStringIO objects have no fileno() at all; others may raise.
+    return True
+
+class _WorkerError(Exception):
+  pass
+
+class _Worker(object):
+  """A persistent worker process.  See worker.py.  The process is started by
+  the first request, so that constructing a _Worker is cheap enough to do
+  while holding the builder's lock."""
+
+  def __init__(self, program, env, cwd):
+    self.__program = program
+    self.__env = env
+    self.__cwd = cwd
+    self.__proc = None
+
+  def request(self, arguments, cwd):
+    """Sends a request and waits for the response, returning
+    (exit_code, stdout, stderr).  Raises _WorkerError if the worker couldn't
+    be started, died, or replied with garbage."""
+
+    if self.__proc is None:
+      try:
+        self.__proc = subprocess.Popen(
+            [self.__program, worker_protocol.WORKER_FLAG],
+            stdin = subprocess.PIPE, stdout = subprocess.PIPE,
+            env = self.__env, cwd = self.__cwd)
+      except OSError, e:
+        raise _WorkerError(str(e))
+
+    try:
+      self.__proc.stdin.write(worker_protocol.encode_request(arguments, cwd))
+      self.__proc.stdin.flush()
+      line = self.__proc.stdout.readline()
+    except IOError, e:
+      raise _WorkerError(str(e))
+    if line == "":
+      # The worker closed its output, so it is presumably exiting.  Wait so
+      # that returncode() reports how it died.
+      self.__proc.wait()
+      raise _WorkerError("Worker exited unexpectedly.")
+    try:
+      return worker_protocol.decode_response(line)
+    except (ValueError, KeyError, TypeError), e:
+      raise _WorkerError("Malformed worker response: %s" % e)
+
+  def returncode(self):
+    if self.__proc is None:
+      return None
+    return self.__proc.poll()
+
+  def kill(self):
+    if self.__proc is None:
+      return
+    if self.__proc.poll() is None:
+      # Note:  Can't use proc.kill() because it's too new.
+      try:
+        os.kill(self.__proc.pid, signal.SIGKILL)
+      except OSError:
+        pass
+    self.__proc.wait()
+
+  def shutdown(self):
+    """Asks the worker to exit by closing its input, then waits for it."""
+    if self.__proc is None:
+      return
+    try:
+      self.__proc.stdin.close()
+    except IOError:
+      pass
+    self.__proc.wait()
+
+class _WorkerPool(object):
+  """Keeps idle workers around so that later commands running the same program
+  can reuse them.  Must only be used while holding the builder's lock."""
+
+  def __init__(self):
+    # Maps (program, mtime, cwd, env) to a list of idle workers.
+    self.__idle = {}
+    self.__all_workers = []
+    # Environments are usually shared by all commands in a configuration, so
+    # we remember their keys by identity rather than recomputing them.  The
+    # environment itself is kept in the value so that the id stays valid.
+    self.__env_keys = {}
+
+  def acquire(self, program, env, cwd):
+    """Returns (key, worker), reserving a new worker if none are idle.  A new
+    worker's process isn't started until its first request, which is made
+    without holding the lock."""
+
+    # Including the program's modification time means that if a tool is
+    # rebuilt during the build, we don't keep using the old version.
+    if os.path.exists(program):
+      mtime = os.path.getmtime(program)
+    else:
+      mtime = None
+    if env is None:
+      env_key = None
+    else:
+      (_, env_key) = self.__env_keys.get(id(env), (None, None))
+      if env_key is None:
+        env_key = frozenset(env.items())
+        self.__env_keys[id(env)] = (env, env_key)
+    key = (program, mtime, cwd, env_key)
+
+    idle = self.__idle.get(key)
+    if idle:
+      return (key, idle.pop())
+    worker = _Worker(program, env, cwd)
+    self.__all_workers.append(worker)
+    return (key, worker)
+
+  def release(self, key, worker):
+    self.__idle.setdefault(key, []).append(worker)
+
+  def discard(self, worker):
+    worker.kill()
+    self.__all_workers.remove(worker)
+
+  def shutdown(self):
+    for worker in self.__all_workers:
+      worker.shutdown()
+    self.__idle = {}
+    self.__all_workers = []
+
 class _CommandContextImpl(CommandContext):
-  def __init__(self, working_dir, pending_message, verbose, real_name_map,lock):
+  def __init__(self, working_dir, pending_message, verbose, real_name_map,lock,
+               worker_pool = None, env = None):
     self.__working_dir = working_dir
+    self.__env = env
     self.__temp_files_for_mem = {}
     self.__pending_message = pending_message
     self.__verbose = verbose
     self.__real_name_map = real_name_map
     self.__lock = lock
+    self.__worker_pool = worker_pool
+    self.usage = ResourceUsage()
 
     self.__original_text = list(self.__pending_message.text)
     self.__verbose_text = []
@@ -76,21 +375,31 @@ class _CommandContextImpl(CommandContext):
     result = self.__working_dir.get_disk_path(filename)
     if result is None and use_temporary:
       if filename in self.__temp_files_for_mem:
-        result = self.__temp_files_for_mem[filename]
+        result = self.__temp_files_for_mem[filename][0]
       else:
         (fd, result) = tempfile.mkstemp(
-            suffix = "_" + os.path.basename(filename))
-        if self.__working_dir.exists(filename):
-          os.write(fd, self.__working_dir.read(filename))
+            suffix = "_" + os.path.basename(filename),
+            dir = _mem_file_temp_dir())
+        mtime = self.__working_dir.getmtime_if_exists(filename)
+        try:
+          # We don't track whether files are executable so we just set the
+          # executable bit on everything just in case.
+          os.fchmod(fd, 0700)
+          if mtime is not None:
+            content = self.__working_dir.read(filename)
+            while content:
+              content = content[os.write(fd, content):]
+        finally:
           os.close(fd)
-          mtime = self.__working_dir.getmtime(filename)
-          os.utime(result, (mtime, mtime))
+        if mtime is None:
+          original = None
         else:
-          os.close(fd)
-        # We don't track whether files are executable so we just set the
-        # executable bit on everything just in case.
-        os.chmod(result, 0700)
-        self.__temp_files_for_mem[filename] = result
+          os.utime(result, (mtime, mtime))
+          # Remember what the file looked like so that we can tell whether
+          # the command modified it.
+          stat = os.stat(result)
+          original = (stat.st_mtime, stat.st_size)
+        self.__temp_files_for_mem[filename] = (result, original)
     return result
 
   def get_disk_directory_path(self, dirname):
@@ -103,7 +412,7 @@ class _CommandContextImpl(CommandContext):
   def read(self, artifact):
     filename = self.__real_name_map[artifact]
     if filename in self.__temp_files_for_mem:
-      file = open(self.__temp_files_for_mem[filename], "rU")
+      file = open(self.__temp_files_for_mem[filename][0], "rU")
       result = file.read()
       file.close()
       return result
@@ -113,12 +422,17 @@ class _CommandContextImpl(CommandContext):
   def write(self, artifact, content):
     filename = self.__real_name_map[artifact]
     if filename in self.__temp_files_for_mem:
-      file = open(self.__temp_files_for_mem[filename], "wb")
+      file = open(self.__temp_files_for_mem[filename][0], "wb")
       file.write(content)
       file.close()
     else:
       self.__working_dir.write(filename, content)
 
+  def subprocess_environment(self):
+    if self.__env is None:
+      return super(_CommandContextImpl, self).subprocess_environment()
+    return self.__env
+
   def subprocess(self, args, **kwargs):
     if self.__verbose:
       self.__verbose_text.append("\n  ")
@@ -129,7 +443,25 @@ class _CommandContextImpl(CommandContext):
       kwargs["stdin"] = subprocess.PIPE
     else:
       stdin_str = None
-    proc = subprocess.Popen(args, **kwargs)
+    # Popen can only deal with real files, so we pipe output meant for other
+    # file-like objects and copy it over as it arrives.
+    streams = {}
+    for name in ["stdout", "stderr"]:
+      if _is_stream(kwargs.get(name)):
+        streams[name] = kwargs[name]
+        kwargs[name] = subprocess.PIPE
+
+    start_time = time.time()
+    proc = _AccountingPopen(args, **kwargs)
+
+    threads = []
+    for name, output in streams.items():
+      # Take the pipe away from proc so that communicate() doesn't buffer it.
+      pipe = getattr(proc, name)
+      setattr(proc, name, None)
+      thread = threading.Thread(target = _stream_pipe, args = [pipe, output])
+      thread.start()
+      threads.append(thread)
 
     self.__lock.release()
     try:
@@ -140,24 +472,77 @@ class _CommandContextImpl(CommandContext):
       os.kill(proc.pid, signal.SIGKILL)
       raise
     finally:
+      # The pipes hit EOF once the process is gone, which ends the threads.
+      for thread in threads:
+        thread.join()
       self.__lock.acquire()
 
+    self.usage.add(time.time() - start_time, proc.rusage)
+
     if proc.returncode == -signal.SIGINT:
       # Subprocess was killed due to ctrl+C.
       raise KeyboardInterrupt
 
     return (proc.returncode, stdout_str, stderr_str)
 
+  def worker_subprocess(self, args, env=None, cwd=None):
+    if self.__worker_pool is None:
+      return super(_CommandContextImpl, self).worker_subprocess(
+          args, env = env, cwd = cwd)
+
+    if self.__verbose:
+      self.__verbose_text.append("\n  ")
+      self.__verbose_text.append(" ".join(args))
+      self.__verbose_text.append(" (worker)")
+      self.__pending_message.update(self.__original_text + self.__verbose_text)
+
+    (key, worker) = self.__worker_pool.acquire(args[0], env, cwd)
+
+    start_time = time.time()
+    self.__lock.release()
+    try:
+      try:
+        result = worker.request(args[1:], cwd)
+      except _WorkerError:
+        result = None
+    except:
+      self.__lock.acquire()
+      self.__worker_pool.discard(worker)
+      raise
+    self.__lock.acquire()
+
+    if result is not None:
+      # The work happened in a long-lived process, so only the time taken is
+      # meaningful.
+      self.usage.add(time.time() - start_time)
+      self.__worker_pool.release(key, worker)
+      return result
+
+    returncode = worker.returncode()
+    self.__worker_pool.discard(worker)
+    if returncode == -signal.SIGINT:
+      # Worker was killed due to ctrl+C.
+      raise KeyboardInterrupt
+
+    # The worker is broken somehow.  Run the command the old-fashioned way so
+    # that the user sees whatever error it produces.
+    return super(_CommandContextImpl, self).worker_subprocess(
+        args, env = env, cwd = cwd)
+
   def status(self, text):
     self.__original_text.append(" ")
     self.__original_text.append(ColoredText(ColoredText.BLUE, text))
     self.__pending_message.update(self.__original_text + self.__verbose_text)
 
   def resolve_mem_files(self):
-    for (filename, diskfile) in self.__temp_files_for_mem.items():
-      file = open(diskfile, "rb")
-      self.__working_dir.write(filename, file, os.path.getmtime(diskfile))
-      file.close()
+    for (filename, (diskfile, original)) in self.__temp_files_for_mem.items():
+      stat = os.stat(diskfile)
+      # Most temporary files are inputs which were only read by the command,
+      # in which case copying them back would be a waste.
+      if original != (stat.st_mtime, stat.st_size):
+        file = open(diskfile, "rb")
+        self.__working_dir.write(filename, file, stat.st_mtime)
+        file.close()
       os.remove(diskfile)
     self.__temp_files_for_mem = {}
 
@@ -170,11 +555,36 @@ def _config_prefix(config):
 class SubprocessRunner(ActionRunner):
   """An ActionRunner which actually executes the commands."""
 
-  def __init__(self, console, verbose = False):
+  # Default for max_log_size.
+  DEFAULT_MAX_LOG_SIZE = 1 << 20
+
+  def __init__(self, console, verbose = False, use_workers = True,
+               history = None, max_log_size = DEFAULT_MAX_LOG_SIZE):
+    """If |history| is given, it is a BuildHistory in which the resource usage
+    of each action is recorded.  start_build() must already have been called
+    on it.
+
+    Only the last |max_log_size| bytes of output from each action are kept for
+    display.  Output captured to artifacts is not limited."""
+
     super(SubprocessRunner, self).__init__()
+    typecheck(history, BuildHistory)
 
     self.__console = console
     self.__verbose = verbose
+    self.__history = history
+    self.__max_log_size = max_log_size
+    if use_workers:
+      self.__worker_pool = _WorkerPool()
+    else:
+      self.__worker_pool = None
+
+  def shutdown(self):
+    """Stops any persistent workers which were started.  Call once the build
+    is complete."""
+
+    if self.__worker_pool is not None:
+      self.__worker_pool.shutdown()
 
   def run(self, action, inputs, disk_inputs, outputs, test_result, config,
           real_name_map, lock):
@@ -192,13 +602,23 @@ class SubprocessRunner(ActionRunner):
       config.root_dir.mkdir(os.path.dirname(output))
 
     context = _CommandContextImpl(
-        config.root_dir, pending_message, self.__verbose, real_name_map, lock)
+        config.root_dir, pending_message, self.__verbose, real_name_map, lock,
+        self.__worker_pool, config.subprocess_env)
 
     try:
-      log = cStringIO.StringIO()
-      result = action.command.run(context, log)
+      log = _BoundedLog(self.__max_log_size)
+      try:
+        result = action.command.run(context, log)
+      finally:
+        # The command may have modified its outputs behind the directory's
+        # back, e.g. by running a subprocess which writes them.
+        for output in real_outputs:
+          config.root_dir.invalidate(output)
       context.resolve_mem_files()
 
+      if self.__history is not None:
+        self.__history.record(config.name, action, result, context.usage)
+
       final_text = [pending_message.text]
       log_text = log.getvalue()
       if log_text != "":
@@ -298,14 +718,15 @@ class CachingRunner(ActionRunner):
     if result:
       # Action succeeded, so record it in the cache.  First we need to refresh
       # the disk input list.
-      enumerator = _DiskInputCollector(config.root_dir, real_name_map)
+      enumerator = _DiskInputCollector(config.root_dir, real_name_map,
+                                       config.include_cache)
       action.command.enumerate_artifacts(enumerator)
 
       # Must recompute hash if it was not computed before or if the disk inputs
       # changed.
       if hash is None or set(disk_inputs) != set(enumerator.disk_inputs):
         hash = self.__hash(
-            action, inputs, enumerator.disk_inputs, outputs, config.root_dir,
+            action, inputs, enumerator.disk_inputs, outputs, config,
             real_name_map)
 
       # Set new hash on all outputs.
@@ -338,7 +759,7 @@ class CachingRunner(ActionRunner):
 
     # Compute new hash and compare.
     new_hash = self.__hash(
-        action, inputs, disk_inputs, outputs, config.root_dir, real_name_map)
+        action, inputs, disk_inputs, outputs, config, real_name_map)
     if new_hash != last_hash:
       return (False, new_hash)
 
@@ -350,7 +771,9 @@ class CachingRunner(ActionRunner):
 
     return (True, new_hash)
 
-  def __hash(self, action, inputs, disk_inputs, outputs, dir, real_name_map):
+  def __hash(self, action, inputs, disk_inputs, outputs, config,
+             real_name_map):
+    dir = config.root_dir
     # Security is not a concern here, so MD5 is OK and probably faster than
     # more-secure algorithms.
     # caihsiaoster: replace depracated md5 with hashlib.
@@ -393,14 +816,20 @@ class CachingRunner(ActionRunner):
       hasher.update(" ")
       hasher.update(output)
 
+    if config.subprocess_env_digest is not None:
+      hasher.update("e")
+      hasher.update(config.subprocess_env_digest)
+
     action.command.hash(hasher)
     return hasher.digest()
 
 class _DiskInputCollector(ArtifactEnumerator):
-  def __init__(self, root_dir, real_name_map):
+  def __init__(self, root_dir, real_name_map, include_cache = None):
     typecheck(root_dir, Directory)
+    typecheck(include_cache, IncludeCache)
     self.__root_dir = root_dir
     self.__real_name_map = real_name_map
+    self.__include_cache = include_cache
     self.disk_inputs = []
 
   def add_input(self, artifact):
@@ -424,6 +853,17 @@ class _DiskInputCollector(ArtifactEnumerator):
     else:
       return None
 
+  def read_includes(self, artifact):
+    if self.__include_cache is None:
+      return super(_DiskInputCollector, self).read_includes(artifact)
+    return self.__include_cache.scan(self.__root_dir,
+                                     self.__real_name_map[artifact])
+
+  def read_disk_includes(self, filename):
+    if self.__include_cache is None:
+      return super(_DiskInputCollector, self).read_disk_includes(filename)
+    return self.__include_cache.scan(self.__root_dir, filename)
+
 # useful for debugging...
 #
 #class HashInterceptor(object):
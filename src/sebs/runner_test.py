@@ -0,0 +1,170 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import cStringIO
+import os
+import shutil
+import subprocess
+import tempfile
+import threading
+import unittest
+
+from sebs.filesystem import VirtualDirectory
+from sebs.runner import _BoundedLog, _CommandContextImpl, _WorkerError, \
+                        _WorkerPool, _allows_exec, _choose_mem_file_dir, \
+                        _find_memory_backed_dir
+
+class MockPendingMessage(object):
+  def __init__(self):
+    self.text = []
+
+  def update(self, text):
+    self.text = text
+
+class BoundedLogTest(unittest.TestCase):
+  def testSmall(self):
+    log = _BoundedLog(10)
+    self.assertEquals("", log.getvalue())
+    log.write("foo")
+    log.write("bar")
+    self.assertEquals("foobar", log.getvalue())
+
+  def testOverflow(self):
+    log = _BoundedLog(10)
+    for i in range(100):
+      log.write("%d," % i)
+    self.assertEquals("[280 bytes of output omitted]\n,97,98,99,",
+                      log.getvalue())
+    log.write("x")
+    self.assertEquals("[281 bytes of output omitted]\n97,98,99,x",
+                      log.getvalue())
+
+class MemoryBackedDirTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def testFind(self):
+    missing = os.path.join(self.dir, "missing")
+    self.assertEquals(None, _find_memory_backed_dir([missing]))
+    self.assertEquals(self.dir, _find_memory_backed_dir([missing, self.dir]))
+    self.assertEquals([], os.listdir(self.dir))
+
+  def testAllowsExec(self):
+    self.assertTrue(_allows_exec(self.dir))
+    self.assertFalse(_allows_exec(os.path.join(self.dir, "missing")))
+
+  def testFreeSpace(self):
+    self.assertEquals(None, _choose_mem_file_dir(None, 0))
+    self.assertEquals(self.dir, _choose_mem_file_dir(self.dir, 1))
+    # Falls back to the system temp directory when there isn't enough room.
+    self.assertEquals(None, _choose_mem_file_dir(self.dir, 1 << 62))
+
+class WorkerPoolTest(unittest.TestCase):
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def testStartedByRequest(self):
+    # A "worker" which just notes that it was started.
+    marker = os.path.join(self.dir, "started")
+    program = os.path.join(self.dir, "worker")
+    file = open(program, "w")
+    file.write("#! /bin/sh\ntouch %s\n" % marker)
+    file.close()
+    os.chmod(program, 0755)
+
+    pool = _WorkerPool()
+    (key, worker) = pool.acquire(program, None, self.dir)
+    self.assertFalse(os.path.exists(marker))
+
+    self.assertRaises(_WorkerError, worker.request, [], self.dir)
+    self.assertTrue(os.path.exists(marker))
+    self.assertEquals(0, worker.returncode())
+    pool.discard(worker)
+
+  def testMissingProgram(self):
+    pool = _WorkerPool()
+    (key, worker) = pool.acquire(os.path.join(self.dir, "missing"), None,
+                                 self.dir)
+    self.assertRaises(_WorkerError, worker.request, [], self.dir)
+    self.assertEquals(None, worker.returncode())
+    pool.discard(worker)
+    pool.shutdown()
+
+class CommandContextImplTest(unittest.TestCase):
+  def setUp(self):
+    self.lock = threading.Lock()
+    self.lock.acquire()
+    self.context = _CommandContextImpl(
+        VirtualDirectory(), MockPendingMessage(), False, {}, self.lock)
+
+  def tearDown(self):
+    self.lock.release()
+
+  def testStreaming(self):
+    log = cStringIO.StringIO()
+    (exit_code, stdout, stderr) = self.context.subprocess(
+        ["sh", "-c", "echo out; echo err >&2; exit 3"],
+        stdout = log, stderr = subprocess.STDOUT)
+    self.assertEquals(3, exit_code)
+    self.assertTrue(stdout is None)
+    self.assertTrue(stderr is None)
+    self.assertEquals("out\nerr\n", log.getvalue())
+
+    # Streams can be mixed with pipes and input.
+    log = cStringIO.StringIO()
+    (exit_code, stdout, stderr) = self.context.subprocess(
+        ["sh", "-c", "cat; echo err >&2"],
+        stdin = "in\n", stdout = subprocess.PIPE, stderr = log)
+    self.assertEquals(0, exit_code)
+    self.assertEquals("in\n", stdout)
+    self.assertTrue(stderr is None)
+    self.assertEquals("err\n", log.getvalue())
+
+  def testBoundedMemory(self):
+    log = _BoundedLog(1000)
+    (exit_code, stdout, stderr) = self.context.subprocess(
+        ["sh", "-c", "head -c 10000000 /dev/zero"],
+        stdout = log, stderr = subprocess.STDOUT)
+    self.assertEquals(0, exit_code)
+    self.assertEquals("[9999000 bytes of output omitted]\n" + "\0" * 1000,
+                      log.getvalue())
+
+    self.assertTrue(self.context.usage.wall_time > 0)
+
+if __name__ == "__main__":
+  unittest.main()
@@ -31,6 +31,7 @@
 
 import os
 import pipes
+import re
 
 from sebs.command import Command, ScriptWriter
 from sebs.core import Action, Artifact, Rule, Test
@@ -136,6 +137,26 @@ function write_to_cache() {
   eval "echo $1=\$$1 >> $script_name.cache"
 }
 
+# Usage:  is_dirty OUTPUTS... -- INPUTS...
+# Succeeds if any output is missing or any input is newer than the oldest
+# output.  Uses only shell builtins, and looks at each file once.
+function is_dirty() {
+  local oldest=
+  while test "$1" != --; do
+    test -e "$1" || return 0
+    if test -z "$oldest" || test "$1" -ot "$oldest"; then
+      oldest=$1
+    fi
+    shift
+  done
+  shift
+  local input
+  for input in "$@"; do
+    test "$input" -nt "$oldest" && return 0
+  done
+  return 1
+}
+
 if test $do_clean = no; then
   if test -e $script_name.cache; then
     read_cache < $script_name.cache
@@ -153,6 +174,14 @@ _NO_PHASE = 2
 
 _PHASE_NAMES = ["build", "test"]
 
+# In ninja and make files, a variable which the build tool itself expands (as
+# opposed to the shell running a command) is written between these markers
+# until the file is written, so that it isn't escaped along with the "$"s of
+# shell expressions.
+_VARIABLE_START = "\0"
+_VARIABLE_END = "\1"
+_VARIABLE_PATTERN = re.compile("\0([A-Za-z0-9_]*)\1")
+
 def _canonicalize_artifact(artifact):
   while artifact.alt_artifact is not None:
     if artifact.alt_config != "host":
@@ -177,22 +206,37 @@ class _ScriptActionState(object):
     self.inputs = set()
     self.input_names = set()
 
-    # Set of artifacts which are built by this action.
+    # Set of artifacts which are built by this action.  output_names is in
+    # the order the outputs were reported.
     self.outputs = set()
-    self.output_names = set()
+    self.output_names = []
     self.output_vars = set()
 
+    # Names of files the action writes listing further inputs, e.g. headers.
+    self.dep_files = []
+
     self.status_expression = None
 
     self.phase = _NO_PHASE
 
 class _ScriptStateMap(object):
-  def __init__(self):
+  def __init__(self, files_only, prefix):
     self.__actions = {}
 
     # Maps actions to variable names.
     self.__mem_vars = {}
 
+    # If true, memory artifacts are stored in files rather than in shell
+    # variables, because each action runs in a shell of its own.
+    self.files_only = files_only
+
+    # Expression prepended to the names of files which aren't sources.
+    self.prefix = prefix
+
+    # Names of environment variables which file names depend on.  Only used
+    # if files_only is true.
+    self.name_variables = set()
+
   def action_state(self, action):
     typecheck(action, Action)
 
@@ -221,7 +265,7 @@ class _ScriptWriterImpl(ScriptWriter):
     self.__action_state.commands.append(text)
 
   def echo_expression(self, expression, output_artifact):
-    if output_artifact.filename.startswith("mem/"):
+    if self.__is_variable(output_artifact):
       self.add_output(output_artifact)
       varname = self.__state_map.varname(output_artifact)
       return "%s=%s" % (varname, expression)
@@ -234,8 +278,7 @@ class _ScriptWriterImpl(ScriptWriter):
     if artifact not in self.__action_state.inputs:
       self.__action_state.inputs.add(artifact)
 
-      if not artifact.filename.startswith("mem/") and \
-         not artifact.filename.startswith("env/"):
+      if self.__is_file(artifact):
         self.__action_state.input_names.add(
           self.artifact_filename_expression(artifact))
 
@@ -243,13 +286,17 @@ class _ScriptWriterImpl(ScriptWriter):
     if artifact not in self.__action_state.outputs:
       self.__action_state.outputs.add(artifact)
 
-      if artifact.filename.startswith("mem/"):
+      if self.__is_variable(artifact):
         self.__action_state.output_vars.add(
             self.__state_map.varname(artifact))
-      elif not artifact.filename.startswith("env/"):
-        self.__action_state.output_names.add(
+      elif self.__is_file(artifact):
+        self.__action_state.output_names.append(
             self.artifact_filename_expression(artifact))
 
+  def add_dep_file(self, artifact):
+    self.__action_state.dep_files.append(
+        self.artifact_filename_expression(artifact))
+
   def artifact_filename_expression(self, artifact):
     artifact = _canonicalize_artifact(artifact)
     if artifact.action is self.__action_state.action:
@@ -257,8 +304,7 @@ class _ScriptWriterImpl(ScriptWriter):
     else:
       self.add_input(artifact)
 
-    if artifact.filename.startswith("mem/") or \
-       artifact.filename.startswith("env/"):
+    if not self.__is_file(artifact):
       raise NotImplementedError("Moving memory artifacts to disk in scripts.")
 
     if artifact.configured_name is None:
@@ -270,7 +316,10 @@ class _ScriptWriterImpl(ScriptWriter):
       parts = []
       for part in artifact.configured_name:
         if isinstance(part, Artifact):
-          parts.append(self.artifact_content_expression(part))
+          if self.__state_map.files_only:
+            parts.append(self.__name_variable(part))
+          else:
+            parts.append(self.artifact_content_expression(part))
         else:
           parts.append(pipes.quote(part))
       filename = "".join(parts)
@@ -278,12 +327,12 @@ class _ScriptWriterImpl(ScriptWriter):
     if filename.startswith("src"):
       return filename
     else:
-      return "${prefix}" + filename
+      return self.__state_map.prefix + filename
 
   def artifact_content_expression(self, artifact):
     artifact = _canonicalize_artifact(artifact)
     self.add_input(artifact)
-    if artifact.filename.startswith("mem/"):
+    if self.__is_variable(artifact):
       varname = self.__state_map.varname(artifact)
       return "${%s}" % varname
     elif artifact.filename.startswith("env/set/"):
@@ -292,6 +341,10 @@ class _ScriptWriterImpl(ScriptWriter):
              artifact.filename[8:]
     elif artifact.filename.startswith("env/"):
       return "${%s}" % artifact.filename[4:]
+    elif self.__state_map.files_only:
+      # $(<file) is a bash extension, and make and ninja run commands with
+      # plain sh.
+      return "$(cat %s)" % self.artifact_filename_expression(artifact)
     else:
       return "$(<%s)" % self.artifact_filename_expression(artifact)
 
@@ -301,7 +354,7 @@ class _ScriptWriterImpl(ScriptWriter):
     if dir.startswith("src"):
       return dir
     else:
-      return "${prefix}" + dir
+      return self.__state_map.prefix + dir
 
   def set_status(self, status_expression):
     self.__action_state.status_expression = status_expression
@@ -315,9 +368,51 @@ class _ScriptWriterImpl(ScriptWriter):
   def leave_conditional(self):
     raise NotImplementedError
 
+  def __is_variable(self, artifact):
+    return artifact.filename.startswith("mem/") and \
+           not self.__state_map.files_only
+
+  def __is_file(self, artifact):
+    return not artifact.filename.startswith("env/") and \
+           not self.__is_variable(artifact)
+
+  def __name_variable(self, artifact):
+    """Returns a reference to a build tool variable standing for the contents
+    of |artifact|, which must be an environment variable."""
+
+    artifact = _canonicalize_artifact(artifact)
+    if not artifact.filename.startswith("env/") or \
+       artifact.filename.startswith("env/set/"):
+      raise NotImplementedError(
+          "File names depending on built artifacts in ninja or make files.")
+    name = artifact.filename[4:]
+    self.__state_map.name_variables.add(name)
+    return _VARIABLE_START + name + _VARIABLE_END
+
 class ScriptBuilder(object):
-  def __init__(self):
-    self.__state_map = _ScriptStateMap()
+  """Collects actions and writes them out as a shell script, a ninja file,
+  or a Makefile, according to |format|, which is one of FORMATS.
+
+  The shell script runs every action itself, one at a time.  Ninja and make
+  files instead let those tools run actions in parallel and track
+  dependencies, including the headers listed in dep files.  Since each of
+  their actions runs in a separate shell, in-memory artifacts are written to
+  files.  Environment variables which file names depend on (e.g. EXEEXT)
+  become variables of the generated file, defaulting to their values when it
+  was generated."""
+
+  FORMATS = ["sh", "ninja", "make"]
+
+  def __init__(self, format = "sh"):
+    typecheck(format, basestring)
+    if format not in ScriptBuilder.FORMATS:
+      raise ValueError("Unknown script format: %s" % format)
+
+    self.__format = format
+    if format == "sh":
+      self.__state_map = _ScriptStateMap(False, "${prefix}")
+    else:
+      self.__state_map = _ScriptStateMap(True, "")
     self.__phases = []
     for _ in xrange(len(_PHASE_NAMES)):
       self.__phases.append([])
@@ -355,6 +450,14 @@ class ScriptBuilder(object):
     self.__add_artifact(test.test_output_artifact, _TEST_PHASE)
 
   def write(self, out):
+    if self.__format == "ninja":
+      self.__write_ninja(out)
+    elif self.__format == "make":
+      self.__write_make(out)
+    else:
+      self.__write_sh(out)
+
+  def __write_sh(self, out):
     made_dirs = set()
 
     out.write(_SCRIPT_INTRO)
@@ -376,9 +479,11 @@ class ScriptBuilder(object):
     action = action_state.action
 
     dirty_tests = []
-    for input in action_state.input_names:
-      for output in action_state.output_names:
-        dirty_tests.append("test %s -nt %s" % (input, output))
+    if action_state.input_names and action_state.output_names:
+      # One name per line, so the script grows linearly with the graph.
+      dirty_tests.append(" \\\n         ".join(
+          ["is_dirty"] + action_state.output_names + ["--"] +
+          sorted(action_state.input_names)))
     for output_var in action_state.output_vars:
       dirty_tests.append("test -z \"${%s+set}\"" % output_var)
     if dirty_tests:
@@ -413,3 +518,169 @@ class ScriptBuilder(object):
     if dirty_tests:
       out.write("  fi\n")
     out.write("\n")
+
+  def __phase_outputs(self, phase):
+    result = []
+    for action_state in self.__phases[phase]:
+      result.extend(_main_output_first(action_state))
+    return result
+
+  def __variable_defaults(self):
+    return [(name, os.environ.get(name, ""))
+            for name in sorted(self.__state_map.name_variables)]
+
+  def __write_ninja(self, out):
+    out.write(_NINJA_INTRO)
+
+    for name, value in self.__variable_defaults():
+      out.write("%s = %s\n" % (name, _ninja_escape(value)))
+    out.write("\n")
+
+    for phase in xrange(len(self.__phases)):
+      out.write("# %s phase\n\n" % _PHASE_NAMES[phase])
+      for action_state in self.__phases[phase]:
+        self.__write_ninja_action(action_state, out)
+
+    # As in the shell script, testing implies building.
+    previous_phases = []
+    for phase in xrange(len(self.__phases)):
+      out.write("build %s: phony %s\n" % (_PHASE_NAMES[phase],
+          " ".join(previous_phases +
+                   [_ninja_escape_path(name)
+                    for name in self.__phase_outputs(phase)])))
+      previous_phases.append(_PHASE_NAMES[phase])
+    out.write("\ndefault build\n")
+
+  def __write_ninja_action(self, action_state, out):
+    outputs = _main_output_first(action_state)
+    if len(outputs) == 0:
+      return
+    if len(action_state.dep_files) > 1:
+      raise NotImplementedError("Actions with several dep files in ninja.")
+
+    out.write("build %s: run %s\n" % (
+        " ".join([_ninja_escape_path(name) for name in outputs]),
+        " ".join([_ninja_escape_path(name)
+                  for name in sorted(action_state.input_names)])))
+    out.write("  command = %s\n" % _ninja_escape(
+        _join_commands(action_state.commands)))
+    out.write("  description = %s\n" % _ninja_escape(
+        "%s: %s" % (action_state.action.verb, action_state.action.name)))
+    if len(action_state.dep_files) > 0:
+      out.write("  depfile = %s\n" %
+                _ninja_escape_path(action_state.dep_files[0]))
+    out.write("\n")
+
+  def __write_make(self, out):
+    out.write(_MAKE_INTRO)
+
+    for name, value in self.__variable_defaults():
+      out.write("%s ?= %s\n" % (name, _make_escape(value)))
+    out.write("\n")
+
+    # As in the shell script, testing implies building.
+    previous_phases = []
+    for phase in xrange(len(self.__phases)):
+      out.write("%s: %s\n" % (_PHASE_NAMES[phase],
+          " ".join(previous_phases +
+                   [_make_escape(name)
+                    for name in self.__phase_outputs(phase)])))
+      previous_phases.append(_PHASE_NAMES[phase])
+    out.write("\n")
+
+    dep_files = []
+    for phase in xrange(len(self.__phases)):
+      out.write("# %s phase\n\n" % _PHASE_NAMES[phase])
+      for action_state in self.__phases[phase]:
+        self.__write_make_action(action_state, out)
+        dep_files.extend(action_state.dep_files)
+
+    # Dep files don't exist until their actions have run once, hence "-".
+    for dep_file in dep_files:
+      out.write("-include %s\n" % _make_escape(dep_file))
+
+  def __write_make_action(self, action_state, out):
+    # Make has no portable way to say that one recipe builds several files,
+    # so the rest of the outputs depend on the first one.
+    outputs = _main_output_first(action_state)
+    if len(outputs) == 0:
+      return
+
+    out.write("%s: %s\n" % (_make_escape(outputs[0]),
+        " ".join([_make_escape(name)
+                  for name in sorted(action_state.input_names)])))
+    out.write("\t@echo %s\n" % _make_escape(pipes.quote(
+        "%s: %s" % (action_state.action.verb, action_state.action.name))))
+    dirs = set([os.path.dirname(name) for name in outputs])
+    dirs.discard("")
+    if len(dirs) > 0:
+      out.write("\t@mkdir -p %s\n" %
+                " ".join([_make_escape(dir) for dir in sorted(dirs)]))
+    for command in action_state.commands:
+      _check_single_line(command)
+      out.write("\t%s\n" % _make_escape(command))
+    for output in outputs[1:]:
+      out.write("%s: %s ;\n" % (_make_escape(output), _make_escape(outputs[0])))
+    out.write("\n")
+
+_NINJA_INTRO = """# Generated by SEBS.  DO NOT EDIT!
+#
+# This file is generated by SEBS (the Scalable Extendable Build System) to
+# allow this package to be built with ninja when SEBS is unavailable.  Run
+# "ninja" to build and "ninja test" to run the tests.
+
+ninja_required_version = 1.3
+
+rule run
+  command = $command
+  description = $description
+
+"""
+
+_MAKE_INTRO = """# Generated by SEBS.  DO NOT EDIT!
+#
+# This file is generated by SEBS (the Scalable Extendable Build System) to
+# allow this package to be built with make when SEBS is unavailable.  Run
+# "make" to build and "make test" to run the tests.
+
+.DELETE_ON_ERROR:
+.PHONY: all build test
+all: build
+
+"""
+
+def _main_output_first(action_state):
+  """Returns the names of the action's outputs, starting with the one its
+  dep files (if any) list the dependencies of -- i.e. any but a dep file.
+  Ninja and make both need that to come first."""
+
+  return [name for name in action_state.output_names
+          if name not in action_state.dep_files] + \
+         [name for name in action_state.output_names
+          if name in action_state.dep_files]
+
+def _check_single_line(command):
+  if "\n" in command:
+    raise NotImplementedError(
+        "Commands spanning several lines in ninja or make files.")
+
+def _join_commands(commands):
+  """Joins commands into one shell command which stops at the first failure.
+  Each is wrapped in braces, since it may be a list of its own."""
+
+  for command in commands:
+    _check_single_line(command)
+  return " && ".join(["{ %s; }" % command for command in commands])
+
+def _expand_variables(text):
+  return _VARIABLE_PATTERN.sub(r"${\1}", text)
+
+def _ninja_escape(text):
+  return _expand_variables(text.replace("$", "$$"))
+
+def _ninja_escape_path(text):
+  return _expand_variables(
+      text.replace("$", "$$").replace(" ", "$ ").replace(":", "$:"))
+
+def _make_escape(text):
+  return _expand_variables(text.replace("$", "$$"))
@@ -0,0 +1,240 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+import unittest
+import cStringIO
+
+from sebs.core import Artifact, Action, Rule, Context
+from sebs.command import EchoCommand, SubprocessCommand, DepFileCommand
+from sebs.filesystem import DiskDirectory
+from sebs.loader import Loader
+from sebs.script import ScriptBuilder
+
+class MockContext(Context):
+  def __init__(self, filename, full_filename):
+    super(MockContext, self).__init__()
+    self.filename = filename
+    self.full_filename = full_filename
+    self.timestamp = 0
+
+class MockRule(Rule):
+  def _expand(self, args):
+    pass
+
+class ScriptBuilderTest(unittest.TestCase):
+  def setUp(self):
+    self.rule = MockRule(MockContext("mock.sebs", "src/mock.sebs"))
+
+    flags_action = Action(self.rule, "configure", "flags")
+    flags = Artifact("mem/flags", flags_action)
+    flags_action.set_command(EchoCommand("-O2", flags))
+
+    source = Artifact("src/foo.c", None)
+    compile_action = Action(self.rule, "compile", "foo.c")
+    object = Artifact("tmp/foo.o", compile_action)
+    dep_file = Artifact("tmp/foo.d", compile_action)
+    compile_action.set_command(DepFileCommand(
+        SubprocessCommand(compile_action,
+                          ["cc", flags.contents(), "-MD", "-c", source,
+                           "-o", object],
+                          implicit = [dep_file]),
+        dep_file))
+
+    exeext = Artifact("env/EXEEXT", None)
+    link_action = Action(self.rule, "link", "foo")
+    binary = Artifact("bin/foo", link_action,
+                      configured_name = ["bin/foo", exeext])
+    link_action.set_command(
+        SubprocessCommand(link_action, ["cc", "-o", binary, object]))
+
+    self.rule.outputs = [binary]
+
+  def write(self, format):
+    builder = ScriptBuilder(format)
+    builder.add_rule(self.rule)
+    out = cStringIO.StringIO()
+    builder.write(out)
+    return out.getvalue()
+
+  def testNinja(self):
+    text = self.write("ninja")
+
+    # Memory artifacts are files, and shell "$"s are escaped.
+    self.assertTrue(
+        "build mem/flags: run \n"
+        "  command = { echo -O2 > mem/flags; }\n"
+        "  description = configure: flags\n" in text)
+    self.assertTrue(
+        "build tmp/foo.o tmp/foo.d: run mem/flags src/foo.c\n"
+        "  command = { cc $$(cat mem/flags) -MD -c src/foo.c -o tmp/foo.o; }\n"
+        "  description = compile: foo.c\n"
+        "  depfile = tmp/foo.d\n" in text)
+
+    # Environment variables in file names are ninja variables.
+    self.assertTrue("\nEXEEXT = " in text)
+    self.assertTrue(
+        "build bin/foo${EXEEXT}: run tmp/foo.o\n"
+        "  command = { cc -o bin/foo${EXEEXT} tmp/foo.o; }\n" in text)
+
+    self.assertTrue(
+        "build build: phony mem/flags tmp/foo.o tmp/foo.d bin/foo${EXEEXT}\n"
+        in text)
+    self.assertTrue("build test: phony build\n" in text)
+
+  def testMake(self):
+    text = self.write("make")
+
+    self.assertTrue("\nEXEEXT ?= " in text)
+    self.assertTrue(
+        "build: mem/flags tmp/foo.o tmp/foo.d bin/foo${EXEEXT}\n" in text)
+    self.assertTrue(
+        "tmp/foo.o: mem/flags src/foo.c\n"
+        "\t@echo 'compile: foo.c'\n"
+        "\t@mkdir -p tmp\n"
+        "\tcc $$(cat mem/flags) -MD -c src/foo.c -o tmp/foo.o\n"
+        "tmp/foo.d: tmp/foo.o ;\n" in text)
+    self.assertTrue("\n-include tmp/foo.d\n" in text)
+
+  def testShell(self):
+    text = self.write("sh")
+
+    # The shell script keeps memory artifacts in variables.
+    self.assertTrue("mem_0_flags=-O2\n" in text)
+    self.assertTrue("-o ${prefix}bin/foo${EXEEXT} ${prefix}tmp/foo.o\n" in text)
+
+    # Each input and output is checked once, not once per pair.
+    self.assertTrue(
+        "  if is_dirty \\\n"
+        "         ${prefix}tmp/foo.d \\\n"
+        "         ${prefix}tmp/foo.o \\\n"
+        "         -- \\\n"
+        "         src/foo.c; then\n" in text)
+
+class RuleFileTestCase(unittest.TestCase):
+  """Loads sebs files which use this package's own rule files."""
+
+  def setUp(self):
+    self.dir = tempfile.mkdtemp()
+    sebs_dir = os.path.dirname(os.path.abspath(__file__))
+    os.makedirs(os.path.join(self.dir, "src", "sebs"))
+    for name in os.listdir(sebs_dir):
+      if name.endswith(".sebs"):
+        shutil.copy(os.path.join(sebs_dir, name),
+                    os.path.join(self.dir, "src", "sebs", name))
+
+  def tearDown(self):
+    shutil.rmtree(self.dir)
+
+  def load(self, content):
+    """Returns src/foo/foo.sebs, containing |content|."""
+
+    os.makedirs(os.path.join(self.dir, "src", "foo"))
+    file = open(os.path.join(self.dir, "src", "foo", "foo.sebs"), "w")
+    file.write(content)
+    file.close()
+    return Loader(DiskDirectory(self.dir)).load("foo/foo.sebs")
+
+def write_script(format, rule = None, test = None):
+  builder = ScriptBuilder(format)
+  if rule is not None:
+    builder.add_rule(rule)
+  if test is not None:
+    builder.add_test(test)
+  out = cStringIO.StringIO()
+  builder.write(out)
+  return out.getvalue()
+
+class ShardedTestScriptTest(RuleFileTestCase):
+  def setUp(self):
+    super(ShardedTestScriptTest, self).setUp()
+    self.test = self.load("""
+_python = sebs.import_("//sebs/python.sebs")
+foo_test = _python.Test(main = "foo_test.py", shard_count = 2)
+""").foo_test
+
+  def write(self, format):
+    return write_script(format, test = self.test)
+
+  def testNinja(self):
+    text = self.write("ninja")
+    self.assertTrue("\n  command = { sh -c 'status=0; " in text)
+    self.assertTrue("  description = merge: src/foo/foo_test.py\n" in text)
+
+  def testMake(self):
+    text = self.write("make")
+    self.assertTrue("\t@echo 'merge: src/foo/foo_test.py'\n" in text)
+    self.assertTrue("\tsh -c 'status=0; " in text)
+    # Each shard runs only its own cases.
+    self.assertTrue(
+        "\tTEST_SHARD_INDEX=1 TEST_TOTAL_SHARDS=2 "
+        "python src/sebs/run_python_test.py src/foo/foo_test.py " in text)
+
+class SharedLibraryScriptTest(RuleFileTestCase):
+  def setUp(self):
+    super(SharedLibraryScriptTest, self).setUp()
+    self.binary = self.load("""
+_cpp = sebs.import_("//sebs/cpp.sebs")
+foo = _cpp.Library(name = "foo", srcs = ["foo.cc"], shared = True)
+bar = _cpp.Binary(name = "bar", srcs = ["bar.cc"], deps = [foo])
+""").bar
+
+  def testFormats(self):
+    for format in ["sh", "ninja", "make"]:
+      text = write_script(format, rule = self.binary)
+      self.assertTrue("-DP --defined-only " in text, format)
+      self.assertTrue("cut -d ' ' -f1,2 " in text, format)
+
+class SystemLibraryScriptTest(RuleFileTestCase):
+  def testDuplicatesLinkedOnce(self):
+    # Each SystemLibrary rule naming a library is a separate object.
+    binary = self.load("""
+_cpp = sebs.import_("//sebs/cpp.sebs")
+def _system_libs():
+  return [_cpp.SystemLibrary(name = "m"), _cpp.SystemLibrary(name = "pthread")]
+foo = _cpp.Library(srcs = ["foo.cc"], deps = _system_libs())
+bar = _cpp.Binary(name = "bar", srcs = ["bar.cc"], deps = [foo] + _system_libs())
+""").bar
+
+    text = write_script("sh", rule = binary)
+    link = [line.split() for line in text.split("\n")
+            if "-o ${prefix}bin/foo/bar${EXEEXT}" in line]
+    self.assertEquals(1, len(link))
+    self.assertEquals(["${prefix}tmp/foo/libfoo.a", "-lm", "-lpthread"],
+                      link[0][-3:])
+    self.assertEquals(1, link[0].count("-lm"))
+    self.assertEquals(1, link[0].count("-lpthread"))
+
+if __name__ == "__main__":
+  unittest.main()
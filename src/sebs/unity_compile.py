@@ -0,0 +1,257 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Compiles a batch of C++ sources as a single "unity" translation unit.
+
+Usage:
+  unity_compile.py -o OBJECT -d DEPFILE [-l LINKER] -- COMPILER... -- SOURCES
+
+COMPILER is the compiler command and flags.  OBJECT receives the compiled
+code for all of SOURCES, and DEPFILE a make-style list of the files it was
+compiled from.
+
+Compiling many sources as one translation unit saves parsing headers they
+share over and over, but means editing any one of them recompiles them all.
+So, sources which have been edited since the last time this batch was
+compiled are split out and compiled individually, and the pieces are combined
+with "LINKER -r" (default: ld).  A source stays split out as long as the
+compiler command stays the same, so that repeatedly editing it and rebuilding
+only recompiles that one file.  The parts are kept in OBJECT.parts, alongside
+OBJECT.state which records what was done last time.
+
+With -gsplit-dwarf, the batch is always compiled in one piece, so that the
+compiler writes its debug info to the .dwo file next to OBJECT rather than to
+one per part.
+"""
+
+import getopt
+import json
+import os
+import shutil
+import subprocess
+import sys
+
+class UsageError(Exception):
+  pass
+
+def _getmtime(filename):
+  try:
+    return os.path.getmtime(filename)
+  except os.error:
+    return None
+
+def _read_depfile(filename):
+  """Returns the list of dependencies in a make-style depfile, or None if it
+  doesn't exist."""
+
+  if not os.path.exists(filename):
+    return None
+  file = open(filename, "rU")
+  text = file.read().replace("\\\n", " ")
+  file.close()
+  return [part for part in text.split() if not part.endswith(":")]
+
+def _write_if_changed(filename, content):
+  if os.path.exists(filename):
+    file = open(filename, "rb")
+    unchanged = file.read() == content
+    file.close()
+    if unchanged:
+      return
+  file = open(filename, "wb")
+  file.write(content)
+  file.close()
+
+def _run_command(command):
+  """Runs a command, forwarding its output to ours.  (We may be running as a
+  persistent worker, in which case our real stdout is not for the compiler.)"""
+
+  proc = subprocess.Popen(command, stdout = subprocess.PIPE,
+                          stderr = subprocess.STDOUT)
+  output = proc.communicate()[0]
+  sys.stderr.write(output)
+  return proc.returncode == 0
+
+class _Part(object):
+  """One separately-compiled piece of the batch."""
+
+  def __init__(self, object, sources, unity_source = None):
+    self.object = object
+    self.depfile = os.path.splitext(object)[0] + ".d"
+    self.sources = sources
+    self.unity_source = unity_source
+
+  def compile(self, compiler, force):
+    if self.unity_source is not None:
+      # A unity source file includes each real source file.
+      _write_if_changed(self.unity_source, "".join(
+          ["#include \"%s\"\n" % os.path.abspath(source)
+           for source in self.sources]))
+      source = self.unity_source
+    else:
+      source = self.sources[0]
+
+    if not force and self.__is_up_to_date():
+      return True
+    return _run_command(compiler + ["-MD", "-MF", self.depfile,
+                            "-c", source, "-o", self.object])
+
+  def __is_up_to_date(self):
+    object_mtime = _getmtime(self.object)
+    deps = _read_depfile(self.depfile)
+    if object_mtime is None or deps is None:
+      return False
+    for dep in deps:
+      mtime = _getmtime(dep)
+      if mtime is None or mtime > object_mtime:
+        return False
+    return True
+
+  def deps(self):
+    return _read_depfile(self.depfile) or []
+
+def main(argv):
+  try:
+    opts, args = getopt.getopt(argv[1:], "ho:d:l:", ["help"])
+  except getopt.error, message:
+    raise UsageError(message)
+
+  output = None
+  depfile = None
+  linker = "ld"
+
+  for name, value in opts:
+    if name in ("-h", "--help"):
+      print __doc__
+      return 0
+    elif name == "-o":
+      output = value
+    elif name == "-d":
+      depfile = value
+    elif name == "-l":
+      linker = value
+
+  if output is None:
+    raise UsageError("Missing required flag -o.")
+  if depfile is None:
+    raise UsageError("Missing required flag -d.")
+  if "--" not in args:
+    raise UsageError("Expected: COMPILER... -- SOURCES")
+  separator = args.index("--")
+  compiler = args[:separator]
+  sources = args[separator + 1:]
+
+  state_file = output + ".state"
+  parts_dir = output + ".parts"
+
+  state = None
+  if os.path.exists(state_file):
+    file = open(state_file, "rb")
+    state = json.load(file)
+    file.close()
+    if state.get("compiler") != compiler:
+      # Flags changed, so nothing from last time is any good.
+      state = None
+
+  # Decide which sources to split out.
+  if state is None or "-gsplit-dwarf" in compiler:
+    split = []
+  else:
+    split = [source for source in sources
+             if source in state["split"] or
+                (source in state["mtimes"] and
+                 _getmtime(source) != state["mtimes"][source])]
+
+  if len(split) == 0:
+    parts = [_Part(output, sources, output + ".unity.cc")]
+    if os.path.exists(parts_dir):
+      shutil.rmtree(parts_dir)
+  else:
+    if not os.path.exists(parts_dir):
+      os.makedirs(parts_dir)
+    parts = []
+    rest = [source for source in sources if source not in split]
+    if len(rest) > 0:
+      parts.append(_Part(os.path.join(parts_dir, "unity.o"), rest,
+                         os.path.join(parts_dir, "unity.cc")))
+    for source in split:
+      name = os.path.basename(os.path.splitext(source)[0])
+      # Disambiguate sources with the same basename.
+      name = "%d_%s.o" % (sources.index(source), name)
+      parts.append(_Part(os.path.join(parts_dir, name), [source]))
+
+  for part in parts:
+    # If the batch is compiled in one piece, the fact that we're running at
+    # all means it is out-of-date.
+    force = state is None or part.object == output
+    if not part.compile(compiler, force):
+      return 1
+
+  if len(parts) > 1 or parts[0].object != output:
+    if not _run_command([linker, "-r", "-o", output] +
+                [part.object for part in parts]):
+      return 1
+
+  # Write the combined dependency list.
+  deps = []
+  seen = set()
+  for part in parts:
+    for dep in part.deps():
+      if dep not in seen:
+        seen.add(dep)
+        deps.append(dep)
+  file = open(depfile, "wb")
+  file.write("%s: %s\n" % (output, " \\\n  ".join(deps)))
+  file.close()
+
+  file = open(state_file, "wb")
+  json.dump({"compiler": compiler,
+             "split": split,
+             "mtimes": dict([(source, _getmtime(source))
+                             for source in sources])}, file)
+  file.close()
+
+  return 0
+
+def _run(argv):
+  try:
+    return main(argv)
+  except UsageError, error:
+    print >>sys.stderr, error.message
+    print >>sys.stderr, "for help use --help"
+    return 2
+
+if __name__ == "__main__":
+  if "--persistent_worker" in sys.argv[1:]:
+    from sebs import worker
+    sys.exit(worker.run_worker(_run))
+  sys.exit(_run(sys.argv))
@@ -0,0 +1,151 @@
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+"""Support for running tools as persistent workers.
+
+Starting a new process for every action is expensive for tools with a slow
+start-up, such as those written in Python, where interpreter start-up and
+module imports often take longer than the actual work.  A tool may instead
+declare itself worker-capable (see SubprocessCommand's "worker" parameter), in
+which case SEBS starts it once with the flag --persistent_worker and then
+sends it any number of requests over stdin, reading responses from stdout.
+
+Each request and each response is a JSON object on a single line.  Requests
+look like:
+  {"arguments": ["-o", "foo", "bar"], "cwd": "some/dir"}
+where "arguments" are the command-line arguments, not including the program
+name, and "cwd" is the directory to run in, or null for the directory in which
+the worker was started.  Responses look like:
+  {"exit_code": 0, "stdout": "...", "stderr": "..."}
+Since JSON strings are Unicode, stdout and stderr are byte strings decoded as
+Latin-1, which round-trips arbitrary bytes.
+
+A worker should exit when it reaches EOF on stdin.  Workers see the
+environment they were started with; SEBS only shares a worker between commands
+run with the same environment.
+
+For Python tools whose entry point is a function taking argv and returning an
+exit code, run_worker() implements the whole protocol:
+
+  if __name__ == "__main__":
+    if sebs.worker.is_worker_invocation(sys.argv):
+      sys.exit(sebs.worker.run_worker(main))
+    sys.exit(main(sys.argv))
+"""
+
+import cStringIO
+import json
+import os
+import signal
+import sys
+import traceback
+
+WORKER_FLAG = "--persistent_worker"
+
+def is_worker_invocation(argv):
+  """Returns true if the program was started as a persistent worker."""
+
+  return WORKER_FLAG in argv[1:]
+
+def encode_request(arguments, cwd):
+  return json.dumps({"arguments": arguments, "cwd": cwd}) + "\n"
+
+def decode_response(line):
+  """Parses a response line, returning (exit_code, stdout, stderr)."""
+
+  response = json.loads(line)
+  return (response["exit_code"],
+          response["stdout"].encode("latin-1"),
+          response["stderr"].encode("latin-1"))
+
+def run_worker(main, input=None, output=None):
+  """Serves requests from |input| (default: stdin), writing responses to
+  |output| (default: stdout), until EOF.  For each request, sys.argv is set to
+  the request's arguments, sys.stdout and sys.stderr are captured, and
+  main(sys.argv) is called.  Its return value, or the code passed to
+  sys.exit(), is the exit code.  Uncaught exceptions are printed to the
+  captured stderr and result in exit code 1."""
+
+  if input is None:
+    input = sys.stdin
+    # Die from ctrl+C the same way a normal tool would, so that SEBS can tell
+    # the build was interrupted rather than that the worker crashed.
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+  if output is None:
+    output = sys.stdout
+
+  while True:
+    line = input.readline()
+    if line == "":
+      return 0
+    request = json.loads(line)
+    (exit_code, stdout, stderr) = \
+        _handle_request(main, request["arguments"], request.get("cwd"))
+    output.write(json.dumps({"exit_code": exit_code,
+                             "stdout": stdout.decode("latin-1"),
+                             "stderr": stderr.decode("latin-1")}))
+    output.write("\n")
+    output.flush()
+
+def _handle_request(main, arguments, cwd):
+  old_argv = sys.argv
+  old_stdout = sys.stdout
+  old_stderr = sys.stderr
+  old_cwd = os.getcwd()
+
+  stdout = cStringIO.StringIO()
+  stderr = cStringIO.StringIO()
+  sys.argv = [old_argv[0]] + [str(arg) for arg in arguments]
+  sys.stdout = stdout
+  sys.stderr = stderr
+  try:
+    if cwd is not None:
+      os.chdir(cwd)
+    exit_code = main(sys.argv)
+  except SystemExit, e:
+    exit_code = e.code
+  except Exception:
+    traceback.print_exc()
+    exit_code = 1
+  finally:
+    sys.argv = old_argv
+    sys.stdout = old_stdout
+    sys.stderr = old_stderr
+    os.chdir(old_cwd)
+
+  if exit_code is None:
+    exit_code = 0
+  elif not isinstance(exit_code, int):
+    # sys.exit("message") prints the message and exits with status 1.
+    stderr.write("%s\n" % exit_code)
+    exit_code = 1
+
+  return (exit_code, stdout.getvalue(), stderr.getvalue())
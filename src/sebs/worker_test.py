@@ -0,0 +1,121 @@
+#! /usr/bin/python
+# Scalable Extendable Build System
+# Copyright (c) 2009 Kenton Varda and contributors.  All rights reserved.
+# Portions copyright Google, Inc.
+# http://code.google.com/p/sebs
+#
+# Redistribution and use in source and binary forms, with or without
+# modification, are permitted provided that the following conditions are
+# met:
+#
+#     * Redistributions of source code must retain the above copyright
+# notice, this list of conditions and the following disclaimer.
+#     * Redistributions in binary form must reproduce the above
+# copyright notice, this list of conditions and the following disclaimer
+# in the documentation and/or other materials provided with the
+# distribution.
+#     * Neither the name of the SEBS project nor the names of its
+# contributors may be used to endorse or promote products derived from
+# this software without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS
+# "AS IS" AND ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT
+# LIMITED TO, THE IMPLIED WARRANTIES OF MERCHANTABILITY AND FITNESS FOR
+# A PARTICULAR PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL THE COPYRIGHT
+# OWNER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE,
+# DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY
+# THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT
+# (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN ANY WAY OUT OF THE USE
+# OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
+
+import cStringIO
+import json
+import os
+import sys
+import unittest
+
+from sebs.worker import WORKER_FLAG, is_worker_invocation, encode_request, \
+                        decode_response, run_worker
+
+class WorkerTest(unittest.TestCase):
+  def setUp(self):
+    self.calls = []
+
+  def main(self, argv):
+    self.calls.append(list(argv))
+    if argv[1] == "exit":
+      sys.exit(int(argv[2]))
+    elif argv[1] == "exit_message":
+      sys.exit("goodbye")
+    elif argv[1] == "raise":
+      raise ValueError("oops")
+    elif argv[1] == "cwd":
+      print os.getcwd()
+      return 0
+    else:
+      print "out:", " ".join(argv[1:])
+      print >>sys.stderr, "err\xff"
+      return len(argv) - 1
+
+  def run_requests(self, requests):
+    input = cStringIO.StringIO(
+        "".join([encode_request(arguments, cwd)
+                 for arguments, cwd in requests]))
+    output = cStringIO.StringIO()
+    self.assertEqual(0, run_worker(self.main, input, output))
+    lines = output.getvalue().splitlines()
+    self.assertEqual(len(requests), len(lines))
+    return [decode_response(line) for line in lines]
+
+  def testIsWorkerInvocation(self):
+    self.assertTrue(is_worker_invocation(["foo", WORKER_FLAG]))
+    self.assertFalse(is_worker_invocation(["foo", "bar"]))
+    self.assertFalse(is_worker_invocation([WORKER_FLAG]))
+
+  def testRequests(self):
+    old_argv = sys.argv
+    old_stdout = sys.stdout
+    old_stderr = sys.stderr
+
+    responses = self.run_requests([
+        (["foo", "bar"], None),
+        (["exit", "3"], None),
+        (["exit_message"], None),
+        (["raise"], None),
+        (["baz"], None)])
+
+    self.assertEqual((2, "out: foo bar\n", "err\xff\n"), responses[0])
+    self.assertEqual((3, "", ""), responses[1])
+    self.assertEqual((1, "", "goodbye\n"), responses[2])
+    self.assertEqual(1, responses[3][0])
+    self.assertTrue("ValueError: oops" in responses[3][2])
+    self.assertEqual((1, "out: baz\n", "err\xff\n"), responses[4])
+
+    self.assertEqual([[old_argv[0], "foo", "bar"],
+                      [old_argv[0], "exit", "3"],
+                      [old_argv[0], "exit_message"],
+                      [old_argv[0], "raise"],
+                      [old_argv[0], "baz"]], self.calls)
+
+    # Global state must be restored after each request.
+    self.assertTrue(sys.argv is old_argv)
+    self.assertTrue(sys.stdout is old_stdout)
+    self.assertTrue(sys.stderr is old_stderr)
+
+  def testWorkingDirectory(self):
+    old_cwd = os.getcwd()
+    parent = os.path.dirname(old_cwd)
+    responses = self.run_requests([(["cwd"], parent), (["cwd"], None)])
+    self.assertEqual((0, parent + "\n", ""), responses[0])
+    self.assertEqual((0, old_cwd + "\n", ""), responses[1])
+    self.assertEqual(old_cwd, os.getcwd())
+
+  def testEmptyInput(self):
+    output = cStringIO.StringIO()
+    self.assertEqual(0, run_worker(self.main, cStringIO.StringIO(""), output))
+    self.assertEqual("", output.getvalue())
+
+if __name__ == "__main__":
+  unittest.main()